@@ -0,0 +1,205 @@
+# advice_cache.py - Exact + semantic cache for LLM advice, keyed by glucose band, trend and free-text context
+import re
+import threading
+import zlib
+from collections import Counter, OrderedDict
+import numpy as np
+from clock import get_clock
+from config import get_settings
+
+BAND_MGDL = 10  # readings in the same 10 mg/dL band (and same side of the thresholds) share advice
+DIM = 512  # hashed feature space
+MAX_PER_PARTITION = 256  # oldest contexts are evicted beyond this
+MAX_EXACT = 20_000
+
+# Same meaning, different words -> one canonical token before vectorizing
+SYNONYMS = {
+    "supper": "dinner", "evening meal": "dinner", "tea time": "dinner",
+    "lunchtime": "lunch", "midday meal": "lunch",
+    "morning meal": "breakfast",
+    "post": "after", "following": "after", "since": "after",
+    "pre": "before", "prior to": "before", "ahead of": "before",
+    "overnight": "night", "nighttime": "night", "asleep": "sleep", "sleeping": "sleep", "bedtime": "sleep",
+    "workout": "exercise", "gym": "exercise", "running": "exercise", "sport": "exercise", "training": "exercise",
+    "fasted": "fasting", "empty stomach": "fasting",
+    "ill": "sick", "illness": "sick", "fever": "sick",
+    "auto": "automated", "automatic": "automated", "scheduled": "automated",
+}
+# Words that change the clinical meaning: contexts only match when these agree exactly
+# ("before dinner" and "after dinner" are close as strings but not as advice)
+QUALIFIERS = frozenset({"before", "after", "during", "fasting", "night", "sleep", "exercise", "sick",
+                        "breakfast", "lunch", "dinner", "snack", "alcohol", "stress"})
+
+# Filler that carries no clinical meaning ("feeling sick today" = "sick")
+STOPWORDS = frozenset({"a", "an", "the", "my", "i", "am", "im", "is", "was", "feeling", "feel", "today", "just",
+                       "some", "time", "of", "at", "in", "on", "very", "bit", "little"})
+
+_NON_WORD = re.compile(r"[^\w\s]+")
+_SYNONYM = re.compile(r"\b(" + "|".join(sorted(map(re.escape, SYNONYMS), key=len, reverse=True)) + r")\b")
+
+
+def normalize_context(context):
+    text = _NON_WORD.sub(" ", (context or "").lower())
+    text = _SYNONYM.sub(lambda m: SYNONYMS[m.group(1)], " ".join(text.split()))
+    return " ".join(word for word in text.split() if word not in STOPWORDS)
+
+
+def embed(text, dim=DIM):
+    """Hashed word + character 3/4-gram vector, L2-normalized (signed hashing keeps collisions unbiased)"""
+    padded = f" {text} "
+    features = text.split()
+    features += [padded[i:i + 3] for i in range(len(padded) - 2)]
+    features += [padded[i:i + 4] for i in range(len(padded) - 3)]
+    hashes = np.fromiter((zlib.crc32(feature.encode()) for feature in features), dtype=np.uint32, count=len(features))
+    signs = np.where(hashes & 0x80000000, 1.0, -1.0)
+    vector = np.bincount(hashes % dim, weights=signs, minlength=dim).astype(np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class FlatIndex:
+    """Contiguous float32 matrix of unit vectors; nearest neighbour = one matrix-vector product"""
+
+    def __init__(self, dim=DIM, capacity=MAX_PER_PARTITION):
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.payloads = [None] * capacity
+        self.size = 0
+        self._next = 0  # ring position: full indexes overwrite their oldest entry
+
+    def add(self, vector, payload):
+        slot = self._next
+        self.vectors[slot] = vector
+        self.payloads[slot] = payload
+        self._next = (slot + 1) % len(self.payloads)
+        self.size = min(self.size + 1, len(self.payloads))
+        return slot
+
+    def search(self, vector):
+        """(similarity, payload) of the closest entry, or (0.0, None) when empty"""
+        if not self.size:
+            return 0.0, None
+        scores = self.vectors[:self.size] @ vector
+        best = int(np.argmax(scores))
+        return float(scores[best]), self.payloads[best]
+
+
+class AdviceCache:
+    def __init__(self, similarity=None, ttl_seconds=None):
+        self.similarity = similarity
+        self.ttl_seconds = ttl_seconds
+        self.stats = Counter()
+        self._exact = OrderedDict()  # (partition, normalized context) -> (advice, stored_at)
+        self._indexes = {}  # partition -> FlatIndex
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _partition(glucose_level, trend, context, scope="", side=None):
+        """Advice is only shared within a glucose band, trend and set of qualifier words
+        (and scope: a patient id when the advice was personalized). `side` is the alert kind under
+        the patient's own thresholds; without it the global ones decide."""
+        if side is None:
+            hypo, hyper = get_settings().thresholds_for()
+            side = "low" if glucose_level <= hypo else "high" if glucose_level >= hyper else "in_range"
+        qualifiers = " ".join(sorted(QUALIFIERS.intersection(context.split())))
+        return side, int(glucose_level // BAND_MGDL), (trend or "stable").lower(), qualifiers, scope
+
+    def _fresh(self, stored_at):
+        return get_clock().time() - stored_at < (self.ttl_seconds or get_settings().advice_cache_ttl_seconds)
+
+    def get(self, glucose_level, trend, context, scope="", side=None):
+        """(advice, "exact" | "semantic") or (None, None)"""
+        text = normalize_context(context)
+        partition = self._partition(glucose_level, trend, text, scope, side)
+        with self._lock:
+            entry = self._exact.get((partition, text))
+            if entry is not None and self._fresh(entry[1]):
+                self._exact.move_to_end((partition, text))
+                self.stats["exact_hits"] += 1
+                return entry[0], "exact"
+            index = self._indexes.get(partition)
+        if index is not None:
+            vector = embed(text)
+            with self._lock:
+                score, payload = index.search(vector)
+            threshold = self.similarity or get_settings().advice_cache_similarity
+            if payload is not None and score >= threshold and self._fresh(payload[1]):
+                with self._lock:
+                    self.stats["semantic_hits"] += 1
+                return payload[0], "semantic"
+        with self._lock:
+            self.stats["misses"] += 1
+        return None, None
+
+    def put(self, glucose_level, trend, context, advice, scope="", side=None):
+        text = normalize_context(context)
+        partition = self._partition(glucose_level, trend, text, scope, side)
+        vector = embed(text)
+        entry = (advice, get_clock().time())
+        with self._lock:
+            self._exact[(partition, text)] = entry
+            self._exact.move_to_end((partition, text))
+            while len(self._exact) > MAX_EXACT:
+                self._exact.popitem(last=False)
+            index = self._indexes.get(partition)
+            if index is None:
+                index = self._indexes[partition] = FlatIndex()
+            index.add(vector, entry)
+            self.stats["stored"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._exact.clear()
+            self._indexes.clear()
+
+
+# Global instance
+advice_cache = AdviceCache()
+
+
+# 🔬 Benchmark: paraphrased contexts against a warm cache
+if __name__ == "__main__":
+    import time
+
+    contexts = ["after dinner", "fasting overnight", "automated monitoring", "before breakfast", "after exercise",
+                "during the night", "after lunch", "feeling sick", "before bed", "after a snack"]
+    paraphrases = {
+        "post dinner": "after dinner", "after supper": "after dinner", "After dinner!": "after dinner",
+        "fasted overnight": "fasting overnight", "fasting, overnight": "fasting overnight",
+        "automatic monitoring": "automated monitoring", "scheduled monitoring": "automated monitoring",
+        "before breakfast time": "before breakfast", "post workout": "after exercise",
+        "after the gym": "after exercise", "following lunch": "after lunch", "ill today": "feeling sick",
+        "after a big dinner": "after dinner", "automated glucose monitoring": "automated monitoring",
+        "after a light snack": "after a snack", "monitoring": "automated monitoring",
+        "right after dinner": "after dinner", "long run, after exercise": "after exercise",
+    }
+    must_miss = ["before dinner", "during exercise", "after breakfast", "before lunch", "fasting"]
+
+    cache = AdviceCache(similarity=0.6, ttl_seconds=3600)
+    for context in contexts:
+        cache.put(65, "falling", context, f"advice for {context}")
+    print(f"🧩 similarity to cached contexts (threshold {cache.similarity}):")
+    for query, expected in paraphrases.items():
+        advice, kind = cache.get(65, "falling", query)
+        print(f"   {query!r:>30} → {kind or 'miss':8} {'✅' if advice == f'advice for {expected}' else '❌'}")
+    for query in must_miss:
+        advice, kind = cache.get(65, "falling", query)
+        print(f"   {query!r:>30} → {kind or 'miss':8} {'✅' if advice is None else '❌ wrong reuse'}")
+
+    # Lookup cost with a large cache: 100 bands x trends x qualifier sets
+    big = AdviceCache(similarity=0.6, ttl_seconds=3600)
+    trends = ["rising", "falling", "stable", "rising fast", "falling fast"]
+    for glucose in range(40, 400, 5):
+        for trend in trends:
+            for context in contexts:
+                big.put(glucose, trend, f"{context} {glucose % 7}", "advice")
+    n = 20_000
+    start = time.perf_counter()
+    for i in range(n):
+        big.get(40 + i % 360, trends[i % 5], "post dinner")
+    semantic = (time.perf_counter() - start) / n
+    start = time.perf_counter()
+    for i in range(n):
+        glucose = 40 + 5 * (i % 72)
+        big.get(glucose, trends[i % 5], f"after dinner {glucose % 7}")
+    print(f"⏱️ {big.stats['stored']:,} entries: semantic lookup {semantic * 1e6:.0f} µs, "
+          f"exact lookup {(time.perf_counter() - start) / n * 1e6:.1f} µs; {dict(big.stats)}")
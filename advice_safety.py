@@ -0,0 +1,160 @@
+# advice_safety.py - Post-generation safety check for LLM advice: one compiled regex pass per response
+import re
+import threading
+from collections import Counter
+
+# Lows: the standard 15 g rule; anything outside this range is not advice we send
+CARB_GRAMS = (10, 30)
+READING_TOLERANCE = 5  # mg/dL; a quoted reading further than this from the real one is a hallucination
+EMERGENCY_SENTENCE = "If you feel confused, faint or unwell, call emergency services immediately."
+
+_MEDS = (r"insulin|metformin|glipizide|gliclazide|glimepiride|glyburide|sitagliptin|empagliflozin|dapagliflozin"
+         r"|semaglutide|liraglutide|dulaglutide|ozempic|trulicity|jardiance|januvia|lantus|humalog|novorapid"
+         r"|basal|bolus|medication|medicine|meds|pills?|tablets? of")
+
+# (rule, action, pattern) - action: "reject" -> safety fallback, "drop" -> remove the sentence,
+# "require" -> must appear at least once (else a standard sentence is appended), "check" -> numeric check
+# Verb rules consume only the verb (the rest is a lookahead), so one pass still sees the
+# numbers after it: "eat 60 grams of sugar" hits both eat_sugar and carbs.
+RULES = (
+    ("insulin_units", "reject", r"\b\d+(?:\.\d+)?\s*(?:units?|iu|u)\b"),
+    ("dosing", "reject",
+     rf"\b(?:take|inject|give|administer|bolus|correct(?:ion)?)(?=\s+(?:\w+\s+){{0,3}}?(?:{_MEDS})\b)"),
+    ("med_change", "drop",
+     rf"\b(?:increase|decrease|raise|lower|reduce|double|halve|adjust|change|stop|skip|pause|hold|omit)"
+     rf"(?=\s+(?:\w+\s+){{0,3}}?(?:{_MEDS}|dose|dosage)\b)"),
+    ("reading", "check", r"(?P<reading_value>\d{2,3}(?:\.\d)?)\s*mg\s*/\s*dl"),
+    ("carbs", "check", r"(?P<carbs_value>\d{1,3})\s*(?:g|grams?)\b"),
+    ("eat_sugar", "check", r"\b(?:eat|drink|have|take|consume)(?=\s+(?:\w+\s+){0,4}?"
+                           r"(?:sugar|juice|candy|sweets|soda|glucose tab|fast[-\s]acting carb))"),
+    ("avoid_carbs", "check", r"\b(?:avoid|skip|no|limit|cut)(?=\s+(?:\w+\s+){0,2}?(?:carb|sugar|food|eating))"),
+    ("emergency", "require", r"\b(?:emergency|911|112|140|ambulance|call (?:your|a) (?:doctor|nurse|care team)"
+                             r"|seek (?:immediate |urgent )?(?:help|care|medical)|urgent care|hospital)"),
+)
+# Every rule starts at a word start; testing that once up front skips most positions cheaply
+_COMBINED = re.compile(r"(?=\w)\b(?:" + "|".join(f"(?P<{name}>{pattern})" for name, _, pattern in RULES) + ")",
+                       re.IGNORECASE)
+_ACTIONS = {name: action for name, action, _ in RULES}
+# Before a quoted reading, these make it a threshold: "below 70", "<70", "≥ 250", "the 70-180 mg/dL range"
+_THRESHOLD_WORDS = re.compile(r"(?:\b(?:below|under|above|over|than|to|between|from|and|exceeds?|reaches?)"
+                              r"|[<>≤≥]=?|\d\s*[-–])\s*$", re.IGNORECASE)
+# A negation earlier in the same clause: "don't drink juice or soda", "avoid eating candy"
+_NEGATED = re.compile(r"\b(?:don[’']?t|do not|never|avoid|no|not|without)\b[^.,;:!?\n—–]*$", re.IGNORECASE)
+_SENTENCE = re.compile(r"[^.!?\n]+(?:[.!?]+|\n|$)")
+
+
+class SafetyValidator:
+    def __init__(self):
+        self.stats = Counter()  # verdicts and rule hits
+        self._lock = threading.Lock()
+
+    def check(self, advice, glucose_level, hypo=70, hyper=180):
+        """(advice, verdict, violations): verdict is "ok", "repaired" or "rejected".
+        Rejected advice must not be sent; repaired advice has sentences dropped or the
+        emergency sentence appended."""
+        low, high = glucose_level <= hypo, glucose_level >= hyper
+        violations, drop_spans = [], []
+        emergency = False
+        for match in _COMBINED.finditer(advice):
+            rule = match.lastgroup
+            action = _ACTIONS[rule]
+            if action == "require":
+                emergency = True
+                continue
+            if rule == "reading":
+                if abs(float(match.group("reading_value")) - glucose_level) <= READING_TOLERANCE:
+                    continue
+                # Thresholds ("below 70 mg/dL", "over 250 mg/dL") are fine; only a wrong "your reading" is not
+                if _THRESHOLD_WORDS.search(advice, max(0, match.start() - 16), match.start()):
+                    continue
+                action = "reject"
+            elif rule == "carbs":
+                grams = int(match.group("carbs_value"))
+                if not low or CARB_GRAMS[0] <= grams <= CARB_GRAMS[1]:
+                    continue
+                action = "reject"
+            elif rule == "eat_sugar":
+                if not high or _NEGATED.search(advice, max(0, match.start() - 40), match.start()):
+                    continue
+                action = "reject"  # sugar for a high reading
+            elif rule == "avoid_carbs":
+                if not low:
+                    continue
+                action = "reject"  # withholding carbs during a low
+            violations.append((rule, match.group(0).strip()))
+            if action == "reject":
+                return self._verdict(advice, "rejected", violations)
+            drop_spans.append((match.start(), match.end()))
+
+        repaired = advice
+        if drop_spans:
+            kept = [s.group(0) for s in _SENTENCE.finditer(advice)
+                    if not any(s.start() < end and start < s.end() for start, end in drop_spans)]
+            repaired = "".join(kept).strip()
+            if len(repaired) < 20:
+                return self._verdict(advice, "rejected", violations)
+        if not emergency:
+            violations.append(("emergency", "missing"))
+            repaired = f"{repaired.rstrip()} {EMERGENCY_SENTENCE}".strip()
+        return self._verdict(repaired, "repaired" if violations else "ok", violations)
+
+    def _verdict(self, advice, verdict, violations):
+        with self._lock:
+            self.stats[verdict] += 1
+            self.stats.update(rule for rule, _ in violations)
+        if violations:
+            icon = "🛑" if verdict == "rejected" else "🛡️"
+            print(f"{icon} Advice {verdict}: " + "; ".join(f"{rule} ({text[:40]!r})" for rule, text in violations))
+        return advice, verdict, violations
+
+
+# Global instance
+safety_validator = SafetyValidator()
+
+
+def check_advice(advice, glucose_level, hypo=70, hyper=180):
+    """Public interface - (advice, verdict, violations)"""
+    return safety_validator.check(advice, glucose_level, hypo, hyper)
+
+
+# 🔬 Benchmark: a fixed set of good and bad responses
+if __name__ == "__main__":
+    import contextlib
+    import os
+    import timeit
+
+    cases = [
+        (65, "ok", "Eat 15g of fast-acting carbs like juice. Recheck in 15 minutes. "
+                   "If still below 70 mg/dL or you feel confused, call emergency services."),
+        (210, "ok", "Drink water and take a light walk. Recheck in 1-2 hours. "
+                    "Seek emergency care if over 250 mg/dL with vomiting."),
+        (65, "repaired", "Eat 15g of fast-acting carbs. Recheck your glucose in 15 minutes."),
+        (210, "repaired", "Drink water and recheck in 2 hours. Skip your evening metformin. "
+                          "Call emergency services if you vomit."),
+        (210, "rejected", "Take 4 units of insulin now and recheck in 2 hours. Call 911 if you feel unwell."),
+        (250, "rejected", "Give a correction dose of Humalog. Seek help if ketones are high."),
+        (62, "rejected", "Your glucose of 180 mg/dL is high; drink water. Call your doctor if it persists."),
+        (55, "rejected", "Eat 60 grams of sugar right away. Call emergency services if you faint."),
+        (230, "rejected", "Drink some juice and rest. Go to the hospital if you feel worse."),
+        (60, "rejected", "Avoid carbs for now and rest. Call emergency services if dizzy."),
+        (250, "ok", "Don't drink juice or soda until it comes down. Drink water and recheck in 1-2 hours. "
+                    "Seek emergency care if you vomit."),
+        (230, "rejected", "Don't wait: drink juice now. Call emergency services if you feel worse."),
+        (55, "ok", "Eat 15g of fast-acting carbs now. Recheck in 15 minutes. "
+                   "If still <70 mg/dL, call emergency services."),
+        (210, "ok", "Drink water and walk to get back into the 70-180 mg/dL range. "
+                    "Seek emergency care if ≥300 mg/dL with vomiting."),
+    ]
+    validator = SafetyValidator()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        results = [validator.check(advice, glucose) for glucose, _, advice in cases]
+    for (glucose, expected, advice), (checked, verdict, violations) in zip(cases, results):
+        print(f"   {glucose:>3} {verdict:8} {'✅' if verdict == expected else '❌ expected ' + expected} "
+              f"{[rule for rule, _ in violations]}")
+    print(f"   repaired: {results[3][0]!r}")
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for glucose, _, advice in cases:
+            n = 2000
+            per = timeit.timeit(lambda: validator.check(advice, glucose), number=n) / n
+            worst = max(per, locals().get("worst", 0.0))
+    print(f"⏱️ worst case per response: {worst * 1e6:.1f} µs")
@@ -0,0 +1,210 @@
+# agp.py - Ambulatory Glucose Profile from per-time-of-day histogram sketches
+import html
+import threading
+from datetime import datetime
+import numpy as np
+
+AGP_DAYS = 14
+SLOTS_PER_DAY = 48  # 30-minute time-of-day slots
+MINUTES_PER_SLOT = 1440 // SLOTS_PER_DAY
+
+# Fixed 5 mg/dL bins from 40 to 400; readings outside are clamped into the end bins
+BIN_MIN = 40
+BIN_MAX = 400
+BIN_WIDTH = 5
+N_BINS = (BIN_MAX - BIN_MIN) // BIN_WIDTH
+
+PERCENTILES = (5, 25, 50, 75, 95)
+
+
+class PatientSketch:
+    """14 daily layers of (time-of-day slot x glucose bin) counts"""
+
+    def __init__(self):
+        self.counts = np.zeros((AGP_DAYS, SLOTS_PER_DAY, N_BINS), dtype=np.uint16)
+        self.days = np.full(AGP_DAYS, -1, dtype=np.int64)  # day ordinal held by each layer
+        self.version = 0  # bumped on every reading, used as the render cache key
+
+    def add(self, glucose, when):
+        day = when.toordinal()
+        layer = day % AGP_DAYS
+        if self.days[layer] > day:
+            return False  # older than the 14-day window
+        if self.days[layer] != day:
+            self.counts[layer] = 0
+            self.days[layer] = day
+        slot = (when.hour * 60 + when.minute) // MINUTES_PER_SLOT
+        b = min(max(int((glucose - BIN_MIN) // BIN_WIDTH), 0), N_BINS - 1)
+        self.counts[layer, slot, b] += 1
+        self.version += 1
+        return True
+
+    def histogram(self, today):
+        """Summed (slot x bin) counts for the 14 days ending today"""
+        live = (self.days > today - AGP_DAYS) & (self.days <= today)
+        return self.counts[live].sum(axis=0, dtype=np.int64), int(live.sum())
+
+
+def percentiles_from_histogram(hist, percentiles=PERCENTILES):
+    """Per-slot percentiles with linear interpolation inside the bin (NaN where a slot is empty)"""
+    cdf = np.cumsum(hist, axis=1)
+    totals = cdf[:, -1].astype(np.float64)
+    out = np.full((len(percentiles), hist.shape[0]), np.nan)
+    has_data = totals > 0
+    for i, p in enumerate(percentiles):
+        target = totals * p / 100.0
+        b = np.argmax(cdf >= target[:, None], axis=1)
+        below = np.where(b > 0, cdf[np.arange(len(b)), b - 1], 0)
+        in_bin = hist[np.arange(len(b)), b]
+        fraction = np.divide(target - below, in_bin, out=np.zeros_like(target), where=in_bin > 0)
+        values = BIN_MIN + (b + fraction) * BIN_WIDTH
+        out[i, has_data] = values[has_data]
+    return out, totals
+
+
+class AGPReporter:
+    def __init__(self):
+        self._sketches = {}  # patient_id -> PatientSketch
+        self._cache = {}  # patient_id -> (cache key, {format: rendered})
+        self._lock = threading.Lock()
+
+    def record(self, patient_id, glucose, when=None):
+        """Fold one reading into the patient's sketch (`when` is local time)"""
+        when = when or datetime.now()
+        with self._lock:
+            sketch = self._sketches.get(patient_id)
+            if sketch is None:
+                sketch = self._sketches[patient_id] = PatientSketch()
+            return sketch.add(glucose, when)
+
+    def _cached(self, patient_id, fmt, today, build):
+        sketch = self._sketches.get(patient_id)
+        key = (sketch.version if sketch else 0, today)
+        with self._lock:
+            entry = self._cache.get(patient_id)
+            if entry is not None and entry[0] == key and fmt in entry[1]:
+                return entry[1][fmt]
+        rendered = build()
+        with self._lock:
+            entry = self._cache.get(patient_id)
+            if entry is None or entry[0] != key:
+                entry = self._cache[patient_id] = (key, {})
+            entry[1][fmt] = rendered
+        return rendered
+
+    def report(self, patient_id, today=None):
+        """AGP percentiles by time of day as a JSON-ready dict (cached until new data)"""
+        today = (today or datetime.now()).toordinal()
+        return self._cached(patient_id, "json", today, lambda: self._build_report(patient_id, today))
+
+    def _build_report(self, patient_id, today):
+        sketch = self._sketches.get(patient_id)
+        if sketch is None:
+            return {"patient_id": patient_id, "days": 0, "readings": 0, "slots": []}
+        hist, days = sketch.histogram(today)
+        values, totals = percentiles_from_histogram(hist)
+        slots = []
+        for slot in range(SLOTS_PER_DAY):
+            minutes = slot * MINUTES_PER_SLOT
+            row = {"time": f"{minutes // 60:02d}:{minutes % 60:02d}", "readings": int(totals[slot])}
+            for i, p in enumerate(PERCENTILES):
+                row[f"p{p}"] = None if np.isnan(values[i, slot]) else round(float(values[i, slot]), 1)
+            slots.append(row)
+        return {
+            "patient_id": patient_id,
+            "days": days,
+            "readings": int(totals.sum()),
+            "percentiles": list(PERCENTILES),
+            "target_range": [70, 180],
+            "slots": slots,
+        }
+
+    def render_svg(self, patient_id, today=None, width=720, height=320):
+        """Server-rendered AGP chart (cached until new data)"""
+        day = (today or datetime.now()).toordinal()
+        return self._cached(patient_id, "svg", day,
+                            lambda: _render_svg(self.report(patient_id, today), width, height))
+
+
+def _render_svg(report, width, height):
+    pad = 40
+    y_max = 350
+
+    def x(slot):
+        return pad + slot * (width - 2 * pad) / (SLOTS_PER_DAY - 1)
+
+    def y(value):
+        return height - pad - min(value, y_max) * (height - 2 * pad) / y_max
+
+    def band(lower, upper):
+        points = [(i, s) for i, s in enumerate(report["slots"]) if s[lower] is not None]
+        if not points:
+            return ""
+        top = " ".join(f"{x(i):.1f},{y(s[upper]):.1f}" for i, s in points)
+        bottom = " ".join(f"{x(i):.1f},{y(s[lower]):.1f}" for i, s in reversed(points))
+        return f"{top} {bottom}"
+
+    median = " ".join(f"{x(i):.1f},{y(s['p50']):.1f}" for i, s in enumerate(report["slots"])
+                      if s["p50"] is not None)
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+        f'viewBox="0 0 {width} {height}" font-family="sans-serif" font-size="11">',
+        f'<rect width="{width}" height="{height}" fill="white"/>',
+        f'<text x="{pad}" y="20" font-size="14">AGP - {html.escape(report["patient_id"])} '
+        f'({report["days"]} days, {report["readings"]} readings)</text>',
+        f'<rect x="{pad}" y="{y(180):.1f}" width="{width - 2 * pad}" height="{y(70) - y(180):.1f}" '
+        f'fill="#e8f5e9"/>',
+        f'<polygon points="{band("p5", "p95")}" fill="#90caf9" fill-opacity="0.5"/>',
+        f'<polygon points="{band("p25", "p75")}" fill="#1e88e5" fill-opacity="0.6"/>',
+        f'<polyline points="{median}" fill="none" stroke="#0d47a1" stroke-width="2"/>',
+    ]
+    for value in (54, 70, 180, 250):
+        parts.append(f'<line x1="{pad}" x2="{width - pad}" y1="{y(value):.1f}" y2="{y(value):.1f}" '
+                     f'stroke="#888" stroke-dasharray="3,3"/>')
+        parts.append(f'<text x="{pad - 4}" y="{y(value) + 4:.1f}" text-anchor="end">{value}</text>')
+    for hour in range(0, 25, 3):
+        slot = min(hour * 60 // MINUTES_PER_SLOT, SLOTS_PER_DAY - 1)
+        parts.append(f'<text x="{x(slot):.1f}" y="{height - pad + 16}" text-anchor="middle">'
+                     f'{hour % 24:02d}:00</text>')
+    parts.append("</svg>")
+    return "\n".join(parts)
+
+
+# Global instance
+agp_reporter = AGPReporter()
+
+
+# 🔬 Benchmark
+if __name__ == "__main__":
+    import time
+    from datetime import timedelta
+
+    rng = np.random.default_rng(3)
+    reporter = AGPReporter()
+    start_day = datetime(2025, 1, 1)
+    readings = 0
+    start = time.perf_counter()
+    for minute in range(0, 14 * 1440, 5):
+        when = start_day + timedelta(minutes=minute)
+        circadian = 30 * np.sin(2 * np.pi * (when.hour - 8) / 24)
+        reporter.record("p1", float(rng.normal(140 + circadian, 35)), when)
+        readings += 1
+    ingest_us = (time.perf_counter() - start) * 1e6 / readings
+
+    today = start_day + timedelta(days=13)
+    start = time.perf_counter()
+    report = reporter.report("p1", today)
+    build_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    svg = reporter.render_svg("p1", today)
+    svg_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    reporter.report("p1", today)
+    cached_us = (time.perf_counter() - start) * 1e6
+
+    print(f"📊 AGP over {report['days']} days, {report['readings']} readings")
+    print(f"   update: {ingest_us:.1f} µs/reading")
+    print(f"   report build: {build_ms:.2f} ms, SVG render: {svg_ms:.2f} ms ({len(svg)} bytes), "
+          f"cached: {cached_us:.1f} µs")
+    for row in report["slots"][::8]:
+        print(f"   {row['time']}  p5={row['p5']} p25={row['p25']} p50={row['p50']} p75={row['p75']} p95={row['p95']}")
@@ -0,0 +1,134 @@
+# alert_state.py - Per-patient trend tracking and repeat-alert suppression
+import threading
+from collections import deque
+from clock import get_clock
+
+TREND_WINDOW_MINUTES = 30
+TREND_RATE = 1.0  # mg/dL per minute; faster than this is rising/falling
+
+REPEAT_MINUTES = 30  # don't resend the same kind of alert within this window...
+WORSENING_MGDL = 15  # ...unless glucose moved this much further out of range
+
+# Critical readings always alert: they ignore quiet hours and snoozes
+CRITICAL_LOW = 54  # level 2 hypoglycaemia
+CRITICAL_HIGH = 300
+
+
+def is_critical(glucose):
+    return glucose < CRITICAL_LOW or glucose > CRITICAL_HIGH
+
+
+class TrendTracker:
+    def __init__(self, window_minutes=TREND_WINDOW_MINUTES):
+        self.window_s = window_minutes * 60
+        self._history = {}  # patient_id -> deque[(epoch seconds, glucose)]
+        self._lock = threading.Lock()
+
+    def update(self, patient_id, glucose, when=None, reported=None):
+        """Record a reading and return its trend; a source-reported trend wins when present"""
+        ts = (when or get_clock().now()).timestamp()
+        with self._lock:
+            history = self._history.setdefault(patient_id, deque())
+            history.append((ts, glucose))
+            while history and history[0][0] < ts - self.window_s:
+                history.popleft()
+            if reported:
+                return reported
+            return self._trend(history)
+
+    def export_state(self, patient_ids, remove=False):
+        """Per-patient history, picklable - handed to a patient's new owner on rebalance"""
+        with self._lock:
+            take = self._history.pop if remove else self._history.get
+            return {pid: list(h) for pid in patient_ids if (h := take(pid, None))}
+
+    def load_state(self, state):
+        with self._lock:
+            for patient_id, history in state.items():
+                self._history[patient_id] = deque(history)
+
+    def _trend(self, history):
+        if len(history) < 2:
+            return "stable"
+        (t0, g0), (t1, g1) = history[0], history[-1]
+        if t1 <= t0:
+            return "stable"
+        rate = (g1 - g0) / ((t1 - t0) / 60.0)
+        if rate >= TREND_RATE:
+            return "rising"
+        if rate <= -TREND_RATE:
+            return "falling"
+        return "stable"
+
+
+class AlertSuppressor:
+    def __init__(self, repeat_minutes=REPEAT_MINUTES, worsening=WORSENING_MGDL):
+        self.repeat_s = repeat_minutes * 60
+        self.worsening = worsening
+        self._last = {}  # patient_id -> (epoch seconds, kind, glucose, acknowledged)
+        self._snoozed = {}  # patient_id -> epoch seconds when the snooze ends
+        self._lock = threading.Lock()
+        self.suppressed = 0
+
+    def should_alert(self, patient_id, kind, glucose):
+        """False if an alert of the same kind went out recently (or was acknowledged) and
+        things haven't got worse, or the patient snoozed alerts and this one isn't critical"""
+        now = get_clock().time()
+        with self._lock:
+            if now < self._snoozed.get(patient_id, 0) and not is_critical(glucose):
+                self.suppressed += 1
+                return False
+            last = self._last.get(patient_id)
+            if last is None or last[1] != kind:
+                return True
+            acknowledged = last[3]
+            if not acknowledged and now - last[0] >= self.repeat_s:
+                return True
+            worse = last[2] - glucose if kind == "low" else glucose - last[2]
+            if worse >= self.worsening:
+                return True
+            self.suppressed += 1
+            return False
+
+    def record_alert(self, patient_id, kind, glucose):
+        with self._lock:
+            self._last[patient_id] = (get_clock().time(), kind, glucose, False)
+
+    def acknowledge(self, patient_id):
+        """Someone replied OK/ACK: no repeats of this alert until it gets worse or resolves"""
+        with self._lock:
+            last = self._last.get(patient_id)
+            if last is None or last[3]:
+                return False
+            self._last[patient_id] = (*last[:3], True)
+            return True
+
+    def snooze(self, patient_id, minutes):
+        """Hold non-critical alerts for `minutes`"""
+        with self._lock:
+            self._snoozed[patient_id] = get_clock().time() + minutes * 60
+
+    def export_state(self, patient_ids, remove=False):
+        with self._lock:
+            take_last = self._last.pop if remove else self._last.get
+            take_snooze = self._snoozed.pop if remove else self._snoozed.get
+            state = {pid: (take_last(pid, None), take_snooze(pid, None)) for pid in patient_ids}
+            return {pid: entry for pid, entry in state.items() if entry != (None, None)}
+
+    def load_state(self, state):
+        with self._lock:
+            for patient_id, (last, snoozed_until) in state.items():
+                if last is not None:
+                    self._last[patient_id] = last
+                if snoozed_until is not None:
+                    self._snoozed[patient_id] = snoozed_until
+
+    def clear(self, patient_id):
+        """Forget the last alert (e.g. glucose back in range)"""
+        with self._lock:
+            self._last.pop(patient_id, None)
+
+
+# Global instances
+trend_tracker = TrendTracker()
+alert_suppressor = AlertSuppressor()
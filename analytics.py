@@ -0,0 +1,231 @@
+# analytics.py - Rolling clinical glucose metrics from bucketed pre-aggregates
+import threading
+import time
+import numpy as np
+
+# International consensus CGM ranges (mg/dL) - fixed, independent of alert thresholds
+RANGE_LOW = 70
+RANGE_HIGH = 180
+VERY_LOW = 54
+VERY_HIGH = 250
+
+# Per-bucket aggregate fields
+COUNT, SUM, SUMSQ, BELOW, ABOVE, VERY_LOW_N, VERY_HIGH_N = range(7)
+N_FIELDS = 7
+
+HOURLY_BUCKETS = 14 * 24  # 1-hour buckets cover windows up to 14 days
+DAILY_BUCKETS = 90  # 1-day buckets cover the 90-day window
+
+# Window name -> (ring, number of buckets)
+WINDOWS = {
+    "24h": ("hourly", 24),
+    "7d": ("hourly", 7 * 24),
+    "14d": ("hourly", 14 * 24),
+    "90d": ("daily", 90),
+}
+
+
+class _BucketRing:
+    """(patients x buckets x fields) aggregates; a bucket slot is reused once its period expires"""
+
+    def __init__(self, capacity, n_buckets, period_s):
+        self.n_buckets = n_buckets
+        self.period_s = period_s
+        self.values = np.zeros((capacity, n_buckets, N_FIELDS), dtype=np.float64)
+        self.stamps = np.full((capacity, n_buckets), -1, dtype=np.int64)  # period number held by each slot
+
+    def grow(self, capacity):
+        values = np.zeros((capacity, self.n_buckets, N_FIELDS), dtype=np.float64)
+        stamps = np.full((capacity, self.n_buckets), -1, dtype=np.int64)
+        values[:self.values.shape[0]] = self.values
+        stamps[:self.stamps.shape[0]] = self.stamps
+        self.values, self.stamps = values, stamps
+
+    def add(self, rows, periods, contributions):
+        """Accumulate per-reading contributions; `periods` must span less than n_buckets"""
+        slots = periods % self.n_buckets
+        current = self.stamps[rows, slots]
+
+        # Readings for a period older than what the slot now holds are past the window
+        keep = periods >= current
+        rows, slots, periods, contributions = rows[keep], slots[keep], periods[keep], contributions[keep]
+
+        # Slots holding an expired period are cleared before accumulating
+        stale = periods > self.stamps[rows, slots]
+        if stale.any():
+            self.values[rows[stale], slots[stale]] = 0.0
+            self.stamps[rows[stale], slots[stale]] = periods[stale]
+
+        # Group readings by (row, slot) and add each group's total once
+        flat = rows.astype(np.int64) * self.n_buckets + slots
+        touched, group = np.unique(flat, return_inverse=True)
+        totals = np.empty((touched.shape[0], N_FIELDS), dtype=np.float64)
+        for field in range(N_FIELDS):
+            totals[:, field] = np.bincount(group, weights=contributions[:, field], minlength=touched.shape[0])
+        self.values.reshape(-1, N_FIELDS)[touched] += totals
+
+    def add_one(self, row, period, contribution):
+        """Scalar fast path for a single reading"""
+        slot = period % self.n_buckets
+        held = self.stamps[row, slot]
+        if period < held:
+            return
+        if period > held:
+            self.values[row, slot] = 0.0
+            self.stamps[row, slot] = period
+        self.values[row, slot] += contribution
+
+    def window(self, row, end_period, n_buckets):
+        """Sum of the last `n_buckets` periods ending at `end_period` - O(buckets)"""
+        stamps = self.stamps[row]
+        live = (stamps > end_period - n_buckets) & (stamps <= end_period)
+        return self.values[row][live].sum(axis=0)
+
+
+def _contributions(glucose):
+    glucose = np.asarray(glucose, dtype=np.float64)
+    out = np.empty((glucose.shape[0], N_FIELDS), dtype=np.float64)
+    out[:, COUNT] = 1.0
+    out[:, SUM] = glucose
+    out[:, SUMSQ] = glucose * glucose
+    out[:, BELOW] = glucose < RANGE_LOW
+    out[:, ABOVE] = glucose > RANGE_HIGH
+    out[:, VERY_LOW_N] = glucose < VERY_LOW
+    out[:, VERY_HIGH_N] = glucose > VERY_HIGH
+    return out
+
+
+def summarize(totals):
+    """Clinical metrics from one aggregate vector"""
+    n = totals[COUNT]
+    if n == 0:
+        return {"readings": 0}
+    mean = totals[SUM] / n
+    variance = max(totals[SUMSQ] / n - mean * mean, 0.0)
+    sd = variance ** 0.5
+    below, above = totals[BELOW] / n, totals[ABOVE] / n
+    return {
+        "readings": int(n),
+        "mean": round(mean, 1),
+        "sd": round(sd, 1),
+        "cv": round(100.0 * sd / mean, 1) if mean else None,  # %; ≤36% is considered stable
+        "gmi": round(3.31 + 0.02392 * mean, 2),  # glucose management indicator, %
+        "time_in_range": round(100.0 * (1.0 - below - above), 1),
+        "time_below_range": round(100.0 * below, 1),
+        "time_above_range": round(100.0 * above, 1),
+        "time_very_low": round(100.0 * totals[VERY_LOW_N] / n, 1),
+        "time_very_high": round(100.0 * totals[VERY_HIGH_N] / n, 1),
+    }
+
+
+class GlucoseAnalytics:
+    def __init__(self, capacity=256):
+        self.hourly = _BucketRing(capacity, HOURLY_BUCKETS, 3600)
+        self.daily = _BucketRing(capacity, DAILY_BUCKETS, 86400)
+        self._index = {}  # patient_id -> row
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._index)
+
+    def _row(self, patient_id):
+        row = self._index.get(patient_id)
+        if row is None:
+            row = len(self._index)
+            capacity = self.hourly.values.shape[0]
+            if row >= capacity:
+                self.hourly.grow(capacity * 2)
+                self.daily.grow(capacity * 2)
+            self._index[patient_id] = row
+        return row
+
+    def rows_for(self, patient_ids):
+        with self._lock:
+            return np.fromiter((self._row(p) for p in patient_ids), dtype=np.int64, count=len(patient_ids))
+
+    def add_batch(self, rows, epoch_seconds, glucose):
+        """Vectorized ingest of many readings (rows from rows_for)"""
+        epoch_seconds = np.asarray(epoch_seconds, dtype=np.int64)
+        order = np.argsort(epoch_seconds, kind="stable")
+        rows, epoch_seconds = np.asarray(rows)[order], epoch_seconds[order]
+        contributions = _contributions(np.asarray(glucose)[order])
+
+        with self._lock:
+            for ring in (self.hourly, self.daily):
+                periods = epoch_seconds // ring.period_s
+                # Each pass must stay inside one ring revolution so slots don't collide
+                start = 0
+                while start < len(periods):
+                    end = np.searchsorted(periods, periods[start] + ring.n_buckets, side="left")
+                    ring.add(rows[start:end], periods[start:end], contributions[start:end])
+                    start = end
+
+    def record(self, patient_id, glucose, when=None):
+        """Add one reading (`when` = epoch seconds or datetime, default now)"""
+        if when is None:
+            when = time.time()
+        elif hasattr(when, "timestamp"):
+            when = when.timestamp()
+        contribution = _contributions([glucose])[0]
+        with self._lock:
+            row = self._row(patient_id)
+            for ring in (self.hourly, self.daily):
+                ring.add_one(row, int(when) // ring.period_s, contribution)
+
+    def metrics(self, patient_id, window="14d", now=None):
+        """TIR/TBR/TAR, mean, SD, CV and GMI over a sliding window"""
+        ring_name, n_buckets = WINDOWS[window]
+        row = self._index.get(patient_id)
+        if row is None:
+            return {"window": window, "readings": 0}
+        ring = self.hourly if ring_name == "hourly" else self.daily
+        now = time.time() if now is None else now
+        with self._lock:
+            totals = ring.window(row, int(now) // ring.period_s, n_buckets)
+        return {"window": window, **summarize(totals)}
+
+    def report(self, patient_id, now=None):
+        return {name: self.metrics(patient_id, name, now) for name in WINDOWS}
+
+
+# Global instance
+glucose_analytics = GlucoseAnalytics()
+
+
+# 🔬 Benchmark
+if __name__ == "__main__":
+    import sys
+
+    n_patients = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 2 * 365
+    per_day = 24  # one reading per patient per hour keeps the run to minutes, not hours
+    rng = np.random.default_rng(7)
+
+    analytics = GlucoseAnalytics(capacity=n_patients)
+    rows = analytics.rows_for([f"p{i}" for i in range(n_patients)])
+    start_epoch = 1_700_000_000 - 1_700_000_000 % 86400
+
+    print(f"📈 Ingesting {days} days x {per_day}/day for {n_patients:,} patients "
+          f"({days * per_day * n_patients / 1e6:.0f}M readings)...")
+    start = time.perf_counter()
+    for day in range(days):
+        times = start_epoch + day * 86400 + np.repeat(np.arange(per_day) * 3600, n_patients)
+        batch_rows = np.tile(rows, per_day)
+        glucose = rng.normal(140, 50, batch_rows.shape[0]).clip(40, 400)
+        analytics.add_batch(batch_rows, times, glucose)
+    ingest_s = time.perf_counter() - start
+    now = start_epoch + days * 86400 - 1
+    print(f"   ingest: {ingest_s:.1f} s ({days * per_day * n_patients / ingest_s / 1e6:.1f}M readings/s)")
+
+    queries = 20_000
+    patients = rng.integers(0, n_patients, queries)
+    for window in WINDOWS:
+        start = time.perf_counter()
+        for p in patients:
+            analytics.metrics(f"p{p}", window, now)
+        per_query = (time.perf_counter() - start) / queries
+        print(f"   {window:>3} query: {per_query * 1e6:.1f} µs")
+
+    print(f"   p0 report: {analytics.report('p0', now)['14d']}")
+    memory = analytics.hourly.values.nbytes + analytics.daily.values.nbytes
+    print(f"   aggregate memory: {memory / 1e6:.0f} MB")
@@ -0,0 +1,275 @@
+# cgm_import.py - Streaming importer for Dexcom Clarity, LibreView and Nightscout exports
+import csv
+import json
+import os
+import numpy as np
+from reading_store import get_reading_store
+
+MMOL_TO_MGDL = 18.0182
+CHUNK_ROWS = 50_000  # rows converted and written per batch - bounds memory on multi-GB files
+JSON_READ_BYTES = 1 << 20
+
+# Dexcom reports out-of-range sensor values as text
+SENSOR_LIMITS = {"low": 40.0, "high": 400.0}
+
+
+def detect_format(path):
+    """'dexcom', 'libreview' or 'nightscout' from the file's first bytes"""
+    with open(path, encoding="utf-8-sig", errors="replace") as f:
+        head = f.read(4096)
+    stripped = head.lstrip()
+    if stripped.startswith("[") or stripped.startswith("{"):
+        return "nightscout"
+    if "Glucose Value (" in head and "Event Type" in head:
+        return "dexcom"
+    if "Historic Glucose" in head or "Device Timestamp" in head:
+        return "libreview"
+    raise ValueError(f"Unrecognized CGM export format: {path}")
+
+
+def _to_mgdl(values, unit):
+    """Parse value strings ('Low'/'High' allowed) and convert mmol/L to mg/dL"""
+    text = np.char.lower(np.char.strip(np.asarray(values, dtype="U16")))
+    numeric = np.where(np.isin(text, ["", *SENSOR_LIMITS]), "nan", text).astype(np.float64)
+    if unit == "mmol/L":
+        numeric *= MMOL_TO_MGDL
+    for label, limit in SENSOR_LIMITS.items():
+        numeric[text == label] = limit
+    return np.round(numeric, 1)
+
+
+def _iso_to_epoch(stamps, utc_offset_minutes):
+    """Vectorized ISO-8601 ('2024-01-15T08:05:00' or with a space) -> epoch seconds"""
+    stamps = np.char.replace(np.asarray(stamps, dtype="U19"), " ", "T")
+    local = stamps.astype("datetime64[s]").astype(np.int64)
+    return local - utc_offset_minutes * 60
+
+
+def _libre_to_epoch(stamps, utc_offset_minutes, day_first=False):
+    """Vectorized 'MM-DD-YYYY HH:MM[ AM/PM]' (DD-MM-YYYY with day_first) -> epoch seconds"""
+    text = np.char.strip(np.asarray(stamps, dtype="U19"))
+    if text.shape[0] and text[0][4:5] == "-":
+        return _iso_to_epoch(text, utc_offset_minutes)  # already year-first
+    chars = text.astype("S16").view("S1").reshape(-1, 16)
+    month, day = (chars[:, 3:5], chars[:, 0:2]) if day_first else (chars[:, 0:2], chars[:, 3:5])
+    dash = np.full((chars.shape[0], 1), b"-", dtype="S1")
+    iso = np.hstack([chars[:, 6:10], dash, month, dash, day, np.full_like(dash, b"T"), chars[:, 11:16]])
+    iso = iso.view("S16").ravel().astype("U16")
+    epoch = iso.astype("datetime64[m]").astype("datetime64[s]").astype(np.int64)
+
+    # 12-hour clock exports: 12:xx AM is midnight, 1-11 PM are +12h
+    hours = chars[:, 11:13].view("S2").ravel().astype(np.int64)
+    pm = np.char.endswith(text, "PM")
+    am = np.char.endswith(text, "AM")
+    epoch += np.where(pm & (hours != 12), 12 * 3600, 0) - np.where(am & (hours == 12), 12 * 3600, 0)
+    return epoch - utc_offset_minutes * 60
+
+
+def _csv_chunks(f, columns, keep_row, chunk_rows):
+    """Yield {column: [values]} chunks of rows that pass keep_row"""
+    reader = csv.reader(f)
+    header = next(reader)
+    index = {name: header.index(name) for name in columns}
+    chunk = {name: [] for name in columns}
+    count = 0
+    for row in reader:
+        if len(row) < len(header) or not keep_row(row, header):
+            continue
+        for name, i in index.items():
+            chunk[name].append(row[i])
+        count += 1
+        if count == chunk_rows:
+            yield chunk
+            chunk = {name: [] for name in columns}
+            count = 0
+    if count:
+        yield chunk
+
+
+def _find_column(header, prefix):
+    for name in header:
+        if name.startswith(prefix):
+            return name
+    raise ValueError(f"Missing column starting with {prefix!r}")
+
+
+def iter_dexcom(path, utc_offset_minutes=0, chunk_rows=CHUNK_ROWS):
+    """Dexcom Clarity CSV: EGV rows only"""
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        header = next(csv.reader([f.readline()]))
+        f.seek(0)
+        ts_col = _find_column(header, "Timestamp")
+        value_col = _find_column(header, "Glucose Value")
+        unit = "mmol/L" if "mmol" in value_col else "mg/dL"
+        event_col = header.index("Event Type")
+        ts_index = header.index(ts_col)
+
+        def keep(row, _header):
+            return row[event_col] == "EGV" and row[ts_index]
+
+        for chunk in _csv_chunks(f, [ts_col, value_col], keep, chunk_rows):
+            yield _iso_to_epoch(chunk[ts_col], utc_offset_minutes), _to_mgdl(chunk[value_col], unit)
+
+
+def iter_libreview(path, utc_offset_minutes=0, chunk_rows=CHUNK_ROWS, day_first=False):
+    """LibreView CSV: historic (record type 0) and scan (record type 1) readings"""
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        first = f.readline()
+        if "Device Timestamp" in first:
+            f.seek(0)  # no metadata line
+        start = f.tell()
+        header = next(csv.reader([f.readline()]))
+        f.seek(start)
+        historic_col = _find_column(header, "Historic Glucose")
+        scan_col = _find_column(header, "Scan Glucose")
+        unit = "mmol/L" if "mmol" in historic_col else "mg/dL"
+        type_index = header.index("Record Type")
+
+        def keep(row, _header):
+            return row[type_index] in ("0", "1")
+
+        for chunk in _csv_chunks(f, ["Device Timestamp", "Record Type", historic_col, scan_col], keep, chunk_rows):
+            values = [h if t == "0" else s for t, h, s in zip(chunk["Record Type"], chunk[historic_col], chunk[scan_col])]
+            yield (_libre_to_epoch(chunk["Device Timestamp"], utc_offset_minutes, day_first),
+                   _to_mgdl(values, unit))
+
+
+def iter_nightscout(path, chunk_rows=CHUNK_ROWS):
+    """Nightscout /api/v1/entries JSON array, decoded incrementally (sgv is always mg/dL)"""
+    decoder = json.JSONDecoder()
+    dates, values = [], []
+    buffer = ""
+    with open(path, encoding="utf-8") as f:
+        eof = False
+        while not eof:
+            data = f.read(JSON_READ_BYTES)
+            eof = not data
+            buffer += data
+            pos = 0
+            while True:
+                # Skip array punctuation and whitespace between entries
+                while pos < len(buffer) and buffer[pos] in "[], \t\r\n":
+                    pos += 1
+                if pos >= len(buffer):
+                    break
+                try:
+                    entry, pos = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                    break  # entry continues in the next read
+                if entry.get("sgv") is not None and entry.get("date") is not None:
+                    dates.append(entry["date"])
+                    values.append(entry["sgv"])
+                    if len(dates) == chunk_rows:
+                        yield np.asarray(dates, dtype=np.int64) // 1000, np.asarray(values, dtype=np.float64)
+                        dates, values = [], []
+            buffer = buffer[pos:]
+    if dates:
+        yield np.asarray(dates, dtype=np.int64) // 1000, np.asarray(values, dtype=np.float64)
+
+
+def import_file(path, patient_id, fmt=None, store=None, only_newer=False, utc_offset_minutes=0,
+                on_batch=None, chunk_rows=CHUNK_ROWS):
+    """Stream a CGM export into the reading store; returns import counters.
+
+    Every valid row is offered to the store, whose INSERT OR IGNORE drops readings it already has,
+    so backfilled readings older than the newest stored one still get in. `only_newer` skips rows
+    at or before that reading without touching the store (faster re-imports of append-only exports);
+    they are counted in "older_skipped".
+    """
+    fmt = fmt or detect_format(path)
+    store = store or get_reading_store()
+    if fmt == "dexcom":
+        batches = iter_dexcom(path, utc_offset_minutes, chunk_rows)
+    elif fmt == "libreview":
+        batches = iter_libreview(path, utc_offset_minutes, chunk_rows)
+    elif fmt == "nightscout":
+        batches = iter_nightscout(path, chunk_rows)
+    else:
+        raise ValueError(f"Unsupported format: {fmt}")
+
+    high_water = store.latest_timestamp(patient_id) if only_newer else None
+    stats = {"format": fmt, "parsed": 0, "skipped": 0, "older_skipped": 0, "inserted": 0}
+    for timestamps, values in batches:
+        stats["parsed"] += len(values)
+        keep = ~np.isnan(values)
+        stats["skipped"] += int((~keep).sum())
+        if high_water is not None:
+            newer = timestamps > high_water
+            stats["older_skipped"] += int((keep & ~newer).sum())
+            keep &= newer
+        timestamps, values = timestamps[keep], values[keep]
+        if len(values):
+            stats["inserted"] += store.add_many(patient_id, timestamps.tolist(), values.tolist(), fmt)
+            if on_batch:
+                on_batch(patient_id, timestamps, values)
+    stats["duplicates"] = stats["parsed"] - stats["skipped"] - stats["older_skipped"] - stats["inserted"]
+    print(f"📥 Imported {path} ({fmt}) for {patient_id}: {stats}")
+    return stats
+
+
+def _write_synthetic_dexcom(path, rows):
+    rng = np.random.default_rng(11)
+    start = np.datetime64("2022-01-01T00:00:00")
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Index", "Timestamp (YYYY-MM-DDThh:mm:ss)", "Event Type", "Event Subtype",
+                         "Glucose Value (mg/dL)", "Device Info"])
+        for offset in range(0, rows, CHUNK_ROWS):
+            n = min(CHUNK_ROWS, rows - offset)
+            stamps = (start + (np.arange(offset, offset + n) * 300).astype("timedelta64[s]")).astype(str)
+            values = rng.normal(140, 45, n).clip(40, 400).round().astype(int)
+            writer.writerows((offset + i, stamps[i], "EGV", "", values[i], "G6") for i in range(n))
+
+
+# 🔬 Import / benchmark
+if __name__ == "__main__":
+    import argparse
+    import tempfile
+    import time
+    from reading_store import ReadingStore
+
+    parser = argparse.ArgumentParser(description="Import CGM export files")
+    parser.add_argument("path", nargs="?", help="export file (omit with --bench)")
+    parser.add_argument("--patient", default="default")
+    parser.add_argument("--format", choices=["dexcom", "libreview", "nightscout"])
+    parser.add_argument("--utc-offset", type=int, default=0, help="minutes east of UTC for local timestamps")
+    parser.add_argument("--only-newer", action="store_true",
+                        help="skip rows older than the newest stored reading (drops backfills)")
+    parser.add_argument("--bench", type=int, metavar="ROWS", help="import a synthetic Dexcom file of ROWS rows")
+    args = parser.parse_args()
+
+    if args.bench:
+        workdir = tempfile.mkdtemp()
+        csv_path = os.path.join(workdir, "clarity.csv")
+        _write_synthetic_dexcom(csv_path, args.bench)
+        store = ReadingStore(os.path.join(workdir, "bench.db"))
+        size_mb = os.path.getsize(csv_path) / 1e6
+        start = time.perf_counter()
+        stats = import_file(csv_path, "bench", "dexcom", store)
+        elapsed = time.perf_counter() - start
+        print(f"⏱️ {size_mb:.0f} MB, {stats['parsed']:,} rows in {elapsed:.1f}s "
+              f"({stats['parsed'] / elapsed:,.0f} rows/s)")
+        for only_newer in (False, True):
+            start = time.perf_counter()
+            again = import_file(csv_path, "bench", "dexcom", store, only_newer=only_newer)
+            print(f"⏱️ re-import ({'only newer' if only_newer else 'de-duplicated by the store'}) in "
+                  f"{time.perf_counter() - start:.1f}s, inserted {again['inserted']}")
+        # A device that uploads late: the first export misses an hour the second one backfills
+        full_path, late_path = os.path.join(workdir, "full.csv"), os.path.join(workdir, "late.csv")
+        _write_synthetic_dexcom(full_path, 288)
+        with open(full_path) as src, open(late_path, "w") as dst:
+            lines = src.readlines()
+            dst.writelines(lines[:1] + lines[13:])
+        for only_newer in (False, True):
+            backfill_store = ReadingStore(":memory:")
+            import_file(late_path, "late", "dexcom", backfill_store)
+            backfill = import_file(full_path, "late", "dexcom", backfill_store, only_newer=only_newer)
+            print(f"🩹 backfilled hour ({'only newer' if only_newer else 'default'}): "
+                  f"inserted {backfill['inserted']} of 12, older_skipped {backfill['older_skipped']}")
+    elif args.path:
+        import_file(args.path, args.patient, args.format, only_newer=args.only_newer,
+                    utc_offset_minutes=args.utc_offset)
+    else:
+        parser.print_help()
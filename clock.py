@@ -0,0 +1,52 @@
+# clock.py - Injectable clock so the agent can run on real or virtual (simulated) time
+import time
+from datetime import datetime, timedelta
+
+
+class SystemClock:
+    def now(self):
+        return datetime.now()
+
+    def time(self):
+        return time.time()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+class VirtualClock:
+    """Time only moves when advanced - used by simulation.py to replay weeks in seconds"""
+
+    def __init__(self, start=None):
+        self._now = start or datetime(2025, 1, 1)
+
+    def now(self):
+        return self._now
+
+    def time(self):
+        return self._now.timestamp()
+
+    def sleep(self, seconds):
+        self.advance(seconds)
+
+    def advance(self, seconds):
+        self._now += timedelta(seconds=seconds)
+
+    def set(self, when):
+        if when < self._now:
+            raise ValueError("Virtual clock cannot move backwards")
+        self._now = when
+
+
+_clock = SystemClock()
+
+
+def get_clock():
+    return _clock
+
+
+def set_clock(clock):
+    """Swap the process-wide clock (returns the previous one)"""
+    global _clock
+    previous, _clock = _clock, clock
+    return previous
@@ -0,0 +1,355 @@
+# cluster.py - Leader election and partition ownership across nodes via a shared SQLite store
+import hashlib
+import os
+import socket
+import sqlite3
+import threading
+import time
+from config import get_settings
+
+N_PARTITIONS = 64  # patients hash into fixed partitions; partitions (not patients) move between nodes
+LEADER = "leader"
+CLAIM_RETENTION_S = 7 * 86400
+
+
+def partition_of(patient_id, n_partitions=N_PARTITIONS):
+    digest = hashlib.blake2b(str(patient_id).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % n_partitions
+
+
+class LeaseStore:
+    """Leases, node heartbeats, partition assignments and check claims in one SQLite file.
+
+    Every node opens the same file (shared volume). Writes run in BEGIN IMMEDIATE
+    transactions, so lease takeover is atomic across processes. A `read_only` store (status
+    pages) opens the file with mode=ro and never creates or changes anything.
+    """
+
+    def __init__(self, path, read_only=False):
+        self.path = path
+        self._lock = threading.Lock()
+        if read_only:
+            self._conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=30, isolation_level=None,
+                                         check_same_thread=False)
+            return
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS leases ("
+            " name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL, epoch INTEGER NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS nodes (node_id TEXT PRIMARY KEY, heartbeat REAL NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS assignments (partition INTEGER PRIMARY KEY, node_id TEXT NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS claims ("
+            " patient_id TEXT NOT NULL, slot TEXT NOT NULL, node_id TEXT NOT NULL, at REAL NOT NULL,"
+            " PRIMARY KEY (patient_id, slot)) WITHOUT ROWID;"
+        )
+
+    def _write(self, fn):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(self._conn)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    def _read(self, query, params=()):
+        with self._lock:
+            return self._conn.execute(query, params).fetchall()
+
+    def acquire(self, name, owner, ttl, now):
+        """Take or renew a lease; returns its epoch (fencing token), or None if someone else holds it"""
+        def txn(conn):
+            row = conn.execute("SELECT owner, expires, epoch FROM leases WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                conn.execute("INSERT INTO leases VALUES (?, ?, ?, 1)", (name, owner, now + ttl))
+                return 1
+            holder, expires, epoch = row
+            if holder != owner and expires > now:
+                return None
+            epoch = epoch if holder == owner else epoch + 1
+            conn.execute("UPDATE leases SET owner = ?, expires = ?, epoch = ? WHERE name = ?",
+                         (owner, now + ttl, epoch, name))
+            return epoch
+        return self._write(txn)
+
+    def release(self, names, owner):
+        names = list(names)
+        if not names:
+            return
+        marks = ",".join("?" * len(names))
+        self._write(lambda conn: conn.execute(
+            f"UPDATE leases SET expires = 0 WHERE owner = ? AND name IN ({marks})", (owner, *names)))
+
+    def holders(self, now):
+        """{lease name: owner} for unexpired leases"""
+        return dict(self._read("SELECT name, owner FROM leases WHERE expires > ?", (now,)))
+
+    def heartbeat(self, node_id, now):
+        self._write(lambda conn: conn.execute(
+            "INSERT INTO nodes VALUES (?, ?) ON CONFLICT(node_id) DO UPDATE SET heartbeat = excluded.heartbeat",
+            (node_id, now)))
+
+    def live_nodes(self, since):
+        return [row[0] for row in self._read(
+            "SELECT node_id FROM nodes WHERE heartbeat >= ? ORDER BY node_id", (since,))]
+
+    def remove_node(self, node_id):
+        self._write(lambda conn: conn.execute("DELETE FROM nodes WHERE node_id = ?", (node_id,)))
+
+    def assignments(self):
+        return dict(self._read("SELECT partition, node_id FROM assignments"))
+
+    def set_assignments(self, assignments):
+        def txn(conn):
+            conn.execute("DELETE FROM assignments")
+            conn.executemany("INSERT INTO assignments VALUES (?, ?)", assignments.items())
+        self._write(txn)
+
+    def claim(self, patient_id, slot, node_id, now):
+        """Record that this scheduled check ran; False if another node already ran it"""
+        def txn(conn):
+            cursor = conn.execute("INSERT OR IGNORE INTO claims VALUES (?, ?, ?, ?)", (patient_id, slot, node_id, now))
+            return cursor.rowcount == 1
+        return self._write(txn)
+
+    def snapshot(self, now, lease_seconds):
+        """Leader, live nodes and the partitions each one holds a lease on"""
+        holders = self.holders(now)
+        nodes = {node_id: [] for node_id in self.live_nodes(since=now - lease_seconds)}
+        for name, owner in holders.items():
+            if name.startswith("partition:"):
+                nodes.setdefault(owner, []).append(int(name.split(":", 1)[1]))
+        leased = sum(len(partitions) for partitions in nodes.values())
+        return {"leader": holders.get(LEADER), "nodes": {node_id: sorted(p) for node_id, p in sorted(nodes.items())},
+                "partitions_leased": leased}
+
+    def prune_claims(self, before):
+        self._write(lambda conn: conn.execute("DELETE FROM claims WHERE at < ?", (before,)))
+
+    def close(self):
+        self._conn.close()
+
+
+def balanced_assignments(nodes, current, n_partitions=N_PARTITIONS):
+    """Spread partitions evenly over `nodes`, keeping as many existing owners as possible"""
+    if not nodes:
+        return {}
+    quota = {node: n_partitions // len(nodes) + (i < n_partitions % len(nodes)) for i, node in enumerate(nodes)}
+    assignments, unassigned = {}, []
+    for partition in range(n_partitions):
+        owner = current.get(partition)
+        if owner in quota and quota[owner] > 0:
+            assignments[partition] = owner
+            quota[owner] -= 1
+        else:
+            unassigned.append(partition)
+    spare = [node for node in nodes for _ in range(quota[node])]
+    assignments.update(zip(unassigned, spare))
+    return assignments
+
+
+class ClusterNode:
+    """One agent instance. Each tick: heartbeat, leader election, (leader) assignment, partition leases.
+
+    A partition is only checked by the node holding its lease; a new owner must wait for the
+    old lease to expire or be released, and per-check claims make a scheduled check run once
+    even if two nodes briefly disagree.
+    """
+
+    def __init__(self, store, node_id=None, lease_seconds=15.0, n_partitions=N_PARTITIONS, clock=time.time):
+        self.store = store
+        self.node_id = node_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.lease_seconds = lease_seconds
+        self.n_partitions = n_partitions
+        self.clock = clock
+        self.is_leader = False
+        self.owned = {}  # partition -> lease expiry (local view)
+        self.stats = {"ticks": 0, "elections_won": 0, "rebalances": 0, "claims": 0, "duplicates_skipped": 0}
+        self._thread = None
+        self._stop = threading.Event()
+
+    def tick(self):
+        now = self.clock()
+        self.stats["ticks"] += 1
+        self.store.heartbeat(self.node_id, now)
+
+        was_leader = self.is_leader
+        self.is_leader = self.store.acquire(LEADER, self.node_id, self.lease_seconds, now) is not None
+        if self.is_leader and not was_leader:
+            self.stats["elections_won"] += 1
+            print(f"👑 {self.node_id} is now cluster leader")
+        if self.is_leader:
+            self._assign(now)
+
+        mine = {p for p, node in self.store.assignments().items() if node == self.node_id}
+        dropped = [p for p in self.owned if p not in mine]
+        if dropped:
+            self.store.release((f"partition:{p}" for p in dropped), self.node_id)
+        owned = {}
+        for partition in mine:
+            if self.store.acquire(f"partition:{partition}", self.node_id, self.lease_seconds, now) is not None:
+                owned[partition] = now + self.lease_seconds
+        self.owned = owned
+        return set(owned)
+
+    def _assign(self, now):
+        nodes = self.store.live_nodes(since=now - self.lease_seconds)
+        current = self.store.assignments()
+        assignments = balanced_assignments(nodes, current, self.n_partitions)
+        if assignments != current:
+            self.store.set_assignments(assignments)
+            self.stats["rebalances"] += 1
+            print(f"🔀 Partitions reassigned over {len(nodes)} node(s)")
+        self.store.prune_claims(now - CLAIM_RETENTION_S)
+
+    def owns(self, patient_id):
+        """True while this node holds an unexpired lease on the patient's partition"""
+        expires = self.owned.get(partition_of(patient_id, self.n_partitions))
+        return expires is not None and self.clock() < expires
+
+    def claim(self, patient_id, slot):
+        """Owner-side guard before alerting: the (patient, scheduled slot) runs exactly once cluster-wide"""
+        if slot is None:
+            return True
+        if self.store.claim(patient_id, slot, self.node_id, self.clock()):
+            self.stats["claims"] += 1
+            return True
+        self.stats["duplicates_skipped"] += 1
+        return False
+
+    def start(self, interval=None):
+        """Tick in the background - well inside the lease so it never lapses while healthy"""
+        interval = interval or self.lease_seconds / 3
+        self.tick()
+
+        def _loop():
+            while not self._stop.wait(interval):
+                try:
+                    self.tick()
+                except sqlite3.Error as e:
+                    print(f"⚠️ Cluster tick failed on {self.node_id}: {e}")
+
+        self._thread = threading.Thread(target=_loop, name="cluster-heartbeat", daemon=True)
+        self._thread.start()
+        return self
+
+    def leave(self):
+        """Graceful shutdown: hand partitions back immediately instead of waiting for expiry"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        names = [f"partition:{p}" for p in self.owned] + [LEADER]
+        self.store.release(names, self.node_id)
+        self.store.remove_node(self.node_id)
+        self.owned = {}
+        self.is_leader = False
+
+    def status(self):
+        return {
+            "node_id": self.node_id,
+            "leader": self.is_leader,
+            "partitions": sorted(self.owned),
+            **self.stats,
+        }
+
+
+_node = None
+
+
+def get_cluster_node():
+    """This process's node when CLUSTER_DB is set (started on first use), else None"""
+    global _node
+    settings = get_settings()
+    if _node is None and settings.cluster_db:
+        store = LeaseStore(settings.cluster_db)
+        _node = ClusterNode(store, settings.cluster_node_id or None, settings.cluster_lease_seconds).start()
+    return _node
+
+
+_view_store = None
+
+
+def cluster_view():
+    """The cluster as the shared store records it, plus this process's node if one is running;
+    None without CLUSTER_DB. Read-only: unlike get_cluster_node() it never joins the cluster."""
+    global _view_store
+    settings = get_settings()
+    if not settings.cluster_db:
+        return None
+    if _view_store is None or _view_store.path != settings.cluster_db:
+        _view_store = LeaseStore(settings.cluster_db, read_only=True)
+    view = _view_store.snapshot(time.time(), settings.cluster_lease_seconds)
+    if _node is not None:
+        view["this_node"] = _node.status()
+    return view
+
+
+# 🔬 Failover demo on a virtual clock: nodes join, one dies, no check runs twice
+if __name__ == "__main__":
+    import sys
+    import tempfile
+    from collections import Counter
+
+    n_nodes = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    n_patients = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    lease = 15.0
+    now = [1_700_000_000.0]
+    path = os.path.join(tempfile.mkdtemp(), "cluster.db")
+    nodes = [ClusterNode(LeaseStore(path), f"node{i}", lease, clock=lambda: now[0]) for i in range(n_nodes)]
+    patients = [f"p{i}" for i in range(n_patients)]
+    ran = Counter()
+
+    def advance(seconds, alive):
+        for _ in range(int(seconds // (lease / 3))):
+            now[0] += lease / 3
+            for node in alive:
+                node.tick()
+
+    def scheduled_check(slot, alive):
+        start = time.perf_counter()
+        for node in alive:
+            for patient_id in patients:
+                if node.owns(patient_id) and node.claim(patient_id, slot):
+                    ran[(patient_id, slot)] += 1
+        done = sum(1 for p in patients if ran[(p, slot)])
+        per_node = {n.node_id: len(n.owned) for n in alive}
+        print(f"   {slot}: {done}/{n_patients} patients checked once in {(time.perf_counter() - start) * 1000:.0f} ms, "
+              f"partitions per node {per_node}")
+
+    print(f"🛰️ {n_nodes} nodes, {n_patients} patients, {N_PARTITIONS} partitions, {lease:.0f}s leases")
+    advance(2 * lease, nodes)
+    print(f"   leader: {[n.node_id for n in nodes if n.is_leader]}")
+    scheduled_check("07:30", nodes)
+
+    victim = next(n for n in nodes if n.is_leader)
+    survivors = [n for n in nodes if n is not victim]
+    print(f"💥 {victim.node_id} stops heartbeating (crash)")
+    scheduled_check("12:00", survivors)  # orphaned partitions are skipped until their lease expires
+    advance(3 * lease, survivors)
+    print(f"   new leader: {[n.node_id for n in survivors if n.is_leader]}")
+    scheduled_check("12:00", survivors)
+
+    # Split-brain probe: the crashed node wakes up with stale ownership and retries the same slot
+    victim.owned = {p: now[0] + lease for p in range(N_PARTITIONS)}
+    scheduled_check("12:00", [victim])
+
+    joiner = ClusterNode(LeaseStore(path), f"node{n_nodes}", lease, clock=lambda: now[0])
+    advance(3 * lease, survivors + [joiner])
+    scheduled_check("18:30", survivors + [joiner])
+
+    viewer = LeaseStore(path, read_only=True)
+    view = viewer.snapshot(now[0], lease)
+    print(f"👀 read-only view: leader {view['leader']}, {view['partitions_leased']} partitions leased, "
+          f"nodes {list(view['nodes'])}")
+    try:
+        viewer.heartbeat("viewer", now[0])
+    except sqlite3.OperationalError as e:
+        print(f"   the viewer cannot join: {e}")
+
+    duplicates = sum(1 for count in ran.values() if count > 1)
+    print(f"✅ duplicate checks: {duplicates}; claims skipped as duplicates: "
+          f"{sum(n.stats['duplicates_skipped'] for n in nodes + [joiner])}")
@@ -1,19 +1,430 @@
-# config.py - DEBUG VERSION
+# config.py - Typed settings, loaded lazily, validated once, hot-reloadable
+import json
 import os
+import signal
+import threading
+from dataclasses import dataclass, field, fields
 
-# Get these from environment - NO DEFAULTS
-TWILIO_ACCOUNT_SID = os.environ.get("TWILIO_ACCOUNT_SID", "")
-TWILIO_AUTH_TOKEN = os.environ.get("TWILIO_AUTH_TOKEN", "")
-TWILIO_PHONE_NUMBER = os.environ.get("TWILIO_PHONE_NUMBER", "")
-PATIENT_PHONE_NUMBER = os.environ.get("PATIENT_PHONE_NUMBER", "")
-
-# Debug print
-print("🔐 TWILIO CREDENTIALS LOADED:")
-print(f"   SID: {'SET' if TWILIO_ACCOUNT_SID else 'NOT SET'}")
-print(f"   TOKEN: {'SET' if TWILIO_AUTH_TOKEN else 'NOT SET'}")
-print(f"   FROM: {TWILIO_PHONE_NUMBER}")
-print(f"   TO: {PATIENT_PHONE_NUMBER}")
-
-# Medical thresholds
-LOW_GLUCOSE = 70
-HIGH_GLUCOSE = 180
\ No newline at end of file
+# Optional JSON file layered over the environment (and watched for changes)
+SETTINGS_FILE_ENV = "GLUCO_SETTINGS_FILE"
+
+
+@dataclass(frozen=True)
+class PatientThresholds:
+    hypo: float
+    hyper: float
+
+
+@dataclass(frozen=True)
+class Settings:
+    # Twilio
+    twilio_account_sid: str = ""
+    twilio_auth_token: str = ""
+    twilio_phone_number: str = ""
+    twilio_whatsapp_from: str = ""
+    patient_phone_number: str = ""
+    patient_whatsapp: str = ""
+
+    # Messages (messages.py)
+    message_locale: str = "en"  # en / fr / ar
+    sms_max_segments: int = 1
+
+    # Care teams (notifications.py): patient_id -> [{"id", "tier", "phone", "channels", "quiet_hours", ...}]
+    care_teams: dict = field(default_factory=dict)
+    escalation_minutes: float = 10.0  # no acknowledgement within this -> next tier
+    fanout_concurrency: int = 32
+
+    # Voice calls (voice_sender.py)
+    voice_concurrency: int = 4  # call-create requests in flight
+    voice_calls_per_second: float = 1.0  # Twilio's default CPS for an account
+
+    # Inbound webhooks (inbound.py)
+    webhook_signature_check: int = 1  # 0 only for local testing without Twilio
+    embedded_scheduler: int = 0  # 1 = web.py also runs main.run_scheduler, sharing ack/snooze state
+    inbound_db_path: str = "inbound_commands.db"  # replies for a separate scheduler process (shared volume)
+
+    # Delivery tracking (delivery.py)
+    status_callback_url: str = ""  # public URL of /webhooks/twilio/status; empty = no callbacks requested
+    message_ledger_path: str = "message_ledger.db"
+    delivery_deadline_seconds: float = 120.0  # critical alert not delivered by then -> next channel
+
+    # LLM
+    openai_api_key: str = ""
+    llm_model: str = "gpt-4o-mini"
+    max_tokens: int = 150
+    llm_prompt_variant: str = "compact"  # prompts.py: "compact" or "full" (the original, longer prompt)
+    llm_history_tokens: int = 60  # patient_context.py: cap on the patient history summary in the prompt; 0 = off
+    # LLM routing (llm_router.py): empty = every configured backend (openai / azure / local)
+    llm_providers: str = ""  # e.g. "openai,azure,local,stub"
+    llm_hedge_percentile: float = 0.0  # e.g. 0.95: race the next provider past that latency; 0 = off
+    llm_async_concurrency: int = 64  # aget_advice: LLM requests in flight per event loop (and pooled connections)
+    llm_http2: int = 1  # async pool speaks HTTP/2 when the optional h2 package is installed
+    azure_openai_endpoint: str = ""
+    azure_openai_api_key: str = ""
+    azure_openai_deployment: str = ""  # empty = LLM_MODEL
+    azure_openai_api_version: str = "2024-06-01"
+    local_llm_url: str = ""  # OpenAI-compatible server, e.g. http://localhost:8080/v1 (llama.cpp, vLLM)
+    local_llm_model: str = "local"
+    # Token / cost accounting (llm_usage.py); budgets in USD, 0 = unlimited
+    llm_usage_db_path: str = "llm_usage.db"
+    llm_daily_budget_usd: float = 0.0
+    llm_patient_daily_budget_usd: float = 0.0
+    llm_prices: dict = field(default_factory=dict)  # model -> [USD per 1M prompt, per 1M completion tokens]
+    advice_cache_ttl_seconds: float = 6 * 3600.0  # advice_cache.py; 0 disables caching
+    advice_cache_similarity: float = 0.6  # cosine similarity for reusing a paraphrased context's advice
+
+    # Medical thresholds (mg/dL)
+    hypo_threshold: float = 70
+    hyper_threshold: float = 180
+    patient_id: str = "default"
+    patient_thresholds: dict = field(default_factory=dict)  # patient_id -> PatientThresholds
+    patient_profiles: dict = field(default_factory=dict)  # patient_id -> preset name or schedule (profiles.py)
+
+    # Storage
+    reading_db_path: str = "glucose_readings.db"
+
+    # Nightscout sources: patient_id -> {"url": ..., "token": ...}
+    nightscout_sites: dict = field(default_factory=dict)
+    nightscout_concurrency: int = 16
+    nightscout_max_age_minutes: float = 15.0  # an older newest entry is not alerted on (sensor/uploader gap)
+
+    # Sharded mode (sharding.py): worker processes; 0 = run in-process
+    shard_workers: int = 0
+
+    # Cluster mode (cluster.py): nodes sharing this SQLite file split patients between them
+    cluster_db: str = ""  # empty = single instance
+    cluster_node_id: str = ""  # empty = hostname-pid
+    cluster_lease_seconds: float = 15.0
+
+    # Tracing
+    trace_buffer_size: int = 1000
+    trace_export_dir: str = ""  # empty = no JSON export
+
+    def thresholds_for(self, patient_id=None):
+        """(hypo, hyper) for a patient - O(1) dict lookup, global defaults otherwise"""
+        override = self.patient_thresholds.get(patient_id or self.patient_id)
+        if override is None:
+            return self.hypo_threshold, self.hyper_threshold
+        return override.hypo, override.hyper
+
+
+# Environment variable -> Settings field
+_ENV_FIELDS = {
+    "TWILIO_ACCOUNT_SID": "twilio_account_sid",
+    "TWILIO_AUTH_TOKEN": "twilio_auth_token",
+    "TWILIO_PHONE_NUMBER": "twilio_phone_number",
+    "TWILIO_WHATSAPP_FROM": "twilio_whatsapp_from",
+    "PATIENT_SMS": "patient_phone_number",
+    "PATIENT_PHONE_NUMBER": "patient_phone_number",
+    "PATIENT_PHONE_WHATSAPP": "patient_whatsapp",  # name used in render.yaml
+    "PATIENT_WHATSAPP": "patient_whatsapp",
+    "MESSAGE_LOCALE": "message_locale",
+    "SMS_MAX_SEGMENTS": "sms_max_segments",
+    "ESCALATION_MINUTES": "escalation_minutes",
+    "FANOUT_CONCURRENCY": "fanout_concurrency",
+    "VOICE_CONCURRENCY": "voice_concurrency",
+    "VOICE_CALLS_PER_SECOND": "voice_calls_per_second",
+    "WEBHOOK_SIGNATURE_CHECK": "webhook_signature_check",
+    "EMBEDDED_SCHEDULER": "embedded_scheduler",
+    "INBOUND_DB_PATH": "inbound_db_path",
+    "STATUS_CALLBACK_URL": "status_callback_url",
+    "MESSAGE_LEDGER_PATH": "message_ledger_path",
+    "DELIVERY_DEADLINE_SECONDS": "delivery_deadline_seconds",
+    "OPENAI_API_KEY": "openai_api_key",
+    "LLM_MODEL": "llm_model",
+    "MAX_TOKENS": "max_tokens",
+    "LLM_PROMPT_VARIANT": "llm_prompt_variant",
+    "LLM_HISTORY_TOKENS": "llm_history_tokens",
+    "LLM_PROVIDERS": "llm_providers",
+    "LLM_HEDGE_PERCENTILE": "llm_hedge_percentile",
+    "LLM_ASYNC_CONCURRENCY": "llm_async_concurrency",
+    "LLM_HTTP2": "llm_http2",
+    "AZURE_OPENAI_ENDPOINT": "azure_openai_endpoint",
+    "AZURE_OPENAI_API_KEY": "azure_openai_api_key",
+    "AZURE_OPENAI_DEPLOYMENT": "azure_openai_deployment",
+    "AZURE_OPENAI_API_VERSION": "azure_openai_api_version",
+    "LOCAL_LLM_URL": "local_llm_url",
+    "LOCAL_LLM_MODEL": "local_llm_model",
+    "LLM_USAGE_DB_PATH": "llm_usage_db_path",
+    "LLM_DAILY_BUDGET_USD": "llm_daily_budget_usd",
+    "LLM_PATIENT_DAILY_BUDGET_USD": "llm_patient_daily_budget_usd",
+    "ADVICE_CACHE_TTL_SECONDS": "advice_cache_ttl_seconds",
+    "ADVICE_CACHE_SIMILARITY": "advice_cache_similarity",
+    "HYPO_THRESHOLD": "hypo_threshold",
+    "HYPER_THRESHOLD": "hyper_threshold",
+    "PATIENT_ID": "patient_id",
+    "READING_DB_PATH": "reading_db_path",
+    "NIGHTSCOUT_CONCURRENCY": "nightscout_concurrency",
+    "NIGHTSCOUT_MAX_AGE_MINUTES": "nightscout_max_age_minutes",
+    "SHARD_WORKERS": "shard_workers",
+    "CLUSTER_DB": "cluster_db",
+    "CLUSTER_NODE_ID": "cluster_node_id",
+    "CLUSTER_LEASE_SECONDS": "cluster_lease_seconds",
+    "TRACE_BUFFER_SIZE": "trace_buffer_size",
+    "TRACE_EXPORT_DIR": "trace_export_dir",
+}
+
+_FIELD_TYPES = {f.name: f.type for f in fields(Settings)}
+
+
+def _coerce(name, value):
+    kind = _FIELD_TYPES[name]
+    if kind in ("dict", dict):
+        if not isinstance(value, dict):
+            raise ValueError(f"Invalid value for {name}: expected an object")
+        return value
+    try:
+        if kind in ("int", int):
+            return int(value)
+        if kind in ("float", float):
+            return float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid value for {name}: {value!r}")
+    return str(value)
+
+
+def _parse_patient_thresholds(raw):
+    """Accept {"p1": {"hypo": 80, "hyper": 200}} or "p1:80:200,p2:65:250" """
+    if isinstance(raw, str):
+        entries = {}
+        for item in filter(None, (part.strip() for part in raw.split(","))):
+            try:
+                patient_id, hypo, hyper = item.split(":")
+            except ValueError:
+                raise ValueError(f"Invalid patient threshold entry: {item!r}")
+            entries[patient_id] = {"hypo": hypo, "hyper": hyper}
+        raw = entries
+
+    thresholds = {}
+    for patient_id, values in (raw or {}).items():
+        try:
+            thresholds[str(patient_id)] = PatientThresholds(float(values["hypo"]), float(values["hyper"]))
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f"Invalid thresholds for patient {patient_id!r}: {values!r}")
+    return thresholds
+
+
+def _validate(settings):
+    if settings.max_tokens <= 0:
+        raise ValueError("MAX_TOKENS must be positive")
+    if settings.llm_prompt_variant not in ("compact", "full"):
+        raise ValueError("LLM_PROMPT_VARIANT must be 'compact' or 'full'")
+    if settings.llm_history_tokens < 0:
+        raise ValueError("LLM_HISTORY_TOKENS cannot be negative")
+    if not 0 <= settings.llm_hedge_percentile < 1:
+        raise ValueError("LLM_HEDGE_PERCENTILE must be in [0, 1)")
+    if settings.llm_async_concurrency <= 0:
+        raise ValueError("LLM_ASYNC_CONCURRENCY must be positive")
+    if settings.llm_daily_budget_usd < 0 or settings.llm_patient_daily_budget_usd < 0:
+        raise ValueError("LLM budgets cannot be negative")
+    for model, prices in settings.llm_prices.items():
+        if not (isinstance(prices, (list, tuple)) and len(prices) == 2):
+            raise ValueError(f"LLM price for {model!r} must be [prompt, completion] USD per 1M tokens")
+    if settings.advice_cache_ttl_seconds < 0:
+        raise ValueError("ADVICE_CACHE_TTL_SECONDS cannot be negative")
+    if not 0 < settings.advice_cache_similarity <= 1:
+        raise ValueError("ADVICE_CACHE_SIMILARITY must be in (0, 1]")
+    if settings.trace_buffer_size <= 0:
+        raise ValueError("TRACE_BUFFER_SIZE must be positive")
+    if settings.nightscout_concurrency <= 0:
+        raise ValueError("NIGHTSCOUT_CONCURRENCY must be positive")
+    if settings.nightscout_max_age_minutes <= 0:
+        raise ValueError("NIGHTSCOUT_MAX_AGE_MINUTES must be positive")
+    if settings.escalation_minutes <= 0:
+        raise ValueError("ESCALATION_MINUTES must be positive")
+    if settings.delivery_deadline_seconds <= 0:
+        raise ValueError("DELIVERY_DEADLINE_SECONDS must be positive")
+    if settings.fanout_concurrency <= 0:
+        raise ValueError("FANOUT_CONCURRENCY must be positive")
+    if settings.voice_concurrency <= 0 or settings.voice_calls_per_second <= 0:
+        raise ValueError("VOICE_CONCURRENCY and VOICE_CALLS_PER_SECOND must be positive")
+    if settings.care_teams:
+        from notifications import parse_care_team  # deferred: notifications imports config
+        for patient_id, team in settings.care_teams.items():
+            if not isinstance(team, list):
+                raise ValueError(f"Care team for {patient_id!r} must be a list of recipients")
+            parse_care_team(patient_id, team)  # the same parse CareGraph runs after a reload
+    if settings.sms_max_segments <= 0:
+        raise ValueError("SMS_MAX_SEGMENTS must be positive")
+    if settings.shard_workers < 0:
+        raise ValueError("SHARD_WORKERS cannot be negative")
+    if settings.cluster_lease_seconds <= 0:
+        raise ValueError("CLUSTER_LEASE_SECONDS must be positive")
+    for patient_id, site in settings.nightscout_sites.items():
+        if not isinstance(site, dict) or not site.get("url"):
+            raise ValueError(f"Nightscout site for {patient_id!r} needs a url")
+    if settings.patient_profiles:
+        from profiles import PRESETS, expand_schedule  # deferred: numpy, and profiles imports config
+        for patient_id, schedule in settings.patient_profiles.items():
+            if isinstance(schedule, str) and schedule not in PRESETS:
+                raise ValueError(f"Unknown profile preset {schedule!r} for {patient_id!r}")
+            try:
+                expand_schedule(PRESETS[schedule] if isinstance(schedule, str) else schedule)
+            except (TypeError, ValueError, IndexError) as e:
+                raise ValueError(f"Invalid profile for {patient_id!r}: {e}")
+    checks = [("global", settings.hypo_threshold, settings.hyper_threshold)]
+    checks += [(pid, t.hypo, t.hyper) for pid, t in settings.patient_thresholds.items()]
+    for name, hypo, hyper in checks:
+        if not 0 < hypo < hyper:
+            raise ValueError(f"Invalid thresholds for {name}: hypo={hypo}, hyper={hyper}")
+
+
+def load_settings(environ=None, path=None):
+    """Build and validate Settings from the environment plus the optional JSON file"""
+    environ = os.environ if environ is None else environ
+    values = {}
+    for env_key, name in _ENV_FIELDS.items():
+        if environ.get(env_key):
+            values[name] = _coerce(name, environ[env_key])
+    patient_thresholds = _parse_patient_thresholds(environ.get("PATIENT_THRESHOLDS", ""))
+
+    path = environ.get(SETTINGS_FILE_ENV, "") if path is None else path
+    if path:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        patient_thresholds.update(_parse_patient_thresholds(data.pop("patient_thresholds", {})))
+        for name, value in data.items():
+            if name not in _FIELD_TYPES:
+                raise ValueError(f"Unknown setting in {path}: {name}")
+            values[name] = _coerce(name, value)
+
+    settings = Settings(patient_thresholds=patient_thresholds, **values)
+    _validate(settings)
+    return settings
+
+
+def _print_summary(settings):
+    print("🔐 TWILIO CREDENTIALS LOADED:")
+    print(f"   SID: {'SET' if settings.twilio_account_sid else 'NOT SET'}")
+    print(f"   TOKEN: {'SET' if settings.twilio_auth_token else 'NOT SET'}")
+    print(f"   FROM: {settings.twilio_phone_number}")
+    print(f"   TO: {settings.patient_phone_number}")
+
+
+class SettingsManager:
+    def __init__(self, loader=load_settings):
+        self._loader = loader
+        self._settings = None
+        self._lock = threading.Lock()
+        self._file_mtime = None
+        self._watcher = None
+        self._reload_requested = threading.Event()  # set by SIGHUP, served by the watcher thread
+        self.load_count = 0
+        self.reload_errors = 0
+
+    def get(self):
+        """Cached settings; the first call loads and validates them"""
+        settings = self._settings
+        if settings is None:
+            with self._lock:
+                if self._settings is None:
+                    self._settings = self._loader()
+                    self._file_mtime = self._current_mtime()
+                    self.load_count += 1
+                    _print_summary(self._settings)
+                settings = self._settings
+        return settings
+
+    def reload(self):
+        """Re-read settings; on validation errors keep the previous ones"""
+        try:
+            settings = self._loader()
+        except (OSError, ValueError) as e:
+            self.reload_errors += 1
+            print(f"⚠️ Settings reload failed, keeping previous settings: {e}")
+            return False
+        with self._lock:
+            self._settings = settings
+            self._file_mtime = self._current_mtime()
+            self.load_count += 1
+        print("🔄 Settings reloaded")
+        return True
+
+    def _current_mtime(self):
+        path = os.environ.get(SETTINGS_FILE_ENV, "")
+        try:
+            return os.stat(path).st_mtime if path else None
+        except OSError:
+            return None
+
+    def watch(self, interval=5.0):
+        """Reload on SIGHUP and whenever the settings file changes. The handler only flags the
+        reload: it runs on the main thread between bytecodes, possibly while that thread holds
+        self._lock, so reloading there could deadlock."""
+        if hasattr(signal, "SIGHUP") and threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGHUP, lambda signum, frame: self._reload_requested.set())
+
+        if self._watcher is not None:
+            return
+
+        def _poll():
+            while True:
+                requested = self._reload_requested.wait(interval)
+                self._reload_requested.clear()
+                if requested or (self._settings is not None and self._current_mtime() != self._file_mtime):
+                    self.reload()
+
+        self._watcher = threading.Thread(target=_poll, name="settings-watcher", daemon=True)
+        self._watcher.start()
+
+
+# Global instance
+settings_manager = SettingsManager()
+
+
+def get_settings():
+    """Public interface - cheap enough to call on every check"""
+    return settings_manager.get()
+
+
+# Legacy module-level names (`from config import LOW_GLUCOSE`) resolve lazily.
+# They are a snapshot: hot-path code should call get_settings() instead.
+_LEGACY_NAMES = {
+    "TWILIO_ACCOUNT_SID": "twilio_account_sid",
+    "TWILIO_AUTH_TOKEN": "twilio_auth_token",
+    "TWILIO_PHONE_NUMBER": "twilio_phone_number",
+    "TWILIO_WHATSAPP_FROM": "twilio_whatsapp_from",
+    "PATIENT_PHONE_NUMBER": "patient_phone_number",
+    "OPENAI_API_KEY": "openai_api_key",
+    "LLM_MODEL": "llm_model",
+    "MAX_TOKENS": "max_tokens",
+    "LOW_GLUCOSE": "hypo_threshold",
+    "HIGH_GLUCOSE": "hyper_threshold",
+    "HYPO_THRESHOLD": "hypo_threshold",
+    "HYPER_THRESHOLD": "hyper_threshold",
+    "TRACE_BUFFER_SIZE": "trace_buffer_size",
+    "TRACE_EXPORT_DIR": "trace_export_dir",
+}
+
+
+def __getattr__(name):
+    if name in _LEGACY_NAMES:
+        return getattr(get_settings(), _LEGACY_NAMES[name])
+    raise AttributeError(f"module 'config' has no attribute {name!r}")
+
+
+# 🔬 Test function
+if __name__ == "__main__":
+    import timeit
+
+    print("⚙️ Testing settings...")
+    settings = get_settings()
+    print(f"   Thresholds (default): {settings.thresholds_for()}")
+
+    overrides = load_settings({"PATIENT_THRESHOLDS": "p1:80:200,p2:65:250"})
+    print(f"   Thresholds (p1): {overrides.thresholds_for('p1')}")
+    print(f"   Thresholds (unknown): {overrides.thresholds_for('nobody')}")
+
+    try:
+        load_settings({"HYPO_THRESHOLD": "200", "HYPER_THRESHOLD": "100"})
+    except ValueError as e:
+        print(f"   Rejected invalid settings: {e}")
+
+    # Hot-path cost of reading a setting
+    n = 1_000_000
+    per_read = timeit.timeit("get_settings().hypo_threshold", globals=globals(), number=n) / n
+    per_lookup = timeit.timeit("s.thresholds_for('p1')", globals={"s": overrides}, number=n) / n
+    print(f"⏱️ get_settings().hypo_threshold: {per_read * 1e9:.0f} ns/read")
+    print(f"⏱️ thresholds_for(patient): {per_lookup * 1e9:.0f} ns/lookup")
+    print(f"   Loads so far: {settings_manager.load_count}")
+    print("\n✅ Settings test complete")
@@ -0,0 +1,480 @@
+# delivery.py - Twilio status callbacks, SID-indexed message ledger, fallback for undelivered critical alerts
+import json
+import sqlite3
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from alert_state import CRITICAL_LOW
+from clock import get_clock
+from config import get_settings
+
+# Ledger status codes double as their order: a late "sent" never overwrites "delivered"
+STATUSES = ("queued", "sent", "failed", "delivered", "read")
+_CODES = {name: code for code, name in enumerate(STATUSES)}
+_TIME_COLUMNS = ("queued_at", "sent_at", "failed_at", "delivered_at", "read_at")
+
+# Twilio MessageStatus -> ledger status
+TWILIO_STATUSES = {
+    "accepted": "queued", "scheduled": "queued", "queued": "queued",
+    "sending": "sent", "sent": "sent",
+    "delivered": "delivered", "read": "read",
+    "undelivered": "failed", "failed": "failed", "canceled": "failed",
+    # CallStatus (voice_sender.py): an answered call counts as delivered
+    "initiated": "sent", "ringing": "sent", "in-progress": "delivered", "completed": "delivered",
+    "busy": "failed", "no-answer": "failed",
+}
+
+# A critical alert not delivered in time is re-sent on the first channel here that has a sender
+FALLBACK_CHAIN = {"whatsapp": ("sms", "voice"), "sms": ("voice",)}
+# Channels only some critical alerts may fall back to: a phone call is for severe lows, like
+# AlertFanout.escalate_due; a high above CRITICAL_HIGH stays on messaging
+FALLBACK_ELIGIBLE = {"voice": lambda alert: alert["glucose"] is not None and alert["glucose"] < CRITICAL_LOW}
+
+
+class MessageLedger:
+    """One compact row per outbound message: integer status code and epoch-ms timestamps.
+
+    The SID is the primary key (WITHOUT ROWID, so SID lookups are one B-tree descent)
+    and (patient_id, queued_at) is indexed for per-patient history.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            " sid TEXT PRIMARY KEY,"
+            " patient_id TEXT NOT NULL DEFAULT '',"
+            " alert_id TEXT NOT NULL DEFAULT '',"
+            " channel TEXT NOT NULL DEFAULT '',"
+            " recipient TEXT NOT NULL DEFAULT '',"
+            " critical INTEGER NOT NULL DEFAULT 0,"
+            " status INTEGER NOT NULL DEFAULT 0,"
+            " error_code INTEGER,"
+            " queued_at INTEGER, sent_at INTEGER, failed_at INTEGER, delivered_at INTEGER, read_at INTEGER,"
+            " fallback_sid TEXT"
+            ") WITHOUT ROWID;"
+            "CREATE INDEX IF NOT EXISTS messages_by_patient ON messages (patient_id, queued_at);"
+            # Critical messages awaiting delivery, with what a fallback needs to re-send them. Shared, so a
+            # status callback landing in the web process can fall back for an alert sent by the scheduler.
+            "CREATE TABLE IF NOT EXISTS pending ("
+            " sid TEXT PRIMARY KEY,"
+            " deadline INTEGER NOT NULL,"
+            " alert TEXT NOT NULL"
+            ") WITHOUT ROWID;"
+            "CREATE INDEX IF NOT EXISTS pending_by_deadline ON pending (deadline);"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+        self._updates = {
+            code: (f"INSERT INTO messages (sid, status, {column}, error_code) VALUES (?, ?, ?, ?)"
+                   f" ON CONFLICT (sid) DO UPDATE SET status = MAX(status, excluded.status),"
+                   f" {column} = COALESCE({column}, excluded.{column}),"
+                   f" error_code = COALESCE(excluded.error_code, error_code)")
+            for code, column in enumerate(_TIME_COLUMNS)
+        }
+
+    def add_many(self, rows):
+        """Insert sent messages: (sid, patient_id, alert_id, channel, recipient, critical, status, at_ms)"""
+        batch = []
+        for sid, patient_id, alert_id, channel, recipient, critical, status, at_ms in rows:
+            code = _CODES[status]
+            times = [at_ms, None, None, None, None]
+            times[code] = at_ms
+            batch.append((sid, patient_id, alert_id, channel, recipient, int(critical), code, *times))
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO messages (sid, patient_id, alert_id, channel, recipient, critical, status, "
+                + ", ".join(_TIME_COLUMNS) + ") VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (sid) DO UPDATE SET patient_id = excluded.patient_id,"
+                " alert_id = excluded.alert_id, channel = excluded.channel, recipient = excluded.recipient,"
+                " critical = excluded.critical, status = MAX(status, excluded.status),"
+                " queued_at = COALESCE(queued_at, excluded.queued_at)", batch
+            )
+            self._conn.commit()
+        return len(rows)
+
+    def add(self, sid, patient_id="", alert_id="", channel="", recipient="", critical=False, status="queued",
+            at_ms=None):
+        at_ms = int(get_clock().time() * 1000) if at_ms is None else at_ms
+        return self.add_many([(sid, patient_id, alert_id, channel, recipient, critical, status, at_ms)])
+
+    def update_many(self, updates):
+        """Apply status transitions: (sid, status, at_ms, error_code); unknown SIDs get a bare row"""
+        by_status = {}
+        for sid, status, at_ms, error_code in updates:
+            code = _CODES[status]
+            by_status.setdefault(code, []).append((sid, code, at_ms, error_code))
+        with self._lock:
+            for code, batch in by_status.items():
+                self._conn.executemany(self._updates[code], batch)
+            self._conn.commit()
+        return len(updates)
+
+    def update(self, sid, status, at_ms=None, error_code=None):
+        at_ms = int(get_clock().time() * 1000) if at_ms is None else at_ms
+        return self.update_many([(sid, status, at_ms, error_code)])
+
+    def set_fallback(self, sid, fallback_sid):
+        with self._lock:
+            self._conn.execute("UPDATE messages SET fallback_sid = ? WHERE sid = ?", (fallback_sid, sid))
+            self._conn.commit()
+
+    def add_pending(self, sid, deadline_ms, alert):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO pending (sid, deadline, alert) VALUES (?, ?, ?)",
+                               (sid, deadline_ms, json.dumps(alert)))
+            self._conn.commit()
+
+    def claim_pending(self, sid):
+        """Remove and return one pending alert; None if it was delivered or another process claimed it"""
+        with self._lock:
+            row = self._conn.execute("DELETE FROM pending WHERE sid = ? RETURNING alert", (sid,)).fetchone()
+            self._conn.commit()
+        return None if row is None else json.loads(row[0])
+
+    def claim_due(self, now_ms):
+        """Remove and return every pending alert whose deadline has passed"""
+        with self._lock:
+            rows = self._conn.execute("DELETE FROM pending WHERE deadline <= ? RETURNING alert", (now_ms,)).fetchall()
+            self._conn.commit()
+        return [json.loads(alert) for alert, in rows]
+
+    def pending_count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM pending").fetchone()[0]
+
+    @staticmethod
+    def _row(row):
+        if row is None:
+            return None
+        (sid, patient_id, alert_id, channel, recipient, critical, status, error_code, *times, fallback_sid) = row
+        return {
+            "sid": sid, "patient_id": patient_id, "alert_id": alert_id, "channel": channel,
+            "recipient": recipient, "critical": bool(critical), "status": STATUSES[status],
+            "error_code": error_code, "fallback_sid": fallback_sid,
+            **{column: at for column, at in zip(_TIME_COLUMNS, times) if at is not None},
+        }
+
+    _COLUMNS = ("sid, patient_id, alert_id, channel, recipient, critical, status, error_code, "
+                + ", ".join(_TIME_COLUMNS) + ", fallback_sid")
+
+    def status(self, sid):
+        """Current status name for a SID (None if it was never seen)"""
+        with self._lock:
+            row = self._conn.execute("SELECT status FROM messages WHERE sid = ?", (sid,)).fetchone()
+        return None if row is None else STATUSES[row[0]]
+
+    def get(self, sid):
+        with self._lock:
+            row = self._conn.execute(f"SELECT {self._COLUMNS} FROM messages WHERE sid = ?", (sid,)).fetchone()
+        return self._row(row)
+
+    def for_patient(self, patient_id, limit=50):
+        """Newest messages first"""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {self._COLUMNS} FROM messages WHERE patient_id = ? ORDER BY queued_at DESC LIMIT ?",
+                (patient_id, limit),
+            ).fetchall()
+        return [self._row(row) for row in rows]
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _phone(address):
+    return (address or "").replace("whatsapp:", "")
+
+
+def _fallback_sms(to, alert):
+    from sms_sender import send_sms_alert
+    return send_sms_alert(alert["glucose"], alert["timestamp"], alert["advice"], to=_phone(to),
+                          locale=alert.get("locale"), kind=alert.get("kind"))
+
+
+def _fallback_voice(to, alert):
+    from voice_sender import send_voice_alert
+    return send_voice_alert(alert["glucose"], alert["timestamp"], alert["advice"], to=_phone(to),
+                            locale=alert.get("locale"), kind=alert.get("kind"))
+
+
+# channel -> fn(address, alert) -> (ok, sid or error)
+FALLBACK_SENDERS = {"sms": _fallback_sms, "voice": _fallback_voice}
+
+
+class DeliveryTracker:
+    """Records sends and status callbacks in the ledger; re-sends critical alerts that miss their deadline.
+
+    Deadlines are only armed when Twilio is asked for status callbacks (STATUS_CALLBACK_URL):
+    without them no message ever reports "delivered". Pending alerts live in the ledger, so any
+    process sharing it (web.py receives the callbacks) can fall back for them.
+    """
+
+    def __init__(self, ledger=None, senders=None, deadline_seconds=None, callbacks=None):
+        self._ledger = ledger
+        self.senders = dict(FALLBACK_SENDERS if senders is None else senders)
+        self.deadline_seconds = deadline_seconds
+        self.callbacks = callbacks  # None = whether settings.status_callback_url is set
+        self.stats = Counter()
+        self._executor = None
+        self._ticker = None
+        self._lock = threading.Lock()
+
+    @property
+    def ledger(self):
+        if self._ledger is None:
+            with self._lock:
+                if self._ledger is None:
+                    self._ledger = MessageLedger(get_settings().message_ledger_path)
+        return self._ledger
+
+    def _deadline_s(self):
+        return self.deadline_seconds or get_settings().delivery_deadline_seconds
+
+    def _callbacks(self):
+        return bool(get_settings().status_callback_url) if self.callbacks is None else self.callbacks
+
+    def track(self, sid, channel, to, patient_id="", alert_id="", glucose=None, timestamp="", advice="",
+              locale=None, critical=False, status="queued", kind=None):
+        """Ledger row for a message Twilio accepted; critical ones get a delivery deadline"""
+        now = get_clock().time()
+        self.ledger.add(sid, patient_id, alert_id or "", channel, to, critical, TWILIO_STATUSES.get(status, "queued"),
+                        int(now * 1000))
+        self.stats["tracked"] += 1
+        if critical and self._callbacks():
+            alert = {"sid": sid, "channel": channel, "to": to, "patient_id": patient_id, "alert_id": alert_id,
+                     "glucose": glucose, "timestamp": timestamp, "advice": advice, "locale": locale, "kind": kind}
+            self.ledger.add_pending(sid, int((now + self._deadline_s()) * 1000), alert)
+            self._ensure_ticker()
+
+    def on_status(self, sid, twilio_status, error_code=None):
+        """Apply a status callback; an undelivered critical message falls back right away"""
+        status = TWILIO_STATUSES.get((twilio_status or "").lower())
+        if not sid or status is None:
+            self.stats["ignored"] += 1
+            return None
+        self.ledger.update(sid, status, error_code=int(error_code) if error_code else None)
+        self.stats[status] += 1
+        if status in ("delivered", "read"):
+            self.ledger.claim_pending(sid)
+        elif status == "failed":
+            alert = self.ledger.claim_pending(sid)
+            if alert is not None:
+                self._pool().submit(self._fall_back, alert, "failed")
+        return status
+
+    def check_deadlines(self):
+        """Fall back for every critical message still undelivered at its deadline"""
+        due = self.ledger.claim_due(int(get_clock().time() * 1000))
+        for alert in due:
+            if self.ledger.status(alert["sid"]) in ("delivered", "read"):
+                continue
+            self._fall_back(alert, "deadline")
+        return len(due)
+
+    def _fall_back(self, alert, reason):
+        """Re-send on the next channel of FALLBACK_CHAIN that accepts it; returns the new SID"""
+        for channel in FALLBACK_CHAIN.get(alert["channel"], ()):
+            sender = self.senders.get(channel)
+            eligible = FALLBACK_ELIGIBLE.get(channel)
+            if sender is None or eligible is not None and not eligible(alert):
+                continue
+            try:
+                ok, ref = sender(alert["to"], alert)
+            except Exception as e:
+                ok, ref = False, f"{type(e).__name__}: {str(e)[:100]}"
+            if not ok:
+                self.stats["fallback_failed"] += 1
+                print(f"❌ Fallback {alert['channel']} → {channel} for {alert['sid'][:8]} failed: {ref}")
+                continue
+            self.stats["fallbacks"] += 1
+            print(f"🔁 Critical alert {alert['sid'][:8]} {reason} on {alert['channel']} → re-sent by {channel}")
+            self.ledger.set_fallback(alert["sid"], ref)
+            self.track(ref, channel, alert["to"], alert["patient_id"], alert["alert_id"], alert["glucose"],
+                       alert["timestamp"], alert["advice"], alert["locale"], critical=True, kind=alert["kind"])
+            return ref
+        self.stats["no_fallback"] += 1
+        print(f"🚨 Critical alert {alert['sid'][:8]} {reason} on {alert['channel']} - no fallback channel left")
+        return None
+
+    def _pool(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="delivery")
+        return self._executor
+
+    def _ensure_ticker(self, interval=5.0):
+        if self._ticker is not None:
+            return
+        with self._lock:
+            if self._ticker is not None:
+                return
+
+            def _tick():
+                while True:
+                    time.sleep(interval)  # real time: deadlines themselves come from get_clock()
+                    self.check_deadlines()
+
+            self._ticker = threading.Thread(target=_tick, name="delivery-deadlines", daemon=True)
+        self._ticker.start()
+
+    def pending(self):
+        return self.ledger.pending_count()
+
+    def resume(self):
+        """Arm the ticker at startup for pending rows left by a previous run; otherwise their
+        deadlines would wait for the next track(). Returns the number pending."""
+        pending = self.ledger.pending_count()
+        if pending:
+            print(f"📒 {pending} critical message(s) awaiting delivery - deadline checks resumed")
+            self._ensure_ticker()
+        return pending
+
+
+# Global instance
+delivery_tracker = DeliveryTracker()
+
+
+def track_delivery(sid, channel, to, **alert):
+    """Public interface for the senders' callers - never lets ledger trouble break an alert"""
+    try:
+        delivery_tracker.track(sid, channel, to, **alert)
+    except sqlite3.Error as e:
+        print(f"⚠️ Message ledger unavailable ({e}); {sid[:8]} not tracked")
+
+
+def resume_deliveries():
+    """Public interface for startup (main.py, web.py)"""
+    try:
+        return delivery_tracker.resume()
+    except sqlite3.Error as e:
+        print(f"⚠️ Message ledger unavailable ({e}); pending deliveries not resumed")
+        return 0
+
+
+def accept_status(url, params, signature):
+    """Status-callback webhook entry point -> HTTP status"""
+    from inbound import verify_signature
+    if not verify_signature(url, params, signature):
+        delivery_tracker.stats["bad_signature"] += 1
+        return 403
+    delivery_tracker.on_status(params.get("MessageSid") or params.get("SmsSid") or params.get("CallSid"),
+                               params.get("MessageStatus") or params.get("SmsStatus") or params.get("CallStatus"),
+                               params.get("ErrorCode"))
+    return 204
+
+
+# 🔬 Benchmark: a multi-million-row ledger, SID/patient lookups, callback throughput and deadline fallback
+if __name__ == "__main__":
+    import contextlib
+    import os
+    import random
+    import sys
+    import tempfile
+    from datetime import datetime
+    from clock import VirtualClock, set_clock
+
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    n_patients = 10_000
+    ledger = MessageLedger(os.path.join(tempfile.mkdtemp(), "ledger.db"))
+    base = 1_700_000_000_000
+    start = time.perf_counter()
+    batch = 100_000
+    for offset in range(0, n_rows, batch):
+        ledger.add_many([(f"SM{i:032x}", f"p{i % n_patients}", f"A{i}", "whatsapp" if i % 4 else "sms",
+                          f"+961{i % n_patients:07d}", i % 10 == 0, "queued", base + i * 1000)
+                         for i in range(offset, min(offset + batch, n_rows))])
+    inserted = time.perf_counter() - start
+    print(f"📒 {n_rows:,} messages inserted in {inserted:.1f}s ({n_rows / inserted:,.0f} rows/s), "
+          f"{os.path.getsize(ledger.path) / n_rows:.0f} B/row")
+
+    start = time.perf_counter()
+    for offset in range(0, n_rows, batch):
+        ledger.update_many([(f"SM{i:032x}", "sent", base + i * 1000 + 800, None)
+                            for i in range(offset, min(offset + batch, n_rows))])
+        ledger.update_many([(f"SM{i:032x}", "delivered" if i % 50 else "failed", base + i * 1000 + 2500,
+                             None if i % 50 else 63016) for i in range(offset, min(offset + batch, n_rows))])
+    updated = time.perf_counter() - start
+    print(f"   {2 * n_rows:,} batched transitions in {updated:.1f}s ({2 * n_rows / updated:,.0f}/s)")
+
+    probes = [f"SM{random.randrange(n_rows):032x}" for _ in range(20_000)]
+    start = time.perf_counter()
+    for sid in probes:
+        ledger.get(sid)
+    by_sid = (time.perf_counter() - start) / len(probes)
+    patients = [f"p{random.randrange(n_patients)}" for _ in range(2_000)]
+    start = time.perf_counter()
+    for patient_id in patients:
+        ledger.for_patient(patient_id, 20)
+    by_patient = (time.perf_counter() - start) / len(patients)
+    print(f"⏱️ lookup by SID {by_sid * 1e6:.1f} µs, last 20 by patient {by_patient * 1e6:.0f} µs")
+    print(f"   {ledger.get(probes[0])}")
+
+    # Callbacks one at a time, as Twilio sends them (ledger write + commit per request)
+    clock = VirtualClock(datetime(2025, 1, 6, 12, 0))
+    set_clock(clock)
+    resent = []
+    tracker = DeliveryTracker(ledger, {"sms": lambda to, alert: (resent.append(to) or True, f"SMfb{len(resent)}"),
+                                       "voice": lambda to, alert: (True, f"CA{len(resent)}")}, 120, callbacks=True)
+    n_live = 5_000
+    sids = [f"SMlive{i:028d}" for i in range(n_live)]
+    for i, sid in enumerate(sids):
+        tracker.track(sid, "whatsapp", f"whatsapp:+961{i:07d}", patient_id=f"p{i}", glucose=48, critical=i % 2 == 0)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):  # one line per fallback
+        start = time.perf_counter()
+        callbacks = 0
+        for i, sid in enumerate(sids):
+            tracker.on_status(sid, "sent")
+            callbacks += 1
+            if i % 10:
+                tracker.on_status(sid, "delivered")
+                callbacks += 1
+            elif i % 20 == 0:
+                tracker.on_status(sid, "undelivered", "63016")
+                callbacks += 1
+        per = (time.perf_counter() - start) / callbacks
+        tracker._pool().shutdown(wait=True)
+        immediate = tracker.stats["fallbacks"]
+        clock.advance(121)
+        start = time.perf_counter()
+        tracker.check_deadlines()
+        sweep = time.perf_counter() - start
+    print(f"📬 {callbacks:,} status callbacks: {per * 1e6:.0f} µs each; "
+          f"{immediate} immediate fallbacks for failed critical WhatsApp alerts")
+    print(f"⏰ deadline sweep: {sweep * 1e3:.1f} ms, {dict(tracker.stats)}")
+    print(f"   {ledger.count():,} rows in the ledger")
+
+    # The scheduler process sends, web.py gets the callback: both only share the ledger file
+    fallbacks = []
+    sender = DeliveryTracker(MessageLedger(ledger.path), {}, 120, callbacks=True)
+    web = DeliveryTracker(MessageLedger(ledger.path), {"sms": lambda to, alert: (fallbacks.append(alert) or True,
+                                                                                 "SMweb")}, 120, callbacks=True)
+    sender.track("SMshared", "whatsapp", "whatsapp:+9610000001", patient_id="p1", glucose=45, critical=True,
+                 kind="low")
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        web.on_status("SMshared", "undelivered", "63016")
+        web._pool().shutdown(wait=True)
+    calls = []
+    voice = DeliveryTracker(ledger, {"voice": lambda to, alert: (calls.append(alert["glucose"]) or True, "CAx")}, 120,
+                            callbacks=True)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for sid, glucose in (("SMhigh", 320), ("SMlow", 45)):
+            voice.track(sid, "sms", "+9610000003", glucose=glucose, critical=True)
+            voice.on_status(sid, "failed")
+        voice._pool().shutdown(wait=True)
+    print(f"📞 failed critical SMS → voice only for severe lows: called for {calls} of [320, 45]")
+    armed = ledger.pending_count()
+    DeliveryTracker(ledger, {}, 120, callbacks=False).track("SMquiet", "whatsapp", "whatsapp:+9610000002",
+                                                             glucose=45, critical=True)
+    print(f"🔀 failure callback in another process: fell back for {[a['sid'] for a in fallbacks]} "
+          f"(kind {fallbacks[0]['kind']}); without callbacks {ledger.pending_count() - armed} deadlines armed")
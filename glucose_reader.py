@@ -1,6 +1,6 @@
 # glucose_reader.py
 import random
-from datetime import datetime
+from clock import get_clock
 
 def read_glucose_level():
     """Generate realistic synthetic glucose reading"""
@@ -10,12 +10,12 @@ def read_glucose_level():
     # 5% chance of abnormal reading
     if random.random() < 0.05:
         if random.random() < 0.5:
-            return {"glucose": 62, "timestamp": datetime.now().isoformat(), "trend": "falling"}
+            return {"glucose": 62, "timestamp": get_clock().now().isoformat(), "trend": "falling"}
         else:
-            return {"glucose": 190, "timestamp": datetime.now().isoformat(), "trend": "rising"}
+            return {"glucose": 190, "timestamp": get_clock().now().isoformat(), "trend": "rising"}
     
     return {
         "glucose": base_level,
-        "timestamp": datetime.now().isoformat(),
+        "timestamp": get_clock().now().isoformat(),
         "trend": "stable"
     }
\ No newline at end of file
@@ -0,0 +1,335 @@
+# inbound.py - Replies from patients/caregivers (Twilio SMS + WhatsApp webhooks): ack, snooze, check, schedule
+import queue
+import re
+import sqlite3
+import threading
+from collections import Counter
+from html import escape
+from clock import get_clock
+from config import get_settings
+
+QUEUE_SIZE = 10_000  # bursts beyond this get 503 (Twilio logs the failure) instead of unbounded memory
+DEFAULT_SNOOZE_MINUTES = 30
+MAX_SNOOZE_MINUTES = 12 * 60
+COMMAND_RETENTION_S = 7 * 86400  # stored acks/snoozes older than this are pruned (schedules are kept)
+
+_ACK = re.compile(r"^(ok|okay|ack|yes|got it|done|👍|تم|حسنا|نعم|d'accord|vu|oui)[.! ]*$", re.IGNORECASE)
+_SNOOZE = re.compile(r"^snooze(?:\s+(\d{1,4}))?\s*(?:m|min|mins|minutes)?$", re.IGNORECASE)
+_CHECK = re.compile(r"^check(?:\s+now)?$", re.IGNORECASE)
+_SCHEDULE = re.compile(r"^schedule\s+([01]?\d|2[0-3]):([0-5]\d)$", re.IGNORECASE)
+
+REPLIES = {
+    "ack": "✅ Acknowledged - repeat alerts paused unless glucose gets worse.",
+    "snooze": "😴 Alerts snoozed for {arg} min (critical lows/highs still come through).",
+    "check": "🔎 Checking your glucose now.",
+    "schedule": "⏰ Daily check added at {arg}.",
+    "help": "GlucoAlert replies: OK, SNOOZE 30, CHECK NOW, SCHEDULE 08:00",
+}
+
+
+def parse_command(body):
+    """(command, argument) for a reply body; ("help", None) when it isn't understood"""
+    text = " ".join((body or "").split())
+    if _ACK.match(text):
+        return "ack", None
+    match = _SNOOZE.match(text)
+    if match:
+        minutes = int(match.group(1) or DEFAULT_SNOOZE_MINUTES)
+        return "snooze", max(1, min(minutes, MAX_SNOOZE_MINUTES))
+    if _CHECK.match(text):
+        return "check", None
+    match = _SCHEDULE.match(text)
+    if match:
+        return "schedule", f"{int(match.group(1)):02d}:{match.group(2)}"
+    return "help", None
+
+
+def twiml_message(text=None):
+    if not text:
+        return '<?xml version="1.0" encoding="UTF-8"?><Response></Response>'
+    return f'<?xml version="1.0" encoding="UTF-8"?><Response><Message>{escape(text)}</Message></Response>'
+
+
+def verify_signature(url, params, signature):
+    """X-Twilio-Signature check (HMAC-SHA1 of URL + sorted POST params with the auth token)"""
+    settings = get_settings()
+    if not settings.webhook_signature_check:
+        return True
+    if not signature or not settings.twilio_auth_token:
+        return False
+    from twilio.request_validator import RequestValidator  # deferred with the rest of twilio
+    return RequestValidator(settings.twilio_auth_token).validate(url, params, signature)
+
+
+def patients_for(address):
+    """(patient_id, recipient_id) pairs a sender address can act for"""
+    from notifications import care_graph
+    address = (address or "").replace("whatsapp:", "")
+    matches = [(patient_id, r.recipient_id) for patient_id, r in care_graph.find(address)]
+    settings = get_settings()
+    if address and address in (settings.patient_phone_number, settings.patient_whatsapp.replace("whatsapp:", "")):
+        matches.append((settings.patient_id, "patient"))
+    return list(dict.fromkeys(matches))
+
+
+def apply_command(patient_id, recipient_id, command, arg, at=None):
+    """Act on one reply in the process that holds the alert state; `at` = when it was received"""
+    if command == "ack":
+        from alert_state import alert_suppressor
+        from notifications import alert_fanout
+        alert_id = alert_fanout.latest_unacked(patient_id)
+        if alert_id:
+            alert_fanout.acknowledge(alert_id, recipient_id)
+        alert_suppressor.acknowledge(patient_id)
+    elif command == "snooze":
+        from alert_state import alert_suppressor
+        minutes = int(arg) - ((get_clock().time() - at) / 60 if at is not None else 0)
+        if minutes > 0:
+            alert_suppressor.snooze(patient_id, minutes)
+    elif command == "check":
+        from main import check_patient
+        check_patient(patient_id)
+    elif command == "schedule":
+        from main import add_check_time
+        add_check_time(arg)
+
+
+class CommandStore:
+    """Replies for a scheduler running in another process (EMBEDDED_SCHEDULER=0).
+
+    web.py appends rows; every scheduler process reads forward from its own cursor, so each
+    cluster node sees every command (and applies those for patients it owns). One SQLite file
+    on the shared volume, like the message ledger.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS commands ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " patient_id TEXT NOT NULL, recipient_id TEXT NOT NULL,"
+            " command TEXT NOT NULL, arg TEXT, at REAL NOT NULL);"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    def add_many(self, rows):
+        """Append (patient_id, recipient_id, command, arg, at) rows"""
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO commands (patient_id, recipient_id, command, arg, at) VALUES (?, ?, ?, ?, ?)",
+                [(p, r, c, None if a is None else str(a), at) for p, r, c, a, at in rows])
+            self._conn.commit()
+
+    def since(self, after_id):
+        """(id, patient_id, recipient_id, command, arg, at) rows after `after_id`, oldest first"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT id, patient_id, recipient_id, command, arg, at FROM commands WHERE id > ? ORDER BY id",
+                (after_id,)).fetchall()
+
+    def last_id(self):
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM commands").fetchone()[0]
+
+    def schedule_times(self):
+        with self._lock:
+            return [row[0] for row in self._conn.execute(
+                "SELECT DISTINCT arg FROM commands WHERE command = 'schedule' ORDER BY arg")]
+
+    def prune(self, before):
+        with self._lock:
+            self._conn.execute("DELETE FROM commands WHERE at < ? AND command != 'schedule'", (before,))
+            self._conn.commit()
+
+
+_command_store = None
+_cursor = None  # id of the last stored command this process has applied
+
+
+def get_command_store():
+    global _command_store
+    if _command_store is None:
+        _command_store = CommandStore(get_settings().inbound_db_path)
+    return _command_store
+
+
+def stores_commands():
+    """True when replies go through the CommandStore: the alert state is in another process
+    (EMBEDDED_SCHEDULER=0), or spread over shard workers (SHARD_WORKERS > 1)"""
+    settings = get_settings()
+    return not settings.embedded_scheduler or settings.shard_workers > 1
+
+
+def apply_stored_commands(patient_filter=None, apply=apply_command):
+    """Scheduler side of stores_commands(): apply replies web.py stored since the last call, with
+    `apply` (sharding.py routes them to the worker owning the patient). The first call restores
+    added check times and skips older acks/snoozes (they were for alerts from before this process
+    started). Returns the number of commands applied."""
+    global _cursor
+    store = get_command_store()
+    if _cursor is None:
+        _cursor = store.last_id()
+        store.prune(get_clock().time() - COMMAND_RETENTION_S)
+        for t in store.schedule_times():
+            apply(None, None, "schedule", t, None)
+        return 0
+    rows = store.since(_cursor)
+    applied = 0
+    for command_id, patient_id, recipient_id, command, arg, at in rows:
+        _cursor = command_id
+        if command != "schedule" and patient_filter is not None and not patient_filter(patient_id):
+            continue  # another cluster node owns this patient
+        try:
+            apply(patient_id, recipient_id, command, arg, at)
+            applied += 1
+        except Exception as e:
+            print(f"❌ Stored {command} for {patient_id} failed: {e}")
+    return applied
+
+
+class InboundProcessor:
+    """Webhooks only parse and enqueue; one worker thread applies commands in arrival order.
+    When the alert state is elsewhere (stores_commands()), commands go to the CommandStore."""
+
+    def __init__(self, maxsize=QUEUE_SIZE):
+        self.queue = queue.Queue(maxsize)
+        self.stats = Counter()
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def submit(self, message):
+        """Queue {"from", "command", "arg", "sid"}; False when the queue is full"""
+        self._ensure_worker()
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            self.stats["dropped"] += 1
+            return False
+        self.stats["queued"] += 1
+        return True
+
+    def _ensure_worker(self):
+        if self._worker is None:
+            with self._lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._run, name="inbound", daemon=True)
+                    self._worker.start()
+
+    def _run(self):
+        while True:
+            message = self.queue.get()
+            try:
+                self.handle(message)
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"❌ Inbound {message.get('command')} from {message.get('from')} failed: {e}")
+            finally:
+                self.queue.task_done()
+
+    def handle(self, message):
+        command, arg = message["command"], message["arg"]
+        targets = message.get("targets") or patients_for(message["from"])
+        if not targets:
+            self.stats["unknown_sender"] += 1
+            print(f"⚠️ Inbound '{command}' from unknown number {message['from']}")
+            return
+        if command == "schedule":
+            targets = targets[:1]  # the check schedule is shared by all patients
+        if not stores_commands():
+            for patient_id, recipient_id in targets:
+                apply_command(patient_id, recipient_id, command, arg)
+        else:
+            now = get_clock().time()
+            get_command_store().add_many([(patient_id, recipient_id, command, arg, now)
+                                          for patient_id, recipient_id in targets])
+            self.stats["stored"] += 1
+        self.stats[command] += 1
+
+    def wait_idle(self):
+        self.queue.join()
+
+
+# Global instance
+inbound_processor = InboundProcessor()
+
+
+def accept_inbound(url, params, signature):
+    """Webhook entry point -> (TwiML body, HTTP status). Parsing is inline, the work is queued."""
+    if not verify_signature(url, params, signature):
+        inbound_processor.stats["bad_signature"] += 1
+        return twiml_message(), 403
+    command, arg = parse_command(params.get("Body", ""))
+    sender = params.get("From", "")
+    targets = patients_for(sender)
+    if not targets:
+        # No reply: nothing was done, and an unknown number should not learn the commands
+        inbound_processor.stats["unknown_sender"] += 1
+        print(f"⚠️ Inbound '{command}' from unknown number {sender}")
+        return twiml_message(), 200
+    if command != "help":
+        message = {"from": sender, "targets": targets, "command": command, "arg": arg,
+                   "sid": params.get("MessageSid")}
+        if not inbound_processor.submit(message):
+            return twiml_message(), 503
+    return twiml_message(REPLIES[command].format(arg=arg)), 200
+
+
+# 🔬 Benchmark: a burst of replies through the Flask route
+if __name__ == "__main__":
+    import os
+    import tempfile
+    import time
+    import timeit
+
+    os.environ.setdefault("TWILIO_AUTH_TOKEN", "stand-in-token")
+    os.environ.setdefault("INBOUND_DB_PATH", os.path.join(tempfile.mkdtemp(), "inbound.db"))
+    os.environ.setdefault("PATIENT_PHONE_NUMBER", "+9613000000")
+    for body in ("OK", "ok!", "Snooze 45", "snooze", "check now", "schedule 8:05", "what?"):
+        print(f"   {body!r:>14} → {parse_command(body)}")
+    per = timeit.timeit(lambda: parse_command("snooze 30"), number=100_000) / 100_000
+    print(f"⏱️ parse_command: {per * 1e6:.2f} µs")
+
+    import inbound  # the instance web.py uses (this file runs as __main__)
+    from twilio.request_validator import RequestValidator
+    from web import app
+
+    client = app.test_client()
+    url = "http://localhost/webhooks/twilio/inbound"
+    validator = RequestValidator(get_settings().twilio_auth_token)
+    forged = client.post(url, data={"From": "+9613000000", "Body": "OK"}, headers={"X-Twilio-Signature": "bad"})
+    print(f"   forged signature → HTTP {forged.status_code}")
+
+    n = 5000
+    requests = []
+    for i in range(n):
+        form = {"From": "+9613000000", "Body": "OK" if i % 2 else "snooze 30", "MessageSid": f"SM{i}"}
+        requests.append((form, validator.compute_signature(url, form)))
+    latencies = []
+    start = time.perf_counter()
+    for form, signature in requests:
+        t0 = time.perf_counter()
+        response = client.post(url, data=form, headers={"X-Twilio-Signature": signature})
+        latencies.append(time.perf_counter() - t0)
+        assert response.status_code == 200, response.status_code
+    accepted = time.perf_counter() - start
+    inbound.inbound_processor.wait_idle()
+    drained = time.perf_counter() - start
+    latencies.sort()
+    print(f"📥 {n:,} signed webhooks accepted in {accepted:.2f}s (p50 {latencies[n // 2] * 1e3:.2f} ms, "
+          f"p99 {latencies[int(n * 0.99)] * 1e3:.2f} ms); queue drained at {drained:.2f}s")
+    print(f"   {dict(inbound.inbound_processor.stats)}")
+
+    form = {"From": "+9613999999", "Body": "OK", "MessageSid": "SMunknown"}
+    unknown = client.post(url, data=form, headers={"X-Twilio-Signature": validator.compute_signature(url, form)})
+    print(f"   unknown sender → HTTP {unknown.status_code}, "
+          f"{'a reply' if b'<Message>' in unknown.data else 'no reply'}")
+
+    # The scheduler process (EMBEDDED_SCHEDULER=0) applies them from the shared store
+    inbound._cursor = 0  # as if it had started before the burst
+    start = time.perf_counter()
+    applied = inbound.apply_stored_commands()
+    print(f"🗂️ scheduler side: {applied:,} stored commands applied in {time.perf_counter() - start:.2f}s")
@@ -1,9 +1,18 @@
 # llm_advisor.py - REAL LLM ADVICE WITH ROBUST ERROR HANDLING
+import asyncio
+import sys
 import time
 import traceback
-from langchain_openai import ChatOpenAI
-from langchain_core.prompts import ChatPromptTemplate
-from config import OPENAI_API_KEY, LLM_MODEL, MAX_TOKENS
+from advice_cache import advice_cache
+from advice_safety import check_advice
+from clock import get_clock
+from config import get_settings
+from llm_router import llm_router
+from llm_usage import cached_tokens, get_usage_ledger, record_llm_usage
+from patient_context import patient_summary
+from profiles import profile_store
+from prompts import build_messages, prompt_text
+from tracing import span
 
 class LLMAdvisor:
     def __init__(self):
@@ -12,52 +21,11 @@ class LLMAdvisor:
         self.max_retries = 3
         self.retry_delay = 2.0  # seconds
         
-    def _get_llm_instance(self):
-        """Create LLM instance with proper configuration"""
-        if not OPENAI_API_KEY:
-            raise ValueError("Missing OpenAI API key")
-            
-        return ChatOpenAI(
-            model=LLM_MODEL,
-            api_key=OPENAI_API_KEY,
-            max_tokens=MAX_TOKENS,
-            temperature=0.2,  # Low randomness for medical safety
-            timeout=30.0,
-            max_retries=2
-        )
-    
-    def _create_prompt(self, glucose_level, trend, context):
-        """Create context-aware prompt with safety guardrails"""
-        # Determine condition type
-        if glucose_level <= 70:
-            condition = "low blood sugar (hypoglycemia)"
-            action_focus = "immediate treatment with fast-acting carbohydrates"
-        else:
-            condition = "high blood sugar (hyperglycemia)"
-            action_focus = "hydration and monitoring"
-        
-        # System prompt with strict safety rules
-        system_prompt = (
-            "You are a diabetes care assistant providing evidence-based guidance. "
-            "NEVER suggest insulin dosing, medication changes, or specific medical procedures. "
-            "ALWAYS include when to seek emergency help. "
-            "For lows (≤70 mg/dL): recommend 15g fast-acting carbs, recheck in 15 minutes. "
-            "For highs (≥180 mg/dL): recommend hydration, light activity, recheck in 1-2 hours. "
-            "Use simple, actionable language. Max 3 sentences."
-        )
-        
-        # User prompt with full context
-        user_prompt = (
-            f"Glucose reading: {glucose_level} mg/dL ({trend}) during {context}. "
-            f"This indicates {condition}. "
-            f"Provide immediate actions for {action_focus}. "
-            "Include when to seek emergency help."
-        )
-        
-        return ChatPromptTemplate.from_messages([
-            ("system", system_prompt),
-            ("human", user_prompt)
-        ])
+    def _create_prompt(self, glucose_level, trend, context, patient_id=None, kind=None):
+        """Create context-aware prompt with safety guardrails (variants in prompts.py)"""
+        # 🗂️ Recent lows, time in range and meal times, capped at LLM_HISTORY_TOKENS (patient_context.py)
+        history = patient_summary(patient_id) if patient_id else ""
+        return build_messages(glucose_level, trend, context, history=history, kind=kind)
     
     def _extract_advice(self, response):
         """Safely extract advice from LLM response"""
@@ -75,14 +43,15 @@ class LLMAdvisor:
             print(f"⚠️ Error extracting advice: {str(e)}")
             return None
     
-    def _get_safety_fallback(self, glucose_level, error_context=""):
-        """Safety fallback advice when LLM fails"""
+    def _get_safety_fallback(self, glucose_level, error_context="", kind=None):
+        """Safety fallback advice when LLM fails; `kind` ("low"/"high") is the alert's, from the
+        patient's thresholds (global HYPO_THRESHOLD when not given)"""
         base_advice = (
             "This is a safety message. Please consult your healthcare provider "
             "for personalized guidance. In emergencies, call emergency services."
         )
         
-        if glucose_level <= 70:
+        if kind == "low" or (kind is None and glucose_level <= get_settings().hypo_threshold):
             return (
                 f"🚨 CRITICAL LOW GLUCOSE ({glucose_level} mg/dL)\n"
                 "Immediately consume 15g fast-acting carbohydrates (4 oz juice, glucose tablets, or regular soda).\n"
@@ -99,70 +68,203 @@ class LLMAdvisor:
                 f"{base_advice}"
             )
     
-    def get_advice(self, glucose_level, trend="stable", context="automated monitoring"):
-        """Get real LLM advice with comprehensive error handling"""
+    def _thresholds(self, patient_id):
+        """(hypo, hyper) the alert was raised against: the patient's profile at this time of day"""
+        if not patient_id:
+            return get_settings().thresholds_for()
+        return profile_store.thresholds_at(patient_id, get_clock().now())
+
+    def _kind(self, glucose_level, patient_id):
+        hypo, hyper = self._thresholds(patient_id)
+        return "low" if glucose_level <= hypo else "high" if glucose_level >= hyper else "in_range"
+
+    def _cache_scope(self, patient_id):
+        # Advice written with a patient's history in the prompt is only reused for that patient
+        return patient_id if get_settings().llm_history_tokens and patient_id else ""
+
+    def _without_llm(self, glucose_level, trend, context, scope, patient_id, kind, advice_span):
+        """Cached or precomputed advice when no LLM call is needed, else None"""
+        if get_settings().advice_cache_ttl_seconds > 0:
+            advice, hit = advice_cache.get(glucose_level, trend, context, scope, side=kind)
+            if advice is not None:
+                # Same band/trend and an equivalent context (exact or paraphrased): no LLM call
+                advice_span.set_attribute("source", f"cache_{hit}")
+                return advice
+        # 💸 Daily LLM budget spent: precomputed safety advice instead of a paid call
+        usage = get_usage_ledger()
+        exhausted = usage.over_budget(patient_id)
+        if exhausted:
+            usage.stats["over_budget"] += 1
+            print(f"💸 {exhausted.capitalize()} daily LLM budget reached - using precomputed advice")
+            advice_span.set_attribute("source", "budget_fallback")
+            return self._get_safety_fallback(glucose_level, "over budget", kind)
+        return None
+
+    def _store(self, glucose_level, trend, context, scope, kind, advice, source, advice_span):
+        if get_settings().advice_cache_ttl_seconds > 0 and source == "llm":
+            advice_cache.put(glucose_level, trend, context, advice, scope, side=kind)
+        advice_span.set_attribute("source", source)
+
+    def get_advice(self, glucose_level, trend="stable", context="automated monitoring", patient_id=None, kind=None):
+        """Get real LLM advice with comprehensive error handling; `kind` is the alert kind
+        ("low"/"high"), resolved from the patient's thresholds when not given"""
+        with span("llm.get_advice", glucose=glucose_level, trend=trend, context=context) as advice_span:
+            kind = kind or self._kind(glucose_level, patient_id)
+            scope = self._cache_scope(patient_id)
+            advice = self._without_llm(glucose_level, trend, context, scope, patient_id, kind, advice_span)
+            if advice is not None:
+                return advice
+            advice, source = self._get_advice(glucose_level, trend, context, advice_span, patient_id, kind)
+            self._store(glucose_level, trend, context, scope, kind, advice, source, advice_span)
+            return advice
+
+    async def aget_advice(self, glucose_level, trend="stable", context="automated monitoring", patient_id=None,
+                          timeout=None, kind=None):
+        """Async get_advice() for many alerts at once: no per-request cooldown, at most
+        LLM_ASYNC_CONCURRENCY requests in flight over one pooled client, cancellable.
+        Past `timeout` seconds the request is cancelled and the safety fallback returned."""
+        with span("llm.get_advice", glucose=glucose_level, trend=trend, context=context) as advice_span:
+            kind = kind or self._kind(glucose_level, patient_id)
+            scope = self._cache_scope(patient_id)
+            advice = self._without_llm(glucose_level, trend, context, scope, patient_id, kind, advice_span)
+            if advice is not None:
+                return advice
+            try:
+                advice, source = await asyncio.wait_for(
+                    self._aget_advice(glucose_level, trend, context, advice_span, patient_id, kind), timeout)
+            except asyncio.TimeoutError:
+                print(f"⏱️ No LLM advice within {timeout}s - using safety fallback")
+                advice, source = self._get_safety_fallback(glucose_level, "timeout", kind), "timeout_fallback"
+            self._store(glucose_level, trend, context, scope, kind, advice, source, advice_span)
+            return advice
+
+    def _accept(self, response, provider, prompt, glucose_level, patient_id, kind, attempt_span, advice_span):
+        """(advice, source) from one response after usage accounting and the safety check,
+        or None when it is too short to use"""
+        # Extract advice
+        advice = self._extract_advice(response)
+
+        # 💰 Tokens and cost per patient/day/model (llm_usage.py)
+        tokens_in, tokens_out, cost = record_llm_usage(patient_id, provider, response,
+                                                       prompt_text(prompt), advice or "")
+        attempt_span.set_attribute("tokens", tokens_in + tokens_out)
+        attempt_span.set_attribute("cached_tokens", cached_tokens(response))
+
+        if not advice or len(advice) <= 20:  # Minimum meaningful length
+            print(f"⚠️ LLM returned short/empty response: '{advice}'")
+            attempt_span.record_error("short/empty response")
+            return None
+
+        # 🛡️ No dosing, sane numbers, emergency guidance present (advice_safety.py), against the
+        # thresholds the alert was raised on
+        hypo, hyper = self._thresholds(patient_id)
+        advice, verdict, violations = check_advice(advice, glucose_level, hypo, hyper)
+        advice_span.set_attribute("safety", verdict)
+        if verdict == "rejected":
+            advice_span.set_attribute("safety_rules", ",".join(r for r, _ in violations))
+            return self._get_safety_fallback(glucose_level, "unsafe advice", kind), "safety_fallback"
+        return advice, "llm"
+
+    def _get_advice(self, glucose_level, trend, context, advice_span, patient_id=None, kind=None):
+        """_advise() with blocking calls, rate limited; it never suspends, so it runs to completion
+        without an event loop"""
+        # Rate limiting
+        elapsed = time.time() - self.last_request_time
+        if elapsed < self.request_cooldown:
+            with span("llm.cooldown", wait_s=round(self.request_cooldown - elapsed, 3)):
+                time.sleep(self.request_cooldown - elapsed)
+        advice = self._advise(glucose_level, trend, context, advice_span, patient_id, kind,
+                              _blocking(llm_router.invoke), _blocking(time.sleep))
+        try:
+            advice.send(None)
+        except StopIteration as done:
+            return done.value
+        advice.close()
+        raise RuntimeError("LLM advice suspended without an event loop")
+
+    async def _aget_advice(self, glucose_level, trend, context, advice_span, patient_id=None, kind=None):
+        """_advise() on the event loop; cancellation (CancelledError) propagates to the HTTP request"""
+        return await self._advise(glucose_level, trend, context, advice_span, patient_id, kind,
+                                  llm_router.ainvoke, asyncio.sleep)
+
+    async def _advise(self, glucose_level, trend, context, advice_span, patient_id, kind, invoke, sleep):
+        """The retry loop behind both entry points: `invoke(prompt)` -> (response, provider name)
+        and `sleep(seconds)` are awaited"""
         start_time = time.time()
         
         try:
-            # Rate limiting
-            elapsed = time.time() - self.last_request_time
-            if elapsed < self.request_cooldown:
-                time.sleep(self.request_cooldown - elapsed)
-            
-            # Create LLM instance
-            llm = self._get_llm_instance()
+            # Providers (OpenAI / Azure / local / stub) are built and ranked by llm_router.py
+            if not llm_router.providers():
+                raise ValueError("Missing OpenAI API key (or another LLM provider)")
             
             # Create prompt
-            prompt = self._create_prompt(glucose_level, trend, context)
+            prompt = self._create_prompt(glucose_level, trend, context, patient_id, kind)
             
             # Get response with retry logic
             for attempt in range(self.max_retries):
-                try:
-                    print(f"🧠 LLM Request (attempt {attempt+1}/{self.max_retries})")
-                    chain = prompt | llm
-                    response = chain.invoke({})
+                with span("llm.attempt", attempt=attempt + 1) as attempt_span:
+                    try:
+                        print(f"🧠 LLM Request (attempt {attempt+1}/{self.max_retries})")
+                        # Fastest healthy provider; fails over (and optionally hedges) across the others
+                        response, provider = await invoke(prompt)
+                        attempt_span.set_attribute("provider", provider)
+                        
+                        result = self._accept(response, provider, prompt, glucose_level, patient_id, kind,
+                                              attempt_span, advice_span)
+                        if result is not None:
+                            self.last_request_time = time.time()
+                            print(f"✅ LLM Response received in {time.time()-start_time:.2f}s")
+                            advice_span.set_attribute("attempts", attempt + 1)
+                            advice_span.set_attribute("latency_s", round(time.time() - start_time, 3))
+                            return result
                     
-                    # Extract advice
-                    advice = self._extract_advice(response)
-                    
-                    if advice and len(advice) > 20:  # Minimum meaningful length
-                        self.last_request_time = time.time()
-                        print(f"✅ LLM Response received in {time.time()-start_time:.2f}s")
-                        return advice
-                    else:
-                        print(f"⚠️ LLM returned short/empty response: '{advice}'")
-                
-                except Exception as e:
-                    error_type = type(e).__name__
-                    print(f"❌ LLM attempt {attempt+1} failed: {error_type} - {str(e)[:100]}")
-                    if attempt < self.max_retries - 1:
-                        time.sleep(self.retry_delay * (attempt + 1))
+                    except Exception as e:
+                        attempt_span.record_error(e)
+                        error_type = type(e).__name__
+                        print(f"❌ LLM attempt {attempt+1} failed: {error_type} - {str(e)[:100]}")
+                        if attempt < self.max_retries - 1:
+                            with span("llm.retry_backoff", delay_s=self.retry_delay * (attempt + 1)):
+                                await sleep(self.retry_delay * (attempt + 1))
             
             # If all retries fail, use safety fallback
             print("❌ All LLM attempts failed - using safety fallback")
-            return self._get_safety_fallback(glucose_level, "LLM failure")
+            advice_span.set_attribute("attempts", self.max_retries)
+            return self._get_safety_fallback(glucose_level, "LLM failure", kind), "fallback"
             
         except ValueError as e:
             # Missing API key or configuration error
+            advice_span.record_error(e)
             print(f"❌ Configuration error: {str(e)}")
-            return self._get_safety_fallback(glucose_level, "configuration error")
+            return self._get_safety_fallback(glucose_level, "configuration error", kind), "fallback"
             
         except Exception as e:
             # Unexpected errors
+            advice_span.record_error(e)
             error_details = traceback.format_exc()
             print(f"🚨 Unexpected error in LLM advisor: {str(e)}")
             print(f"   Details: {error_details[:200]}...")
-            return self._get_safety_fallback(glucose_level, "system error")
+            return self._get_safety_fallback(glucose_level, "system error", kind), "fallback"
+
+
+def _blocking(call):
+    """Awaitable around a blocking call, so the sync path can share _advise()"""
+    async def run(*args):
+        return call(*args)
+    return run
 
 # Global instance
 llm_advisor = LLMAdvisor()
 
-def get_glucose_advice(glucose_level, trend="stable", context=""):
+def get_glucose_advice(glucose_level, trend="stable", context="", patient_id=None, kind=None):
     """Public interface for getting glucose advice"""
-    return llm_advisor.get_advice(glucose_level, trend, context)
+    return llm_advisor.get_advice(glucose_level, trend, context, patient_id, kind)
+
+async def aget_glucose_advice(glucose_level, trend="stable", context="", patient_id=None, timeout=None, kind=None):
+    """Public async interface - many alerts concurrently (see LLMAdvisor.aget_advice)"""
+    return await llm_advisor.aget_advice(glucose_level, trend, context, patient_id, timeout, kind)
 
-# 🔬 Test function
-if __name__ == "__main__":
+# 🔬 Test function (`python llm_advisor.py --bench [n]`: n concurrent async requests against a local stand-in)
+if __name__ == "__main__" and "--bench" not in sys.argv:
     print("🧠 Testing REAL LLM advisor with error handling...")
     
     # Test low glucose scenario
@@ -174,14 +276,137 @@ if __name__ == "__main__":
     print(f"\n💡 Advice for HIGH glucose (210 mg/dL):\n{'-'*50}\n{advice}\n{'-'*50}")
     
     print("\n✅ LLM advisor test complete")
-           
-    
-           
-              
-    
 
-   
-         
-        
-     
-    
+elif __name__ == "__main__":
+    import contextlib
+    import json
+    import os
+    import tempfile
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    from config import settings_manager
+    from llm_router import _h2_installed
+
+    n = int(sys.argv[-1]) if sys.argv[-1].isdigit() else 500
+    LATENCY = 0.1  # stand-in "model" time per request
+    ADVICE = {"low": "Eat 15g of fast-acting carbs like juice and recheck in 15 minutes. "
+                     "If you feel confused or faint, call emergency services.",
+              "high": "Drink water and take a light walk, then recheck in 1-2 hours. "
+                      "Seek emergency care if you vomit or feel very unwell."}
+
+    class StandIn:
+        """OpenAI chat-completions stand-in on its own loop/thread; HTTP/1.1 keep-alive"""
+
+        def __init__(self):
+            self.counts = {"connections": 0, "requests": 0, "aborted": 0}
+            self.in_flight = self.peak = 0
+            self.loop = asyncio.new_event_loop()
+            self.server = self.loop.run_until_complete(asyncio.start_server(self.handle, "127.0.0.1", 0))
+            self.port = self.server.sockets[0].getsockname()[1]
+            threading.Thread(target=self.loop.run_forever, daemon=True).start()
+
+        async def handle(self, reader, writer):
+            self.counts["connections"] += 1
+            try:
+                while True:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                    length = next((int(line.split(b":")[1]) for line in head.split(b"\r\n")
+                                   if line.lower().startswith(b"content-length:")), 0)
+                    body = json.loads(await reader.readexactly(length))
+                    self.counts["requests"] += 1
+                    self.in_flight += 1
+                    self.peak = max(self.peak, self.in_flight)
+                    try:
+                        # Answer after LATENCY unless the client hangs up first (cancelled request)
+                        eof = asyncio.ensure_future(reader.read(1))
+                        done, _ = await asyncio.wait([eof], timeout=LATENCY)
+                        if done:
+                            self.counts["aborted"] += 1
+                            return
+                        eof.cancel()
+                        await asyncio.wait([eof])  # the reader is free for the next request only once it is done
+                    finally:
+                        self.in_flight -= 1
+                    status = "low" if "status: low" in body["messages"][-1]["content"] else "high"
+                    payload = json.dumps({
+                        "id": "chatcmpl-stand-in", "object": "chat.completion", "created": 0, "model": body["model"],
+                        "choices": [{"index": 0, "finish_reason": "stop",
+                                     "message": {"role": "assistant", "content": ADVICE[status]}}],
+                        "usage": {"prompt_tokens": 90, "completion_tokens": 30, "total_tokens": 120},
+                    }).encode()
+                    writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                                 b"Content-Length: %d\r\n\r\n%s" % (len(payload), payload))
+                    await writer.drain()
+            except (asyncio.IncompleteReadError, ConnectionError):
+                pass
+            finally:
+                writer.close()
+
+    stand_in = StandIn()
+    os.environ.update({"LLM_PROVIDERS": "local", "LOCAL_LLM_URL": f"http://127.0.0.1:{stand_in.port}/v1",
+                       "ADVICE_CACHE_TTL_SECONDS": "0", "LLM_HISTORY_TOKENS": "0", "LLM_ASYNC_CONCURRENCY": "64",
+                       "LLM_USAGE_DB_PATH": os.path.join(tempfile.mkdtemp(), "usage.db")})
+    settings_manager.reload()
+
+    def readings(count):
+        return [(50 + i % 20 if i % 2 else 200 + i % 100, "falling" if i % 2 else "rising", f"alert {i}")
+                for i in range(count)]
+
+    async def timed(glucose, trend, context, timeout=None):
+        start = time.perf_counter()
+        advice = await aget_glucose_advice(glucose, trend, context, f"p{context}", timeout)
+        return time.perf_counter() - start, advice
+
+    async def run_async(count):
+        start = time.perf_counter()
+        results = await asyncio.gather(*(timed(*reading) for reading in readings(count)))
+        return time.perf_counter() - start, results
+
+    def report(label, elapsed, latencies, connections):
+        latencies = sorted(latencies)
+        print(f"   {label:30} {elapsed:5.2f}s  {len(latencies) / elapsed:6.0f} req/s  "
+              f"p50 {latencies[len(latencies) // 2] * 1e3:5.0f} ms  p99 {latencies[int(len(latencies) * 0.99)] * 1e3:5.0f} ms  "
+              f"peak in flight {stand_in.peak:3}  connections {connections}")
+
+    print(f"⚡ {n} advice requests, stand-in latency {LATENCY * 1e3:.0f} ms")
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        elapsed, results = asyncio.run(run_async(n))
+    llm_answers = sum(advice in ADVICE.values() for _, advice in results)
+    report("aget_advice (cap 64)", elapsed, [t for t, _ in results], stand_in.counts["connections"])
+    print(f"      {llm_answers}/{n} LLM answers, HTTP/2 {'on' if _h2_installed() else 'off (h2 not installed)'}")
+
+    # Sync path for comparison: callers in threads, the router's worker pool makes the requests
+    stand_in.peak, connections = 0, stand_in.counts["connections"]
+    llm_advisor.request_cooldown = 0.0  # the per-process cooldown alone would make this n seconds
+
+    def sync_call(reading):
+        start = time.perf_counter()
+        get_glucose_advice(*reading, patient_id=f"p{reading[2]}")
+        return time.perf_counter() - start
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(64) as pool:
+            latencies = list(pool.map(sync_call, readings(n)))
+        elapsed = time.perf_counter() - start
+    report("get_advice x 64 threads", elapsed, latencies, stand_in.counts["connections"] - connections)
+
+    # Cancellation and timeouts: abandoned requests are closed, not left running
+    async def cancel_half():
+        tasks = [asyncio.ensure_future(timed(*reading)) for reading in readings(100)]
+        while stand_in.in_flight < 32:  # a good share of the requests are waiting on the "model"
+            await asyncio.sleep(0.005)
+        for task in tasks[::2]:
+            task.cancel()
+        done = await asyncio.gather(*tasks, return_exceptions=True)
+        timeout = await timed(62, "falling", "slow", timeout=LATENCY / 4)
+        return sum(isinstance(r, asyncio.CancelledError) for r in done), timeout
+
+    aborted = stand_in.counts["aborted"]
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        cancelled, (waited, fallback) = asyncio.run(cancel_half())
+    time.sleep(LATENCY)
+    aborted = stand_in.counts["aborted"] - aborted
+    print(f"   cancelled {cancelled}/100: {aborted} closed mid-request, {cancelled - aborted} before sending; "
+          f"timeout {LATENCY / 4 * 1e3:.0f} ms -> fallback after {waited * 1e3:.0f} ms "
+          f"({'✅' if fallback.startswith('🚨') else '❌'})")
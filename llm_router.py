@@ -0,0 +1,435 @@
+# llm_router.py - Several LLM backends behind one call: fastest healthy provider first, optional hedging
+import asyncio
+import contextvars
+import threading
+import time
+import weakref
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from config import get_settings
+from tracing import span
+
+EWMA_ALPHA = 0.2  # weight of the newest sample in the latency / error-rate averages
+LATENCY_WINDOW = 200  # recent latencies kept per provider for the hedging percentile
+MIN_SAMPLES_TO_HEDGE = 20
+UNHEALTHY_ERROR_RATE = 0.5
+COOLDOWN_AFTER_FAILURES = 3  # consecutive failures -> provider skipped for COOLDOWN_SECONDS
+COOLDOWN_SECONDS = 30.0
+POOL_SHARD_SIZE = 16  # HTTP/1.1 connections per httpx pool in the async path
+PROBE_EVERY = 50  # every Nth request goes to the least recently used healthy provider, so estimates stay fresh
+STUB_ADVICE = ("Recheck your glucose soon and follow the plan agreed with your care team. "
+               "If you feel confused, faint or unwell, call emergency services immediately.")
+
+
+class _LoopState:
+    """Per event loop: pooled HTTP connections shared by every provider, the concurrency cap, async models.
+    asyncio primitives and pooled connections belong to the loop that created them."""
+
+    def __init__(self, settings):
+        import httpx  # deferred: ships with openai
+        limit = settings.llm_async_concurrency
+        self.settings = settings
+        self.http2 = bool(settings.llm_http2) and _h2_installed()
+        # httpcore matches every waiting request against every connection on each state change, so one
+        # HTTP/1.1 pool of 64 connections costs more CPU than the requests; shards of POOL_SHARD_SIZE don't.
+        # HTTP/2 multiplexes the requests over a few connections: one pool.
+        shards = 1 if self.http2 else -(-limit // POOL_SHARD_SIZE)
+        size = -(-limit // shards)
+        self.clients = [httpx.AsyncClient(http2=self.http2, limits=httpx.Limits(
+            max_connections=size, max_keepalive_connections=size, keepalive_expiry=30.0)) for _ in range(shards)]
+        self.semaphore = asyncio.Semaphore(limit)
+        self.models = {}  # (provider name, shard) -> chat model using that shard's client
+        self._next = 0
+
+    def model(self, name, build):
+        shard = self._next = (self._next + 1) % len(self.clients)
+        model = self.models.get((name, shard))
+        if model is None:
+            model = self.models[(name, shard)] = build(self.settings, http_async_client=self.clients[shard])
+        return model
+
+    async def aclose(self):
+        for client in self.clients:
+            await client.aclose()
+
+
+_loops = weakref.WeakKeyDictionary()  # event loop -> _LoopState
+
+
+def _h2_installed():
+    try:
+        import h2  # noqa: F401  optional: pip install httpx[http2]
+        return True
+    except ImportError:
+        return False
+
+
+def loop_state():
+    """State for the running loop, rebuilt after a settings reload (the old pool is closed in the background)"""
+    loop = asyncio.get_running_loop()
+    settings = get_settings()
+    state = _loops.get(loop)
+    if state is None or state.settings is not settings:
+        if state is not None:
+            loop.create_task(state.aclose())
+        state = _loops[loop] = _LoopState(settings)
+    return state
+
+
+class LLMProvider:
+    """One backend: a LangChain chat model built on first use (and rebuilt when settings change)"""
+
+    def __init__(self, name, build):
+        self.name = name
+        self._build = build  # (settings, **http clients) -> chat model
+        self._model = None
+        self._settings = None
+        self._lock = threading.Lock()
+
+    def model(self):
+        settings = get_settings()
+        if self._model is None or self._settings is not settings:
+            with self._lock:
+                if self._model is None or self._settings is not settings:
+                    self._model = self._build(settings)
+                    self._settings = settings
+        return self._model
+
+    @property
+    def model_name(self):
+        model = self.model()
+        return getattr(model, "model_name", None) or getattr(model, "deployment_name", None) or self.name
+
+    def invoke(self, messages):
+        return self.model().invoke(messages)
+
+    async def ainvoke(self, messages):
+        return await loop_state().model(self.name, self._build).ainvoke(messages)
+
+
+class StubProvider:
+    """Offline backend: canned advice after an optional simulated latency (tests, benchmarks, no network)"""
+
+    def __init__(self, name="stub", latency=None, fail=None):
+        self.name = name
+        self.model_name = name
+        self._latency = latency  # () -> seconds
+        self._fail = fail  # () -> bool
+
+    def invoke(self, messages):
+        if self._latency:
+            time.sleep(self._latency())
+        if self._fail and self._fail():
+            raise ConnectionError(f"{self.name} unavailable")
+        return STUB_ADVICE
+
+    async def ainvoke(self, messages):
+        if self._latency:
+            await asyncio.sleep(self._latency())
+        if self._fail and self._fail():
+            raise ConnectionError(f"{self.name} unavailable")
+        return STUB_ADVICE
+
+
+def _openai(settings, **clients):
+    from langchain_openai import ChatOpenAI  # deferred: heavy import, see warmup.py
+    if not settings.openai_api_key:
+        raise ValueError("Missing OpenAI API key")
+    return ChatOpenAI(model=settings.llm_model, api_key=settings.openai_api_key, max_tokens=settings.max_tokens,
+                      temperature=0.2, timeout=30.0, max_retries=0, **clients)  # the router retries across providers
+
+
+def _azure(settings, **clients):
+    from langchain_openai import AzureChatOpenAI
+    if not (settings.azure_openai_endpoint and settings.azure_openai_api_key):
+        raise ValueError("Missing Azure OpenAI endpoint or key")
+    return AzureChatOpenAI(azure_endpoint=settings.azure_openai_endpoint, api_key=settings.azure_openai_api_key,
+                           azure_deployment=settings.azure_openai_deployment or settings.llm_model,
+                           api_version=settings.azure_openai_api_version, max_tokens=settings.max_tokens,
+                           temperature=0.2, timeout=30.0, max_retries=0, **clients)
+
+
+def _local(settings, **clients):
+    from langchain_openai import ChatOpenAI
+    if not settings.local_llm_url:
+        raise ValueError("Missing LOCAL_LLM_URL")
+    # llama.cpp server / vLLM / Ollama speak the OpenAI chat API; the key is ignored
+    return ChatOpenAI(model=settings.local_llm_model, base_url=settings.local_llm_url, api_key="local",
+                      max_tokens=settings.max_tokens, temperature=0.2, timeout=60.0, max_retries=0, **clients)
+
+
+# name -> (is configured?, provider)
+BACKENDS = {
+    "openai": (lambda s: bool(s.openai_api_key), lambda: LLMProvider("openai", _openai)),
+    "azure": (lambda s: bool(s.azure_openai_endpoint and s.azure_openai_api_key), lambda: LLMProvider("azure", _azure)),
+    "local": (lambda s: bool(s.local_llm_url), lambda: LLMProvider("local", _local)),
+    "stub": (lambda s: False, StubProvider),  # only when listed in LLM_PROVIDERS
+}
+
+
+class _Health:
+    __slots__ = ("latency", "error_rate", "recent", "failures", "cooldown_until", "calls", "last_used")
+
+    def __init__(self):
+        self.latency = None  # EWMA seconds of successful calls; None until the first one
+        self.error_rate = 0.0
+        self.recent = deque(maxlen=LATENCY_WINDOW)
+        self.failures = 0  # consecutive
+        self.cooldown_until = 0.0
+        self.calls = 0
+        self.last_used = 0  # request number
+
+
+class LLMRouter:
+    def __init__(self, providers=None, hedge_percentile=None, max_workers=8):
+        self._fixed = providers  # None -> built from settings
+        self._providers = None
+        self._settings = None
+        self.hedge_percentile = hedge_percentile
+        self.health = {}
+        self.stats = {"requests": 0, "probes": 0, "hedged": 0, "hedge_wins": 0, "failovers": 0}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm")
+        self._lock = threading.Lock()
+
+    def providers(self):
+        """Providers from LLM_PROVIDERS (or every configured backend), rebuilt after a settings reload"""
+        if self._fixed is not None:
+            return self._fixed
+        settings = get_settings()
+        if self._settings is not settings:
+            names = [n.strip() for n in settings.llm_providers.split(",") if n.strip()]
+            if not names:
+                names = [name for name, (configured, _) in BACKENDS.items() if configured(settings)]
+            unknown = [n for n in names if n not in BACKENDS]
+            if unknown:
+                raise ValueError(f"Unknown LLM providers: {unknown}")
+            previous = {p.name: p for p in self._providers or ()}
+            self._providers = [previous.get(n) or BACKENDS[n][1]() for n in names]
+            self._settings = settings
+        return self._providers
+
+    def _count(self, stat):
+        with self._lock:
+            self.stats[stat] += 1
+
+    def _health(self, name):
+        health = self.health.get(name)
+        if health is None:
+            with self._lock:
+                health = self.health.setdefault(name, _Health())
+        return health
+
+    def ranked(self):
+        """Healthy providers, fastest EWMA latency first (untried ones first, to get a sample);
+        unhealthy ones after them in configured order, as a last resort"""
+        now = time.monotonic()
+        healthy, unhealthy = [], []
+        for order, provider in enumerate(self.providers()):
+            health = self._health(provider.name)
+            if health.cooldown_until > now or health.error_rate >= UNHEALTHY_ERROR_RATE:
+                unhealthy.append(provider)
+            else:
+                healthy.append((health.latency if health.latency is not None else -1.0, order, provider))
+        healthy = [provider for _, _, provider in sorted(healthy, key=lambda t: t[:2])]
+        if len(healthy) > 1 and self.stats["requests"] % PROBE_EVERY == 0:
+            stalest = min(healthy, key=lambda p: self._health(p.name).last_used)
+            if stalest is not healthy[0]:
+                healthy.remove(stalest)
+                healthy.insert(0, stalest)
+                self._count("probes")
+        return healthy + unhealthy
+
+    def _record(self, name, elapsed, ok):
+        health = self._health(name)
+        with self._lock:
+            health.calls += 1
+            health.last_used = self.stats["requests"]
+            health.error_rate += EWMA_ALPHA * ((0.0 if ok else 1.0) - health.error_rate)
+            if ok:
+                health.failures = 0
+                health.latency = elapsed if health.latency is None else health.latency + EWMA_ALPHA * (
+                    elapsed - health.latency)
+                health.recent.append(elapsed)
+            else:
+                health.failures += 1
+                if health.failures >= COOLDOWN_AFTER_FAILURES:
+                    health.cooldown_until = time.monotonic() + COOLDOWN_SECONDS
+
+    def _hedge_delay(self, name):
+        """Latency percentile after which a second provider is raced, or None (not enough data / disabled)"""
+        percentile = self.hedge_percentile if self.hedge_percentile is not None else get_settings().llm_hedge_percentile
+        health = self._health(name)
+        if not percentile or len(health.recent) < MIN_SAMPLES_TO_HEDGE:
+            return None
+        recent = sorted(health.recent)
+        return recent[min(len(recent) - 1, int(percentile * len(recent)))]
+
+    def _call(self, provider, prompt):
+        start = time.perf_counter()
+        try:
+            with span("llm.provider", provider=provider.name):
+                response = provider.invoke(prompt)
+        except Exception:
+            self._record(provider.name, time.perf_counter() - start, False)
+            raise
+        self._record(provider.name, time.perf_counter() - start, True)
+        return response
+
+    def _submit(self, provider, prompt):
+        # Each call runs in a copy of this context so its llm.provider span nests under the caller's
+        return self._executor.submit(contextvars.copy_context().run, self._call, provider, prompt)
+
+    def invoke(self, prompt):
+        """(response, provider name) from the first provider that answers. Raises the last error
+        when every provider fails, ValueError when none is configured."""
+        self._count("requests")
+        ranked = self.ranked()
+        if not ranked:
+            raise ValueError("No LLM provider configured (set OPENAI_API_KEY, Azure, LOCAL_LLM_URL or LLM_PROVIDERS)")
+        queue = list(ranked)
+        running = {}  # future -> provider
+        last_error = None
+        while queue or running:
+            if not running:
+                provider = queue.pop(0)
+                if last_error is not None:
+                    self._count("failovers")
+                running[self._submit(provider, prompt)] = provider
+            primary = next(iter(running.values()))
+            delay = self._hedge_delay(primary.name) if queue and len(running) == 1 else None
+            done, _ = wait(running, timeout=delay, return_when=FIRST_COMPLETED)
+            if not done:
+                # Slower than its usual percentile: race the next provider, keep whichever answers first
+                backup = queue.pop(0)
+                running[self._submit(backup, prompt)] = backup
+                self._count("hedged")
+                continue
+            for future in done:
+                provider = running.pop(future)
+                try:
+                    response = future.result()
+                except Exception as e:
+                    last_error = e
+                    print(f"⚠️ LLM provider {provider.name} failed: {type(e).__name__} - {str(e)[:100]}")
+                    continue
+                for other in running:
+                    other.cancel()  # a running call finishes in the background; its result is ignored
+                if provider is not primary:
+                    self._count("hedge_wins")
+                return response, provider.name
+        raise last_error
+
+    async def _acall(self, provider, messages):
+        # LLM_ASYNC_CONCURRENCY requests in flight per loop; time spent queueing is not provider latency
+        async with loop_state().semaphore:
+            start = time.perf_counter()
+            try:
+                with span("llm.provider", provider=provider.name):
+                    response = await provider.ainvoke(messages)
+            except asyncio.CancelledError:
+                raise  # a hedge that lost, or the caller gave up: not the provider's fault
+            except Exception:
+                self._record(provider.name, time.perf_counter() - start, False)
+                raise
+        self._record(provider.name, time.perf_counter() - start, True)
+        return response
+
+    async def ainvoke(self, messages):
+        """Async invoke(): same ranking, failover and hedging, but a losing or abandoned call is
+        cancelled (its HTTP request is closed) instead of finishing in a worker thread"""
+        self._count("requests")
+        ranked = self.ranked()
+        if not ranked:
+            raise ValueError("No LLM provider configured (set OPENAI_API_KEY, Azure, LOCAL_LLM_URL or LLM_PROVIDERS)")
+        queue = list(ranked)
+        running = {}  # task -> provider
+        last_error = None
+        try:
+            while queue or running:
+                if not running:
+                    provider = queue.pop(0)
+                    if last_error is not None:
+                        self._count("failovers")
+                    running[asyncio.ensure_future(self._acall(provider, messages))] = provider
+                primary = next(iter(running.values()))
+                delay = self._hedge_delay(primary.name) if queue and len(running) == 1 else None
+                done, _ = await asyncio.wait(running, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    backup = queue.pop(0)
+                    running[asyncio.ensure_future(self._acall(backup, messages))] = backup
+                    self._count("hedged")
+                    continue
+                for task in done:
+                    provider = running.pop(task)
+                    try:
+                        response = task.result()
+                    except Exception as e:
+                        last_error = e
+                        print(f"⚠️ LLM provider {provider.name} failed: {type(e).__name__} - {str(e)[:100]}")
+                        continue
+                    if provider is not primary:
+                        self._count("hedge_wins")
+                    return response, provider.name
+            raise last_error
+        finally:
+            for task in running:
+                task.cancel()
+
+    def status(self):
+        return {
+            **self.stats,
+            "providers": {
+                name: {"ewma_latency_ms": round(h.latency * 1000, 1) if h.latency is not None else None,
+                       "error_rate": round(h.error_rate, 3), "calls": h.calls,
+                       "cooling_down": h.cooldown_until > time.monotonic()}
+                for name, h in self.health.items()
+            },
+        }
+
+
+# Global instance
+llm_router = LLMRouter()
+
+
+# 🔬 Benchmark: three simulated backends with different latency profiles
+if __name__ == "__main__":
+    import contextlib
+    import os
+    import random
+    import sys
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    rng = random.Random(7)
+
+    def profiles():
+        return [
+            # fast but with a heavy tail (rate-limit queueing) and occasional errors
+            StubProvider("openai", lambda: 0.012 if rng.random() > 0.04 else 0.15, lambda: rng.random() < 0.02),
+            StubProvider("azure", lambda: rng.uniform(0.018, 0.026)),  # slower, steady
+            StubProvider("local", lambda: rng.uniform(0.04, 0.06)),  # slowest, always there
+        ]
+
+    def run(router, label):
+        latencies, errors = [], 0
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            for _ in range(n):
+                start = time.perf_counter()
+                while True:  # like LLMAdvisor: an error means another attempt
+                    try:
+                        router.invoke(None)
+                        break
+                    except ConnectionError:
+                        errors += 1
+                latencies.append(time.perf_counter() - start)
+        latencies.sort()
+        mean = sum(latencies) / n
+        print(f"   {label:24} mean {mean * 1e3:5.1f} ms  p50 {latencies[n // 2] * 1e3:5.1f} ms  "
+              f"p99 {latencies[int(n * 0.99)] * 1e3:6.1f} ms  retries {errors:2}  {router.stats}")
+        return router
+
+    print(f"🔀 {n} sequential requests")
+    run(LLMRouter([profiles()[0]], hedge_percentile=0), "openai only")
+    run(LLMRouter(profiles()[::-1], hedge_percentile=0), "routed (EWMA)")
+    router = run(LLMRouter(profiles(), hedge_percentile=0.9), "routed + hedge at p90")
+    for name, health in router.status()["providers"].items():
+        print(f"      {name}: {health}")
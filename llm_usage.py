@@ -0,0 +1,255 @@
+# llm_usage.py - Token and cost accounting per patient / day / model, with daily budgets
+import sqlite3
+import threading
+from collections import Counter
+from clock import get_clock
+from config import get_settings
+
+# USD per 1M tokens (prompt, completion); LLM_PRICES in the settings file overrides or extends this
+PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1-nano": (0.10, 0.40),
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-3.5-turbo": (0.50, 1.50),
+}
+FREE_PROVIDERS = ("local", "stub")  # self-hosted / offline: tokens counted, no cost
+CHARS_PER_TOKEN = 4  # estimate when neither the response nor tiktoken can tell
+
+_encoders = {}
+
+
+def _encoder(model):
+    """tiktoken encoding for a model, or None (not installed / encoding files unavailable offline)"""
+    if model not in _encoders:
+        try:
+            import tiktoken  # optional; ships with langchain-openai
+            try:
+                _encoders[model] = tiktoken.encoding_for_model(model)
+            except KeyError:
+                _encoders[model] = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            _encoders[model] = None
+    return _encoders[model]
+
+
+def estimate_tokens(text, model=""):
+    encoder = _encoder(model)
+    if encoder is not None:
+        return len(encoder.encode(text))
+    return max(1, (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN)
+
+
+def token_usage(response, prompt_text="", completion_text="", model=""):
+    """(prompt_tokens, completion_tokens, estimated) - provider-reported counts when the response has them"""
+    usage = getattr(response, "usage_metadata", None)
+    if usage:
+        return usage.get("input_tokens", 0), usage.get("output_tokens", 0), False
+    reported = (getattr(response, "response_metadata", None) or {}).get("token_usage")
+    if reported:
+        return reported.get("prompt_tokens", 0), reported.get("completion_tokens", 0), False
+    return estimate_tokens(prompt_text, model), estimate_tokens(completion_text, model), True
+
+
+def cached_tokens(response):
+    """Prompt tokens the provider served from its prefix cache (0 when not reported)"""
+    reported = (getattr(response, "response_metadata", None) or {}).get("token_usage") or {}
+    return (reported.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+
+
+def cost_usd(model, provider, prompt_tokens, completion_tokens):
+    if provider in FREE_PROVIDERS:
+        return 0.0
+    prices = {**PRICES, **{name: tuple(p) for name, p in get_settings().llm_prices.items()}}
+    # Dated snapshots ("gpt-4o-mini-2024-07-18") are priced like their base model: longest prefix wins
+    name = max((n for n in prices if model.startswith(n)), key=len, default=None)
+    if name is None:
+        return 0.0
+    prompt_price, completion_price = prices[name]
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1e6
+
+
+class UsageLedger:
+    """Daily aggregates in SQLite, one row per (day, patient, model), updated in place.
+
+    Today's totals are also kept in memory so the budget check on every advice request
+    never touches the database.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS usage ("
+            " day TEXT NOT NULL,"
+            " patient_id TEXT NOT NULL,"
+            " model TEXT NOT NULL,"
+            " calls INTEGER NOT NULL,"
+            " prompt_tokens INTEGER NOT NULL,"
+            " completion_tokens INTEGER NOT NULL,"
+            " estimated_calls INTEGER NOT NULL,"  # calls whose tokens were estimated, not reported
+            " cost_usd REAL NOT NULL,"
+            " PRIMARY KEY (day, patient_id, model)"
+            ") WITHOUT ROWID"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+        self._day = None
+        self._today = Counter()  # patient_id -> cost today; "" key = everyone
+        self.stats = Counter()
+
+    def _roll(self, day):
+        """Reload today's cost totals (after midnight or a restart)"""
+        if day != self._day:
+            rows = self._conn.execute(
+                "SELECT patient_id, SUM(cost_usd) FROM usage WHERE day = ? GROUP BY patient_id", (day,)
+            ).fetchall()
+            self._today = Counter({patient_id: cost for patient_id, cost in rows})
+            self._today[""] = sum(cost for _, cost in rows)
+            self._day = day
+
+    def record(self, patient_id, model, prompt_tokens, completion_tokens, cost, estimated=False):
+        day = get_clock().now().date().isoformat()
+        with self._lock:
+            self._roll(day)
+            self._conn.execute(
+                "INSERT INTO usage VALUES (?, ?, ?, 1, ?, ?, ?, ?) ON CONFLICT (day, patient_id, model) DO UPDATE SET"
+                " calls = calls + 1, prompt_tokens = prompt_tokens + excluded.prompt_tokens,"
+                " completion_tokens = completion_tokens + excluded.completion_tokens,"
+                " estimated_calls = estimated_calls + excluded.estimated_calls, cost_usd = cost_usd + excluded.cost_usd",
+                (day, patient_id or "", model, prompt_tokens, completion_tokens, int(estimated), cost),
+            )
+            self._conn.commit()
+            self._today[patient_id or ""] += cost
+            if patient_id:
+                self._today[""] += cost
+            self.stats["calls"] += 1
+            self.stats["prompt_tokens"] += prompt_tokens
+            self.stats["completion_tokens"] += completion_tokens
+
+    def spent_today(self, patient_id=None):
+        """USD spent today by one patient, or by everyone"""
+        with self._lock:
+            self._roll(get_clock().now().date().isoformat())
+            return self._today[patient_id or ""]
+
+    def over_budget(self, patient_id=None):
+        """Which daily budget is exhausted: "global", "patient" or None"""
+        settings = get_settings()
+        if settings.llm_daily_budget_usd and self.spent_today() >= settings.llm_daily_budget_usd:
+            return "global"
+        if (patient_id and settings.llm_patient_daily_budget_usd
+                and self.spent_today(patient_id) >= settings.llm_patient_daily_budget_usd):
+            return "patient"
+        return None
+
+    def _aggregate(self, key, where, params):
+        columns = "SUM(calls), SUM(prompt_tokens), SUM(completion_tokens), SUM(estimated_calls), SUM(cost_usd)"
+        query = f"SELECT {key}, {columns} FROM usage WHERE {where}" + (f" GROUP BY {key}" if key != "''" else "")
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return {
+            name: {"calls": calls or 0, "prompt_tokens": prompt or 0, "completion_tokens": completion or 0,
+                   "estimated_calls": estimated or 0, "cost_usd": round(cost or 0.0, 6)}
+            for name, calls, prompt, completion, estimated, cost in rows
+        }
+
+    def report(self, day=None):
+        """Totals for a day (default today), by patient and by model, plus budget state"""
+        settings = get_settings()
+        day = day or get_clock().now().date().isoformat()
+        return {
+            "day": day,
+            "total": self._aggregate("''", "day = ?", (day,)).get("", {}),
+            "by_patient": self._aggregate("patient_id", "day = ?", (day,)),
+            "by_model": self._aggregate("model", "day = ?", (day,)),
+            "budget_usd": {"daily": settings.llm_daily_budget_usd or None,
+                           "per_patient_daily": settings.llm_patient_daily_budget_usd or None,
+                           "spent_today": round(self.spent_today(), 6)},
+            "over_budget_requests": self.stats["over_budget"],  # answered from cache / precomputed advice
+        }
+
+    def patient_history(self, patient_id, days=30):
+        """Per-day totals for one patient, newest first"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT day, SUM(calls), SUM(prompt_tokens), SUM(completion_tokens), SUM(cost_usd) FROM usage"
+                " WHERE patient_id = ? GROUP BY day ORDER BY day DESC LIMIT ?", (patient_id, days)
+            ).fetchall()
+        return [{"day": day, "calls": calls, "prompt_tokens": prompt, "completion_tokens": completion,
+                 "cost_usd": round(cost, 6)} for day, calls, prompt, completion, cost in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+
+def get_usage_ledger():
+    """Shared ledger at settings.llm_usage_db_path, opened on first use"""
+    global _ledger
+    if _ledger is None:
+        with _ledger_lock:
+            if _ledger is None:
+                _ledger = UsageLedger(get_settings().llm_usage_db_path)
+    return _ledger
+
+
+def record_llm_usage(patient_id, provider, response, prompt_text="", completion_text=""):
+    """Public interface for llm_advisor.py - returns (prompt_tokens, completion_tokens, cost)"""
+    metadata = getattr(response, "response_metadata", None) or {}
+    model = metadata.get("model_name") or (get_settings().llm_model if provider == "openai" else provider)
+    prompt_tokens, completion_tokens, estimated = token_usage(response, prompt_text, completion_text, model)
+    cost = cost_usd(model, provider, prompt_tokens, completion_tokens)
+    try:
+        get_usage_ledger().record(patient_id, model, prompt_tokens, completion_tokens, cost, estimated)
+    except sqlite3.Error as e:
+        print(f"⚠️ LLM usage not recorded: {e}")
+    return prompt_tokens, completion_tokens, cost
+
+
+# 🔬 Benchmark: a month of advice calls for 500 patients
+if __name__ == "__main__":
+    import os
+    import random
+    import tempfile
+    import time
+    from datetime import datetime
+    from clock import VirtualClock, set_clock
+    from langchain_core.messages import AIMessage
+
+    ledger = UsageLedger(os.path.join(tempfile.mkdtemp(), "usage.db"))
+    clock = VirtualClock(datetime(2025, 1, 1, 7, 0))
+    set_clock(clock)
+    rng = random.Random(1)
+    n_calls = 0
+    start = time.perf_counter()
+    for day in range(30):
+        for _ in range(2000):
+            response = AIMessage(content="advice", response_metadata={"model_name": "gpt-4o-mini-2024-07-18"},
+                                 usage_metadata={"input_tokens": rng.randint(150, 260),
+                                                 "output_tokens": rng.randint(40, 150), "total_tokens": 0})
+            prompt_tokens, completion_tokens, _ = token_usage(response)
+            cost = cost_usd("gpt-4o-mini-2024-07-18", "openai", prompt_tokens, completion_tokens)
+            ledger.record(f"p{rng.randrange(500)}", "gpt-4o-mini-2024-07-18", prompt_tokens, completion_tokens, cost)
+            n_calls += 1
+        clock.advance(86400)
+    elapsed = time.perf_counter() - start
+    print(f"💰 {n_calls:,} calls recorded in {elapsed:.1f}s ({elapsed / n_calls * 1e6:.0f} µs each)")
+    start = time.perf_counter()
+    for _ in range(10_000):
+        ledger.spent_today("p1")
+    print(f"⏱️ budget check: {(time.perf_counter() - start) / 10_000 * 1e6:.2f} µs")
+    start = time.perf_counter()
+    report = ledger.report("2025-01-15")
+    print(f"   day report in {(time.perf_counter() - start) * 1e3:.1f} ms: total {report['total']}, "
+          f"by_model {report['by_model']}")
+    print(f"   p1 history (3 days): {ledger.patient_history('p1', 3)}")
+    text = "Glucose reading: 62 mg/dL (falling) during automated monitoring. Provide immediate actions."
+    print(f"   tokenizer estimate for a {len(text)}-char prompt: {estimate_tokens(text, 'gpt-4o-mini')} tokens")
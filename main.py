@@ -1,62 +1,208 @@
 # main.py
 import time
-import schedule
 from datetime import datetime
-from glucose_reader import read_glucose_level
+from readers import get_polling_engine
 from llm_advisor import get_glucose_advice
 from whatsapp_sender import send_whatsapp_alert
-from sms_sender import send_glucose_alert
-from config import HYPO_THRESHOLD, HYPER_THRESHOLD
+from sms_sender import send_sms_alert
+from notifications import notify_care_team
+from delivery import resume_deliveries, track_delivery
+from config import get_settings, settings_manager
+from profiles import profile_store
+from analytics import glucose_analytics
+from agp import agp_reporter
+from patient_context import context_assembler
+from alert_state import trend_tracker, alert_suppressor, is_critical
+from clock import get_clock
+from tracing import span
+from warmup import warm_up_in_background
 
-def check_and_alert():
-    """Read glucose, get LLM advice, send alert if out of range."""
-    try:
-        data = read_glucose_level()
-        glucose = data["glucose"]
-        timestamp = data["timestamp"]
-        trend = data.get("trend", "stable")
-
-        print(f"[{datetime.now().strftime('%H:%M:%S')}] Glucose: {glucose} mg/dL ({trend})")
-
-        # Only alert if out of safe range
-        if glucose <= HYPO_THRESHOLD or glucose >= HYPER_THRESHOLD:
-            print("⚠️ Alert triggered!")
-
-            # Get AI advice
-            advice = get_glucose_advice(
-                glucose_level=glucose,
-                trend=trend,
-                context="automated monitoring"
-            )
-            print(f"💡 Advice: {advice[:60]}...")
-
-            # ✅ Try WhatsApp first (best for Lebanon)
-            result = send_whatsapp_alert(glucose, timestamp, advice)
-            print(f"📲 WhatsApp: {result}")
-
-            # ❌ Fallback to SMS if WhatsApp fails
-            if "❌" in result:
-                print("🔁 Fallback to SMS...")
-                result = send_glucose_alert(glucose, timestamp, advice)
-                print(f"📱 SMS: {result}")
-
-        else:
-            print("✅ Glucose in normal range — no alert.")
+# Default schedule (can be overridden by config or WhatsApp later)
+CHECK_TIMES = ["07:30", "12:00", "18:30", "22:00"]
+
+# Provider calls - simulation.py swaps these for stubs
+PROVIDERS = {
+    "advice": get_glucose_advice,
+    "whatsapp": send_whatsapp_alert,
+    "sms": send_sms_alert,
+    "notify": notify_care_team,
+    "track": track_delivery,
+}
 
+def check_and_alert(engine=None, providers=None, cluster=None, slot=None):
+    """Poll every glucose source, then alert on each out-of-range reading.
+
+    In cluster mode only patients whose partition this node owns are polled, and each
+    (patient, scheduled slot) is claimed in the shared store first so it alerts once.
+    """
+    engine = engine or get_polling_engine()
+    patient_filter = cluster.owns if cluster else None
+    if cluster and slot:
+        slot = f"{get_clock().now().date().isoformat()}T{slot}"
+    try:
+        with span("poll_sources") as poll_span:
+            readings = engine.poll_once(force=True, patient_filter=patient_filter)
+            poll_span.set_attribute("readings", len(readings))
     except Exception as e:
-        print(f"🚨 Error in check_and_alert: {e}")
+        print(f"🚨 Error polling glucose sources: {e}")
+        return
+
+    for reading in readings:
+        if cluster and not cluster.claim(reading.patient_id, slot):
+            continue
+        process_reading(reading, providers)
+
+def check_patient(patient_id, engine=None, providers=None):
+    """On-demand check for one patient (e.g. a "check now" reply); returns the outcomes"""
+    engine = engine or get_polling_engine()
+    readings = engine.poll_once(force=True, patient_filter=lambda p: p == patient_id)
+    return [process_reading(reading, providers) for reading in readings]
+
+def process_reading(reading, providers=None):
+    """Get LLM advice and send an alert if one patient's reading is out of range."""
+    providers = providers or PROVIDERS
+    with span("check_and_alert", patient_id=reading.patient_id, source=reading.source_id,
+              read_ms=round(reading.latency_ms, 1)) as root:
+        try:
+            patient_id = reading.patient_id
+            data = reading.data
+            glucose = data["glucose"]
+            timestamp = data["timestamp"]
+            now = get_clock().now()
+            reading_time = datetime.fromisoformat(timestamp)
+            trend = trend_tracker.update(patient_id, glucose, reading_time, data.get("trend"))
+            root.set_attribute("glucose", glucose)
+            root.set_attribute("trend", trend)
+            hypo_threshold, hyper_threshold = profile_store.thresholds_at(patient_id, now)
+            glucose_analytics.record(patient_id, glucose, reading_time)
+            agp_reporter.record(patient_id, glucose, reading_time)
+            context_assembler.record(patient_id, glucose, reading_time)
+
+            print(f"[{now.strftime('%H:%M:%S')}] Glucose: {glucose} mg/dL ({trend})")
+
+            # Only alert if out of safe range
+            if glucose <= hypo_threshold or glucose >= hyper_threshold:
+                kind = "low" if glucose <= hypo_threshold else "high"
+                if not alert_suppressor.should_alert(patient_id, kind, glucose):
+                    print(f"🔕 Repeat {kind} alert suppressed.")
+                    root.set_attribute("alert", "suppressed")
+                    return "suppressed"
+
+                print("⚠️ Alert triggered!")
+                root.set_attribute("alert", True)
+
+                # Get AI advice
+                advice = providers["advice"](
+                    glucose_level=glucose,
+                    trend=trend,
+                    context="automated monitoring",
+                    patient_id=patient_id,
+                    kind=kind
+                )
+                print(f"💡 Advice: {advice[:60]}...")
+
+                # 📣 Patient + caregivers (+ escalation) when a care team is configured
+                notify = providers.get("notify")
+                alert_id = notify(patient_id, glucose, timestamp, advice, kind=kind) if notify else None
+                delivered = alert_id is not None
+                if delivered:
+                    print(f"📣 Care team notified (alert {alert_id})")
+                    root.set_attribute("alert_id", alert_id)
+                else:
+                    # 📒 Ledger rows for delivery receipts; critical alerts fall back if undelivered
+                    settings = get_settings()
+                    track = providers.get("track") or (lambda *args, **kwargs: None)
+                    delivery = {"patient_id": patient_id, "glucose": glucose, "timestamp": timestamp,
+                                "advice": advice, "critical": is_critical(glucose), "kind": kind}
+
+                    # ✅ Try WhatsApp first (best for Lebanon)
+                    result = providers["whatsapp"](glucose, timestamp, advice, kind=kind)
+                    print(f"📲 WhatsApp: {result}")
+                    if result.get("success"):
+                        delivered = True
+                        track(result["sid"], "whatsapp", settings.patient_whatsapp, **delivery)
+
+                    # ❌ Fallback to SMS if WhatsApp fails
+                    if not result.get("success"):
+                        print("🔁 Fallback to SMS...")
+                        result = providers["sms"](glucose, timestamp, advice, kind=kind)
+                        print(f"📱 SMS: {result}")
+                        if result[0]:
+                            delivered = True
+                            track(result[1], "sms", settings.patient_phone_number, **delivery)
+
+                # Nothing went out: leave the suppressor alone so the next check alerts again
+                if not delivered:
+                    print("🚨 Alert could not be delivered on any channel")
+                    root.set_attribute("alert", "undelivered")
+                    return "undelivered"
+                alert_suppressor.record_alert(patient_id, kind, glucose)
+                return "alerted"
+
+            else:
+                print("✅ Glucose in normal range — no alert.")
+                root.set_attribute("alert", False)
+                alert_suppressor.clear(patient_id)
+                return "in_range"
+
+        except Exception as e:
+            root.record_error(e)
+            print(f"🚨 Error in check_and_alert ({reading.patient_id}): {e}")
+            return "error"
+
+_scheduler = {}  # set while a scheduler is running: {"add": function scheduling a check time}
+
+def add_check_time(t):
+    """Add a daily check time (e.g. a "schedule 08:00" reply, see inbound.apply_command);
+    live if the scheduler is running."""
+    if t in CHECK_TIMES:
+        return False
+    CHECK_TIMES.append(t)
+    if _scheduler:
+        _scheduler["add"](t)
+    print(f"⏰ Scheduled check at {t}")
+    return True
 
 def run_scheduler():
     """Run scheduled checks (e.g., 07:30, 12:00, 18:30, 22:00)."""
-    # Default schedule (can be overridden by config or WhatsApp later)
-    times = ["07:30", "12:00", "18:30", "22:00"]
-    
-    for t in times:
-        schedule.every().day.at(t).do(check_and_alert)
+    import schedule
+
+    # Critical messages still pending from before a restart get their fallback deadlines checked
+    resume_deliveries()
+
+    shard_workers = get_settings().shard_workers
+    if shard_workers > 1:
+        from sharding import run_scheduler as run_sharded_scheduler
+        return run_sharded_scheduler(shard_workers)
+
+    # Thresholds/credentials hot-reload on SIGHUP or settings file change
+    settings_manager.watch()
+
+    # With CLUSTER_DB set, every instance runs this schedule but each patient is checked by one
+    from cluster import get_cluster_node
+    cluster = get_cluster_node()
+    if cluster:
+        print(f"🛰️ Cluster node {cluster.node_id} joined ({cluster.store.path})")
+
+    def schedule_check(t):
+        schedule.every().day.at(t).do(check_and_alert, cluster=cluster, slot=t)
+
+    for t in CHECK_TIMES:
+        schedule_check(t)
         print(f"⏰ Scheduled check at {t}")
+    _scheduler["add"] = schedule_check
+
+    # Without EMBEDDED_SCHEDULER, ACK/SNOOZE/CHECK/SCHEDULE replies reach web.py, not this process:
+    # pick them up from the shared command store before each round of due checks
+    from inbound import apply_stored_commands, stores_commands
+    stored_commands = stores_commands()
+    if stored_commands:
+        apply_stored_commands()  # restores check times added by earlier SCHEDULE replies
 
     print("\n✅ Scheduler started. Waiting for next check...")
     while True:
+        if stored_commands:
+            apply_stored_commands(cluster.owns if cluster else None)
         schedule.run_pending()
         time.sleep(30)  # Check every 30 sec for due jobs
 
@@ -64,6 +210,7 @@ if __name__ == "__main__":
     try:
         print("🩺 GlucoAlert Agent v1.0 — WhatsApp + LLM + Fallback")
         print("="*60)
+        warm_up_in_background()
         run_scheduler()
     except KeyboardInterrupt:
         print("\n🛑 Stopped by user.")
\ No newline at end of file
@@ -0,0 +1,494 @@
+# messages.py - Precompiled alert templates per channel and locale, with SMS segment-aware fitting
+import re
+import unicodedata
+from collections import Counter
+from functools import lru_cache
+from string import Formatter
+from alert_state import is_critical
+from config import get_settings
+
+LOCALES = ("en", "fr", "ar")
+
+# GSM 03.38 default alphabet (1 septet each) and its extension table (escape + char = 2 septets)
+GSM_BASIC = frozenset(
+    "@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?"
+    "¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà"
+)
+GSM_EXTENDED = frozenset("^{}\\[~]|€\f")
+GSM_CHARS = GSM_BASIC | GSM_EXTENDED
+_ASCII_NOT_PLAIN_GSM = re.compile(r"[\^{}\\\[~\]|`]")  # ASCII chars that are extended or not GSM at all
+
+# (single-message limit, per-segment limit once concatenated) in encoding units
+SEGMENT_LIMITS = {"gsm7": (160, 153), "ucs2": (70, 67)}
+WHATSAPP_MAX_CHARS = 1600  # Twilio's WhatsApp body limit
+ELLIPSIS = {"gsm7": "...", "ucs2": "…"}
+
+TEMPLATES = {
+    "whatsapp": {
+        "en": {
+            "alert": "🩺 *GlucoAlert AI*\n*Status*: {emoji} {status}\n*Time*: {time}\n*Level*: {glucose} mg/dL\n\n",
+            "advice": "*💡 Advice:*\n{advice}",
+            "LOW": "LOW", "HIGH": "HIGH", "OK": "OK",
+        },
+        "fr": {
+            "alert": "🩺 *GlucoAlert IA*\n*Statut* : {emoji} {status}\n*Heure* : {time}\n*Glycémie* : {glucose} mg/dL\n\n",
+            "advice": "*💡 Conseil :*\n{advice}",
+            "LOW": "BASSE", "HIGH": "ÉLEVÉE", "OK": "NORMALE",
+        },
+        "ar": {
+            "alert": "🩺 *GlucoAlert AI*\n*الحالة*: {emoji} {status}\n*الوقت*: {time}\n*مستوى السكر*: {glucose} mg/dL\n\n",
+            "advice": "*💡 نصيحة:*\n{advice}",
+            "LOW": "منخفض", "HIGH": "مرتفع", "OK": "طبيعي",
+        },
+    },
+    "voice": {  # read aloud by <Say>: no emoji or markdown, units spelled out
+        "en": {
+            "alert": "GlucoAlert. {status} glucose alert at {time}. Glucose is {glucose} milligrams per deciliter. ",
+            "advice": "{advice}",
+            "LOW": "Low", "HIGH": "High", "OK": "Normal",
+        },
+        "fr": {
+            "alert": "GlucoAlert. Alerte glycémie {status} à {time}. "
+                     "La glycémie est de {glucose} milligrammes par décilitre. ",
+            "advice": "{advice}",
+            "LOW": "basse", "HIGH": "élevée", "OK": "normale",
+        },
+        "ar": {
+            "alert": "تنبيه GlucoAlert. {status} الساعة {time}. مستوى السكر {glucose} ملليغرام لكل ديسيلتر. ",
+            "advice": "{advice}",
+            "LOW": "سكر منخفض", "HIGH": "سكر مرتفع", "OK": "سكر طبيعي",
+        },
+    },
+    "sms": {
+        "en": {
+            "alert": "GlucoAlert {time} {status} {glucose}mg/dL",
+            "advice": ". {advice}",
+            "LOW": "LOW", "HIGH": "HIGH", "OK": "OK",
+        },
+        "fr": {
+            "alert": "GlucoAlert {time} glycémie {status} {glucose}mg/dL",
+            "advice": ". {advice}",
+            "LOW": "BASSE", "HIGH": "ÉLEVÉE", "OK": "NORMALE",
+        },
+        "ar": {
+            "alert": "GlucoAlert {time} {status} {glucose}mg/dL",
+            "advice": ". {advice}",
+            "LOW": "سكر منخفض", "HIGH": "سكر مرتفع", "OK": "طبيعي",
+        },
+    },
+}
+STATUS_EMOJI = {"LOW": "⚠️", "HIGH": "⚠️", "OK": "✅"}
+
+
+def encoding_units(text):
+    """("gsm7", septets) if the text fits the GSM alphabet, else ("ucs2", UTF-16 code units)"""
+    if text.isascii():
+        if not _ASCII_NOT_PLAIN_GSM.search(text):
+            return "gsm7", len(text)
+    chars = set(text)
+    if chars <= GSM_CHARS:
+        extended = chars & GSM_EXTENDED
+        return "gsm7", len(text) + sum(text.count(c) for c in extended)
+    return "ucs2", _utf16_units(text)
+
+
+def _utf16_units(text):
+    return len(text.encode("utf-16-le")) >> 1  # astral chars (emoji) are surrogate pairs
+
+
+def units_of(text, encoding):
+    if encoding == "gsm7":
+        return len(text) + sum(text.count(c) for c in set(text) & GSM_EXTENDED)
+    return _utf16_units(text)
+
+
+def sms_segments(text):
+    """(encoding, billed segments) for an SMS body"""
+    encoding, units = encoding_units(text)
+    single, multi = SEGMENT_LIMITS[encoding]
+    if units <= single:
+        return encoding, 1
+    return encoding, -(-units // multi)
+
+
+def sms_capacity(encoding, max_segments):
+    single, multi = SEGMENT_LIMITS[encoding]
+    return single if max_segments <= 1 else multi * max_segments
+
+
+def truncate_words(text, budget, encoding):
+    """Cut `text` to `budget` units at a word boundary, marking the cut with an ellipsis"""
+    if units_of(text, encoding) <= budget:
+        return text
+    mark = ELLIPSIS[encoding]
+    budget -= len(mark)
+    if budget <= 0:
+        return ""
+    if encoding == "gsm7" and not (set(text) & GSM_EXTENDED) or encoding == "ucs2" and _utf16_units(text) == len(text):
+        cut = text[:budget + 1]  # one char over, so a word ending exactly at the budget is kept
+    else:
+        used, end = 0, 0
+        for end, c in enumerate(text):
+            used += 2 if (c in GSM_EXTENDED if encoding == "gsm7" else ord(c) > 0xFFFF) else 1
+            if used > budget + 1:
+                break
+        else:
+            end = len(text)
+        cut = text[:end]
+    space = cut.rfind(" ")
+    head = cut[:space] if space > 0 else cut[:budget]
+    return head.rstrip(" ,;:-") + mark
+
+
+TEMPLATE_FIELDS = {"alert": {"emoji", "status", "time", "glucose"}, "advice": {"advice"}}
+
+
+# --- SMS compaction: keep bodies in GSM-7 and within the segment budget ---
+
+# Common LLM output characters outside GSM-7, mapped to GSM look-alikes
+TRANSLITERATIONS = {
+    "‘": "'", "’": "'", "‚": "'", "‛": "'", "′": "'", "“": '"', "”": '"', "„": '"', "″": '"',
+    "–": "-", "—": "-", "‒": "-", "−": "-", "‐": "-", "…": "...", "•": "-", "·": "-",
+    "\u00a0": " ", "\u2009": " ", "\u202f": " ", "\t": " ",
+    "≤": "<=", "≥": ">=", "±": "+/-", "×": "x", "÷": "/", "→": "->", "µ": "u", "°": " deg",
+    "½": "1/2", "¼": "1/4", "¾": "3/4", "œ": "oe", "Œ": "OE",
+}
+
+# Clinical phrases -> SMS shorthand (applied only when the advice does not fit)
+ABBREVIATIONS = {
+    "en": {
+        "milligrams per deciliter": "mg/dL", "blood glucose": "BG", "blood sugar": "BG",
+        "carbohydrates": "carbs", "glucose tablets": "glucose tabs", "fast-acting": "fast",
+        "healthcare provider": "doctor", "immediately": "now",
+        "minutes": "min", "minute": "min", "hours": "h", "hour": "h", "grams": "g",
+        "approximately": "approx", "for example": "e.g.", "please": "", "if you feel": "if",
+        "continue to monitor": "monitor", "consume": "eat", "with": "w/",
+    },
+    "fr": {
+        "glycémie": "glyc", "glucides": "sucres", "immédiatement": "vite", "minutes": "min",
+        "heures": "h", "grammes": "g", "médecin traitant": "médecin", "services d'urgence": "urgences",
+        "s'il vous plaît": "", "environ": "env.",
+    },
+}
+
+# Sentences carrying these are worth the most SMS space
+_ACTION_WORDS = re.compile(
+    r"\b(eat|drink|take|recheck|check|call|seek|insulin|carbs?|juice|tabs?|water|emergency|doctor|"
+    r"mange[zr]?|bu?vez|prenez|appelez|urgences?|médecin|resucrez)\b", re.IGNORECASE)
+_BOILERPLATE = re.compile(r"safety message|consult|personalized|generic", re.IGNORECASE)
+# "🚨 HIGH GLUCOSE (320 mg/dL)": the SMS heading already says it
+_RESTATED_READING = re.compile(r"^\W*(critical\s+)?(low|high)\s+glucose\s*\(\s*\d+\s*mg/dl\s*\)\W*$",
+                               re.IGNORECASE)
+# A low or critical-high alert never loses the first sentence of each kind here, whatever the SMS budget
+ESSENTIAL_SENTENCES = {
+    "treatment": re.compile(r"\b(carbs?|carbohydrates?|juice|soda|glucose tab|(?<!blood )sugar|sucre|glucides|jus|"
+                            r"resucrez)|سكر|عصير", re.IGNORECASE),
+    "hydration": re.compile(r"\b(water|drink|hydrat\w*|eau|buvez|boire)\b|ماء|اشرب", re.IGNORECASE),
+    "emergency": re.compile(r"emergenc|\b(911|112|urgences?|ambulance|SAMU)\b|طوارئ|إسعاف", re.IGNORECASE),
+}
+ESSENTIALS = {"LOW": ("treatment", "emergency"), "HIGH": ("hydration", "emergency")}  # HIGH: critical only
+ESSENTIAL_EXTRA_SEGMENTS = 2  # such an alert may grow this far past SMS_MAX_SEGMENTS to keep its essentials
+_PICTOGRAPHS = re.compile("[\u2190-\u21ff\u2300-\u23ff\u2600-\u27bf\u2b00-\u2bff\ufe00-\ufe0f\u200d"
+                          "\U0001f000-\U0001faff]")
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+|\n+")
+MAX_SENTENCES = 10  # subset search is exhaustive over at most this many
+
+
+def _gsm_substitute(c):
+    """GSM stand-in for one character: table, then accent stripping; '' when there is none"""
+    if c in GSM_CHARS:
+        return c
+    if c in TRANSLITERATIONS:
+        return TRANSLITERATIONS[c]
+    base = "".join(b for b in unicodedata.normalize("NFKD", c) if not unicodedata.combining(b))
+    return base if base and set(base) <= GSM_CHARS else ""
+
+
+class _Transliterator(dict):
+    """str.translate table that decides each new character once and remembers it"""
+
+    def __missing__(self, codepoint):
+        self[codepoint] = replacement = _gsm_substitute(chr(codepoint))
+        return replacement
+
+
+_to_gsm = _Transliterator()
+
+
+def transliterate_gsm(text):
+    """Map smart quotes, dashes, accents etc. to GSM-7 and drop what has no equivalent (emoji)"""
+    if text.isascii() and not _ASCII_NOT_PLAIN_GSM.search(text):
+        return text
+    return " ".join(text.translate(_to_gsm).split())
+
+
+def _compile_abbreviations(table):
+    """One alternation regex per locale, longest phrase first; a phrase mapped to '' takes its space with it"""
+    lookup = {phrase.strip().lower(): short for phrase, short in table.items()}
+    alternation = "|".join(re.escape(p) for p in sorted(lookup, key=len, reverse=True))
+    pattern = re.compile(r"\b(" + alternation + r")\b(\s?)", re.IGNORECASE)
+
+    def replace(match):
+        short = lookup[match.group(1).lower()]
+        if short and match.group(1)[0].isupper():
+            short = short[0].upper() + short[1:]  # "Immediately eat" -> "Now eat"
+        return short + match.group(2) if short else ""
+
+    return lambda text: pattern.sub(replace, text)
+
+
+_ABBREVIATORS = {locale: _compile_abbreviations(table) for locale, table in ABBREVIATIONS.items()}
+
+
+def abbreviate(text, locale="en"):
+    """Locale shorthand, then English (LLM advice is often English whatever the template locale)"""
+    for name in dict.fromkeys((locale, "en")):
+        abbreviator = _ABBREVIATORS.get(name)
+        if abbreviator:
+            text = abbreviator(text)
+    return " ".join(text.split())
+
+
+def strip_symbols(text):
+    """Drop emoji and other pictographs - up to 2 UTF-16 units each in a UCS-2 SMS"""
+    if text.isascii():
+        return text
+    return " ".join(_PICTOGRAPHS.sub("", text).split())
+
+
+def _sentence_score(sentence, position):
+    """Information value: clinical actions, earlier sentences first; boilerplate and a restated
+    reading are worth 0"""
+    if _BOILERPLATE.search(sentence) or _RESTATED_READING.match(sentence):
+        return 0.0
+    return 1.0 + 2.0 * len(_ACTION_WORDS.findall(sentence)) + 1.0 / (1 + position)
+
+
+def select_sentences(text, budget, encoding, keep=()):
+    """Highest-value subset of sentences (kept in order) that fits `budget` units; None if none fits.
+    For each ESSENTIAL_SENTENCES kind in `keep`, the first sentence of that kind must be in the subset."""
+    sentences = [s.strip() for s in _SENTENCE_SPLIT.split(text) if s.strip()][:MAX_SENTENCES]
+    scores = [_sentence_score(s, i) for i, s in enumerate(sentences)]
+    sentences = [s for s, score in zip(sentences, scores) if score > 0]
+    scores = [score for score in scores if score > 0]
+    costs = [units_of(s, encoding) + 1 for s in sentences]  # +1 for the joining space
+    required = 0
+    for kind in keep:
+        first = next((i for i, s in enumerate(sentences) if ESSENTIAL_SENTENCES[kind].search(s)), None)
+        if first is not None:
+            required |= 1 << first
+    # Exhaustive over bitmasks; each mask's totals extend the mask without its lowest bit
+    n = len(sentences)
+    mask_cost, mask_score = [0] * (1 << n), [0.0] * (1 << n)
+    best, best_score = 0, 0.0
+    for mask in range(1, 1 << n):
+        low = mask & -mask
+        i = low.bit_length() - 1
+        mask_cost[mask] = cost = mask_cost[mask ^ low] + costs[i]
+        mask_score[mask] = score = mask_score[mask ^ low] + scores[i]
+        if cost - 1 <= budget and score > best_score and mask & required == required:
+            best, best_score = mask, score
+    if not best:
+        return None
+    return " ".join(s for i, s in enumerate(sentences) if best >> i & 1)
+
+
+@lru_cache(maxsize=1024)  # fallback and repeated LLM advice compacts once
+def compact_advice(advice, budget, encoding, locale="en", keep=()):
+    """Shrink advice to `budget` units: abbreviations, then best sentence subset, then word truncation.
+    With `keep` (see select_sentences) the advice is None when those sentences cannot fit."""
+    steps = []
+    short = abbreviate(advice, locale)
+    if short != advice:
+        steps.append("abbreviated")
+        advice = short
+    if units_of(advice, encoding) > budget:
+        chosen = select_sentences(advice, budget, encoding, keep)
+        if chosen is not None:
+            steps.append("sentences_selected")
+            advice = chosen
+        elif keep:
+            return None, tuple(steps)
+        else:
+            steps.append("truncated")
+            advice = truncate_words(advice, budget, encoding)
+    return advice, tuple(steps)
+
+
+class _CompiledTemplate:
+    """A template validated once, rendered with str.format_map"""
+    __slots__ = ("source", "fields", "render")
+
+    def __init__(self, source, allowed):
+        self.source = source
+        self.fields = frozenset(name for _, name, _, _ in Formatter().parse(source) if name)
+        if not self.fields <= allowed:
+            raise ValueError(f"Unknown template fields {sorted(self.fields - allowed)} in {source!r}")
+        self.render = source.format_map
+
+
+class MessageRenderer:
+    def __init__(self, templates=TEMPLATES):
+        self.stats = Counter()  # SMS messages / segments / compaction steps used
+        self._compiled = {}  # (channel, locale) -> {"alert", "advice", statuses}
+        for channel, locales in templates.items():
+            for locale, parts in locales.items():
+                self._compiled[(channel, locale)] = {
+                    key: _CompiledTemplate(text, TEMPLATE_FIELDS[key]) if key in TEMPLATE_FIELDS else text
+                    for key, text in parts.items()
+                }
+
+    def _templates(self, channel, locale):
+        compiled = self._compiled.get((channel, locale))
+        if compiled is None:
+            compiled = self._compiled.get((channel, "en"))
+            if compiled is None:
+                raise KeyError(f"No templates for channel {channel!r}")
+        return compiled
+
+    def render_alert(self, channel, glucose_level, timestamp, advice="", locale=None, max_segments=None,
+                     kind=None):
+        """Full alert body; SMS advice is shortened at a word boundary to stay within max_segments.
+        `kind` ("low"/"high") is the decision process_reading made with the patient's own thresholds;
+        without it the status falls back to the global thresholds, compared the same way."""
+        settings = get_settings()
+        templates = self._templates(channel, locale or settings.message_locale)
+        if kind:
+            status = kind.upper()
+        else:
+            hypo, hyper = settings.thresholds_for()
+            status = "LOW" if glucose_level <= hypo else "HIGH" if glucose_level >= hyper else "OK"
+        head = templates["alert"].render({
+            "emoji": STATUS_EMOJI[status],
+            "status": templates[status],
+            "time": timestamp.split("T")[1][:5] if "T" in timestamp else timestamp,
+            "glucose": glucose_level,
+        })
+        if channel == "voice":
+            advice = strip_symbols(advice)
+        if channel == "sms":
+            # A line break ends a sentence (the safety fallback is one instruction per line)
+            lines = (" ".join(line.split()) for line in advice.splitlines())
+            advice = " ".join(line if line[-1] in ".!?:" else line + "." for line in lines
+                              if line and not _RESTATED_READING.match(line))
+        advice = " ".join(advice.split())
+        if not advice:
+            return head
+        advice_template = templates["advice"]
+        if channel != "sms":
+            text = head + advice_template.render({"advice": advice})
+            return text if len(text) <= WHATSAPP_MAX_CHARS else head + advice_template.render(
+                {"advice": truncate_words(advice, WHATSAPP_MAX_CHARS - len(head) - 32, "ucs2")})
+
+        keep = ESSENTIALS[status] if status == "LOW" or (status == "HIGH" and is_critical(glucose_level)) else ()
+        return self._fit_sms(head, advice_template, advice, locale or settings.message_locale,
+                             max_segments or settings.sms_max_segments, keep)
+
+    def _fit_sms(self, head, advice_template, advice, locale, max_segments, keep=()):
+        """Cheapest-first compaction: GSM transliteration, abbreviations, sentence choice, truncation.
+        Sentences of the `keep` kinds are never cut: the SMS takes up to ESSENTIAL_EXTRA_SEGMENTS more
+        segments first, and only then is the advice truncated."""
+        head_encoding, _ = encoding_units(head)
+        cleaned = transliterate_gsm(advice) if head_encoding == "gsm7" else strip_symbols(advice)
+        if cleaned != advice:
+            self.stats["transliterated"] += 1
+            advice = cleaned
+        text = head + advice_template.render({"advice": advice})
+        encoding, units = encoding_units(text)
+        for extra in range(ESSENTIAL_EXTRA_SEGMENTS + 1 if keep else 1):
+            capacity = sms_capacity(encoding, max_segments + extra)
+            if units <= capacity:
+                break
+            budget = capacity - (units - units_of(advice, encoding))
+            fitted, steps = compact_advice(advice, budget, encoding, locale, keep)
+            if fitted is not None:
+                break
+        else:
+            fitted, steps = compact_advice(advice, budget, encoding, locale)
+            self.stats["essentials_truncated"] += 1
+        if units > capacity:
+            self.stats.update(steps)
+            self.stats["extra_segments"] += extra
+            advice = fitted
+            text = head + advice_template.render({"advice": advice}) if advice else head
+        encoding, segments = sms_segments(text)
+        self.stats["sms"] += 1
+        self.stats["sms_segments"] += segments
+        self.stats[f"sms_{encoding}"] += 1
+        return text
+
+    def sms_report(self):
+        """Segment metrics for billing: average segments per SMS and how often each step was needed"""
+        sent = self.stats["sms"]
+        return {
+            **self.stats,
+            "segments_per_sms": round(self.stats["sms_segments"] / sent, 3) if sent else None,
+        }
+
+
+# Global instance
+message_renderer = MessageRenderer()
+
+
+def render_alert(channel, glucose_level, timestamp, advice="", locale=None, max_segments=None, kind=None):
+    """Public interface"""
+    return message_renderer.render_alert(channel, glucose_level, timestamp, advice, locale, max_segments, kind)
+
+
+# 🔬 Benchmark
+if __name__ == "__main__":
+    import timeit
+
+    advice = ("Eat 15g of fast-acting carbs (juice or glucose tabs). Recheck in 15 minutes. "
+              "If still below 70 mg/dL, repeat and call your doctor.")
+    for locale in LOCALES:
+        for channel in ("sms", "whatsapp"):
+            body = render_alert(channel, 62, "2025-01-06T07:30:00", advice, locale=locale)
+            encoding, segments = sms_segments(body)
+            print(f"[{channel}/{locale}] {encoding} {segments} seg, {len(body)} chars: {body!r}")
+
+    n = 100_000
+    for label, args in [
+        ("sms/en (fits)", ("sms", 62, "2025-01-06T07:30:00", "Eat 15g fast carbs, recheck in 15 min.", "en")),
+        ("sms/en (trimmed)", ("sms", 62, "2025-01-06T07:30:00", advice, "en")),
+        ("sms/ar (UCS-2)", ("sms", 250, "2025-01-06T07:30:00", advice, "ar")),
+        ("whatsapp/fr", ("whatsapp", 250, "2025-01-06T07:30:00", advice, "fr")),
+    ]:
+        per = timeit.timeit(lambda: render_alert(*args), number=n) / n
+        print(f"⏱️ {label}: {per * 1e6:.2f} µs/message")
+
+    # Segment cost: raw advice appended vs the compaction stage, on typical LLM/fallback outputs
+    from llm_advisor import LLMAdvisor
+    fallback = LLMAdvisor()._get_safety_fallback
+
+    # A critical SMS keeps its action and emergency sentences in every locale, without restating the reading
+    for glucose, kind in ((45, "low"), (320, "high")):
+        for locale in LOCALES:
+            body = render_alert("sms", glucose, "2025-01-06T03:10:00", fallback(glucose, kind=kind), locale=locale,
+                                kind=kind)
+            advice_part = body.split(". ", 1)[1]
+            missing = [essential for essential in ESSENTIALS[kind.upper()]
+                       if not ESSENTIAL_SENTENCES[essential].search(advice_part)]
+            assert not missing, f"sms/{locale} critical {kind} lost {missing}: {body!r}"
+            assert "GLUCOSE (" not in advice_part, f"sms/{locale} restates the reading: {body!r}"
+            print(f"🚨 sms/{locale} {glucose} mg/dL: {sms_segments(body)[1]} seg, "
+                  f"{' + '.join(ESSENTIALS[kind.upper()])} kept")
+    samples = [fallback(g) for g in (48, 62, 69, 190, 260, 320)] + [
+        "Your glucose is a bit low – have 15g of fast-acting carbs (e.g. juice) and recheck in 15 minutes.",
+        "You’re running high. Drink water, skip sweets for now, and check again in 2 hours.",
+        "Glycémie basse : prenez 15 g de sucre rapide (jus, comprimés) et recontrôlez dans 15 minutes.",
+        "Glucose is trending down fast 📉 — eat a snack now. If you feel shaky or confused, call for help.",
+    ]
+    message_renderer.stats.clear()
+    for locale in LOCALES:
+        raw = fitted = 0
+        for i, sample in enumerate(samples):
+            glucose = 55 if i % 2 else 250
+            head = render_alert("sms", glucose, "2025-01-06T07:30:00", "", locale=locale)
+            raw += sms_segments(f"{head}. {' '.join(sample.split())}")[1]
+            fitted += sms_segments(render_alert("sms", glucose, "2025-01-06T07:30:00", sample, locale=locale))[1]
+        print(f"💬 sms/{locale}: {raw / len(samples):.2f} → {fitted / len(samples):.2f} segments per alert")
+    print(f"   {message_renderer.sms_report()}")
+    per = timeit.timeit(lambda: compact_advice.__wrapped__(samples[1], 120, "gsm7"), number=2000) / 2000
+    cached = timeit.timeit(lambda: render_alert("sms", 55, "2025-01-06T07:30:00", samples[1]), number=2000) / 2000
+    print(f"⏱️ sms/en compaction: {per * 1e6:.1f} µs first time, {cached * 1e6:.1f} µs/message when repeated")
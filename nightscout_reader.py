@@ -0,0 +1,268 @@
+# nightscout_reader.py - Incremental Nightscout /api/v1/entries sync for many patients
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from clock import get_clock
+from config import get_settings
+from reading_store import get_reading_store
+
+ENTRIES_PATH = "/api/v1/entries/sgv.json"
+FETCH_COUNT = 288  # one day of 5-minute entries per page; longer gaps take several pages
+REQUEST_TIMEOUT = 10.0
+
+# Nightscout `direction` -> the trend words used by read_glucose_level()
+DIRECTIONS = {
+    "DoubleUp": "rising", "SingleUp": "rising", "FortyFiveUp": "rising",
+    "Flat": "stable",
+    "FortyFiveDown": "falling", "SingleDown": "falling", "DoubleDown": "falling",
+}
+
+
+class NightscoutSync:
+    def __init__(self, sites=None, concurrency=None, store=None, session=None):
+        settings = get_settings()
+        self.sites = dict(settings.nightscout_sites if sites is None else sites)
+        self.concurrency = concurrency or settings.nightscout_concurrency
+        self.store = store
+        self._session = session
+        self._high_water = {}  # patient_id -> newest entry date (epoch ms) already synced
+        self._validators = {}  # patient_id -> {"etag": ..., "last_modified": ...}
+        self._latest = {}  # patient_id -> newest entry dict
+        self._delivered = {}  # patient_id -> date (epoch ms) of the last reading read_latest() returned
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "not_modified": 0, "entries": 0, "errors": 0, "pages": 0,
+                      "stale": 0, "repeats": 0}
+
+    @property
+    def session(self):
+        """One pooled HTTP session shared by all fetch threads"""
+        if self._session is None:
+            import requests  # deferred: only needed once syncing starts
+            from requests.adapters import HTTPAdapter
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=self.concurrency, pool_maxsize=self.concurrency)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self._session = session
+        return self._session
+
+    def _store(self):
+        if self.store is None:
+            self.store = get_reading_store()
+        return self.store
+
+    def _high_water_mark(self, patient_id):
+        mark = self._high_water.get(patient_id)
+        if mark is None:
+            latest = self._store().latest_timestamp(patient_id)
+            mark = latest * 1000 if latest is not None else 0
+            self._high_water[patient_id] = mark
+        return mark
+
+    def _error(self, patient_id, message):
+        with self._lock:
+            self.stats["errors"] += 1
+        print(f"❌ Nightscout {patient_id}: {message}")
+        return []
+
+    def sync_patient(self, patient_id):
+        """Fetch entries newer than the patient's high-water mark; returns new entries (oldest first).
+
+        Nightscout returns the newest `count` entries first, so a gap longer than one page is
+        read backwards with find[date][$lt] until a short page. Nothing is stored (and the
+        high-water mark does not move) unless every page succeeded.
+        """
+        site = self.sites[patient_id]
+        since = self._high_water_mark(patient_id)
+        params = {"find[date][$gt]": since, "count": FETCH_COUNT}
+        if site.get("token"):
+            params["token"] = site["token"]
+        headers = {"Accept": "application/json"}
+        validators = self._validators.get(patient_id, {})
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+
+        url = site["url"].rstrip("/") + ENTRIES_PATH
+        entries, before, first = [], None, None
+        while True:
+            page_params = params if before is None else {**params, "find[date][$lt]": before}
+            try:
+                # Conditional headers only on the first page: older pages are never cached
+                response = self.session.get(url, params=page_params, timeout=REQUEST_TIMEOUT,
+                                            headers=headers if before is None else {"Accept": "application/json"})
+            except Exception as e:
+                with self._lock:
+                    self.stats["requests"] += 1
+                return self._error(patient_id, f"fetch failed: {type(e).__name__} - {str(e)[:100]}")
+
+            with self._lock:
+                self.stats["requests"] += 1
+            if response.status_code == 304 and before is None:
+                with self._lock:
+                    self.stats["not_modified"] += 1
+                return []
+            if response.status_code != 200:
+                return self._error(patient_id, f"HTTP {response.status_code}")
+            try:
+                page = response.json()
+            except ValueError as e:
+                return self._error(patient_id, f"invalid JSON ({str(e)[:60]})")
+            if not isinstance(page, list):
+                return self._error(patient_id, f"unexpected {type(page).__name__} response")
+            with self._lock:
+                self.stats["pages"] += 1
+            first = first or response
+            dated = [e for e in page if isinstance(e, dict) and e.get("date", 0) > since]
+            entries.extend(e for e in dated if e.get("sgv") is not None)
+            if len(page) < FETCH_COUNT or not dated:
+                break
+            oldest = min(e["date"] for e in dated)
+            if before is not None and oldest >= before:
+                break  # the server ignored $lt: stop rather than loop
+            before = oldest
+
+        self._validators[patient_id] = {
+            "etag": first.headers.get("ETag"),
+            "last_modified": first.headers.get("Last-Modified"),
+        }
+        if not entries:
+            return []
+        entries.sort(key=lambda e: e["date"])
+        self._store().add_many(patient_id, [e["date"] // 1000 for e in entries],
+                               [e["sgv"] for e in entries], "nightscout")
+        self._high_water[patient_id] = entries[-1]["date"]
+        with self._lock:
+            self._latest[patient_id] = entries[-1]
+            self.stats["entries"] += len(entries)
+        return entries
+
+    def sync_all(self, patient_ids=None):
+        """Sync every site concurrently (at most `concurrency` requests in flight)"""
+        patient_ids = list(self.sites if patient_ids is None else patient_ids)
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="nightscout") as pool:
+            results = pool.map(self.sync_patient, patient_ids)
+            return dict(zip(patient_ids, results))
+
+    def read_latest(self, patient_id):
+        """Newest reading in read_glucose_level() format (syncs first).
+
+        None when that reading was already returned (it must not be recorded or alerted on twice)
+        or is older than settings.nightscout_max_age_minutes.
+        """
+        self.sync_patient(patient_id)
+        entry = self._latest.get(patient_id)
+        if entry is None:
+            # Nothing new since a restart: fall back to the newest stored reading
+            latest = self._store().latest_timestamp(patient_id)
+            if latest is None:
+                raise LookupError(f"No Nightscout readings for {patient_id}")
+            ts, glucose = self._store().readings(patient_id, start=latest)[-1]
+            entry = {"sgv": glucose, "date": ts * 1000}
+        with self._lock:
+            if entry["date"] <= self._delivered.get(patient_id, 0):
+                self.stats["repeats"] += 1
+                return None
+            age_min = (get_clock().time() * 1000 - entry["date"]) / 60_000
+            if age_min > get_settings().nightscout_max_age_minutes:
+                self._delivered[patient_id] = entry["date"]  # reported once, not on every poll
+                self.stats["stale"] += 1
+                print(f"⏳ Nightscout {patient_id}: newest reading is {age_min:.0f} min old - not alerting")
+                return None
+            self._delivered[patient_id] = entry["date"]
+        return {
+            "glucose": entry["sgv"],
+            "timestamp": datetime.fromtimestamp(entry["date"] / 1000).isoformat(),
+            "trend": DIRECTIONS.get(entry.get("direction"), "stable"),
+        }
+
+
+_sync = None
+
+
+def get_nightscout_sync():
+    """Shared syncer for settings.nightscout_sites, created on first use"""
+    global _sync
+    if _sync is None:
+        _sync = NightscoutSync()
+    return _sync
+
+
+# 🔬 Local stand-in + benchmark
+def start_stand_in_server(entries_per_site=12, step_ms=300_000, port=0):
+    """Serve /site/<n>/api/v1/entries/sgv.json for any n, with ETag/304 support"""
+    import json
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import urlparse, parse_qs
+
+    base_ms = int(time.time() * 1000) - entries_per_site * step_ms
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, so pooled connections are reused
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            site = int(url.path.split("/")[2])
+            query = parse_qs(url.query)
+            since = int(query.get("find[date][$gt]", ["0"])[0])
+            before = int(query.get("find[date][$lt]", [str(2 ** 62)])[0])
+            count = int(query.get("count", ["10"])[0])
+            etag = f'"{site}-{base_ms + (entries_per_site - 1) * step_ms}"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            entries = [
+                {"sgv": 90 + (site + i) % 120, "date": base_ms + i * step_ms, "direction": "Flat"}
+                for i in range(entries_per_site) if since < base_ms + i * step_ms < before
+            ][::-1][:count]  # newest first, like Nightscout
+            body = json.dumps(entries).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    import sys
+    from reading_store import ReadingStore
+
+    n_sites = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+    server = start_stand_in_server()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    sites = {f"p{i}": {"url": f"{base}/site/{i}"} for i in range(n_sites)}
+    sync = NightscoutSync(sites, concurrency, ReadingStore(":memory:"))
+
+    for label in ("initial sync", "incremental (no new data)"):
+        before = dict(sync.stats)
+        start = time.perf_counter()
+        sync.sync_all()
+        elapsed = time.perf_counter() - start
+        delta = {k: sync.stats[k] - before[k] for k in sync.stats}
+        print(f"🔄 {label}: {n_sites:,} sites in {elapsed:.2f}s ({n_sites / elapsed:,.0f} sites/s) {delta}")
+    print(f"   stored readings: {sync.store.count():,}")
+    print(f"   latest p0: {sync.read_latest('p0')}, polled again: {sync.read_latest('p0')}")
+    server.shutdown()
+
+    # A week-long uploader gap: 2,016 entries arrive at once, more than one page
+    server = start_stand_in_server(entries_per_site=7 * 288)
+    gap = NightscoutSync({"p0": {"url": f"http://127.0.0.1:{server.server_address[1]}/site/0"}}, 1,
+                         ReadingStore(":memory:"))
+    new = gap.sync_patient("p0")
+    print(f"📚 week-long gap: {len(new):,} entries stored of {7 * 288:,} in {gap.stats['pages']} pages")
+    server.shutdown()
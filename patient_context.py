@@ -0,0 +1,275 @@
+# patient_context.py - Compact patient history for the advice prompt, from running per-patient aggregates
+import sqlite3
+import threading
+from collections import deque
+from datetime import datetime
+from analytics import glucose_analytics
+from clock import get_clock
+from config import get_settings
+from llm_usage import estimate_tokens
+
+LOW_MGDL = 70  # consensus range, like analytics.py - not the patient's alert thresholds
+LOW_DAYS = 7
+RISE_MGDL = 40  # this much above the recent trough within RISE_WINDOW_S counts as a meal rise
+RISE_WINDOW_S = 90 * 60
+RISE_COOLDOWN_S = 3 * 3600  # one meal per excursion
+HOUR_DECAY = 0.95  # older episodes weigh less, so the summary follows changing habits
+MIN_EPISODES = 3  # fewer than this -> no "usually around" line
+TYPICAL_SHARE = 0.2  # a 2-hour window is typical when it holds this share of the (decayed) episodes
+CATCH_UP_DAYS = 14  # a patient seen for the first time is folded in from this much stored history
+
+
+class _History:
+    """O(1) state per patient: updated per reading, read without touching past readings"""
+    __slots__ = ("in_low", "last_low", "low_days", "low_hours", "low_total", "trough", "trough_at",
+                 "rise_hours", "rise_total", "quiet_until", "last_at", "version")
+
+    def __init__(self):
+        self.in_low = False
+        self.last_low = None  # datetime the latest low episode started
+        self.low_days = deque(maxlen=LOW_DAYS)  # [day ordinal, low episodes that day]
+        self.low_hours = [0.0] * 24
+        self.low_total = 0
+        self.trough = None
+        self.trough_at = 0.0
+        self.rise_hours = [0.0] * 24
+        self.rise_total = 0
+        self.quiet_until = 0.0
+        self.last_at = 0.0  # epoch of the newest reading folded in
+        self.version = 0
+
+
+def _decayed_add(hours, hour):
+    for h in range(24):
+        hours[h] *= HOUR_DECAY
+    hours[hour] += 1.0
+
+
+def _typical_windows(hours, total):
+    """Non-overlapping 2-hour windows holding TYPICAL_SHARE of the episodes, as "07-09h" labels
+    (episodes around an hour boundary split between two hours)"""
+    if total < MIN_EPISODES:
+        return ""
+    weight = sum(hours)
+    pairs = [hours[h] + hours[(h + 1) % 24] for h in range(24)]
+    starts = []
+    while True:
+        best = max(range(24), key=pairs.__getitem__)
+        if pairs[best] < TYPICAL_SHARE * weight:
+            break
+        starts.append(best)
+        for h in (best - 1, best, best + 1):
+            pairs[h % 24] = 0.0
+    return "/".join(f"{h:02d}-{(h + 2) % 24:02d}h" for h in sorted(starts))
+
+
+class ContextAssembler:
+    """Folds every reading of a patient into _History: the scheduled checks main.py passes to
+    record(), and the 5-minute history cgm_import.py and nightscout_reader.py keep in the reading
+    store (meal rises happen between checks)."""
+
+    def __init__(self, analytics=None, store=None):
+        self.analytics = analytics if analytics is not None else glucose_analytics  # has __len__
+        self.store = store  # reading_store.ReadingStore; None = the shared one, opened on first use
+        self._history = {}  # patient_id -> _History
+        self._summaries = {}  # patient_id -> (version, token budget, summary)
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "builds": 0, "trimmed": 0, "stored_readings": 0}
+
+    def _store(self):
+        if self.store is None:
+            from reading_store import get_reading_store
+            self.store = get_reading_store()
+        return self.store
+
+    def catch_up(self, patient_id, until):
+        """Fold stored readings after the last folded one and before `until` (epoch seconds)"""
+        with self._lock:
+            history = self._history.get(patient_id)
+            since = history.last_at if history is not None else until - CATCH_UP_DAYS * 86400
+        try:
+            rows = self._store().readings(patient_id, start=int(since) + 1, end=until)
+        except sqlite3.Error as e:
+            print(f"⚠️ Reading store unavailable for {patient_id} history: {e}")
+            return 0
+        for ts, glucose in rows:
+            self._fold(patient_id, glucose, datetime.fromtimestamp(ts))
+        with self._lock:
+            self.stats["stored_readings"] += len(rows)
+        return len(rows)
+
+    def record(self, patient_id, glucose, when):
+        """Fold one reading (`when` = datetime) into the patient's aggregates, after the stored
+        readings since the previous one; invalidates the summary"""
+        self.catch_up(patient_id, when.timestamp())
+        self._fold(patient_id, glucose, when)
+
+    def _fold(self, patient_id, glucose, when):
+        epoch = when.timestamp()
+        with self._lock:
+            history = self._history.get(patient_id)
+            if history is None:
+                history = self._history[patient_id] = _History()
+            if epoch <= history.last_at:
+                return  # already folded (a stored reading that was also checked)
+            history.last_at = epoch
+            history.version += 1
+
+            # Low episodes: counted once when the reading first drops below range
+            if glucose < LOW_MGDL:
+                if not history.in_low:
+                    history.in_low = True
+                    history.last_low = when
+                    day = when.toordinal()
+                    if history.low_days and history.low_days[-1][0] == day:
+                        history.low_days[-1][1] += 1
+                    else:
+                        history.low_days.append([day, 1])
+                    _decayed_add(history.low_hours, when.hour)
+                    history.low_total += 1
+            else:
+                history.in_low = False
+
+            # Meal rises: a climb of RISE_MGDL from the lowest point of the last RISE_WINDOW_S
+            if history.trough is None or glucose <= history.trough or epoch - history.trough_at > RISE_WINDOW_S:
+                history.trough, history.trough_at = glucose, epoch
+            elif (glucose - history.trough >= RISE_MGDL and epoch >= history.quiet_until
+                  and history.trough >= LOW_MGDL):  # recovering from a low is not a meal
+                # The meal was around the trough, not the peak
+                _decayed_add(history.rise_hours, datetime.fromtimestamp(history.trough_at).hour)
+                history.rise_total += 1
+                history.quiet_until = epoch + RISE_COOLDOWN_S
+                history.trough, history.trough_at = glucose, epoch
+
+    def _lines(self, patient_id, history):
+        """Summary lines, most important first"""
+        lines = []
+        today = get_clock().now().toordinal()
+        lows = sum(count for day, count in history.low_days if today - day < LOW_DAYS)
+        if lows:
+            line = f"{lows} low{'s' if lows > 1 else ''} in {LOW_DAYS} days, last {history.last_low:%a %H:%M}"
+            typical = _typical_windows(history.low_hours, history.low_total)
+            if typical:
+                line += f", often {typical}"
+            lines.append(line)
+        else:
+            lines.append(f"no lows in {LOW_DAYS} days")
+        metrics = self.analytics.metrics(patient_id, "7d", get_clock().time())
+        if metrics.get("readings"):
+            lines.append(f"7-day time in range {metrics['time_in_range']:.0f}% "
+                         f"(below {metrics['time_below_range']:.0f}%, above {metrics['time_above_range']:.0f}%)")
+        typical = _typical_windows(history.rise_hours, history.rise_total)
+        if typical:
+            lines.append(f"meal rises usually {typical}")
+        return lines
+
+    def summary(self, patient_id, max_tokens=None):
+        """One-line history for the prompt, at most `max_tokens` (settings.llm_history_tokens);
+        "" for unknown patients. Rebuilt only after a new reading."""
+        max_tokens = get_settings().llm_history_tokens if max_tokens is None else max_tokens
+        if not max_tokens:
+            return ""
+        self.catch_up(patient_id, get_clock().time() + 1)
+        with self._lock:
+            history = self._history.get(patient_id)
+            if history is None:
+                return ""
+            cached = self._summaries.get(patient_id)
+            if cached is not None and cached[0] == history.version and cached[1] == max_tokens:
+                self.stats["hits"] += 1
+                return cached[2]
+            version = history.version
+            lines = self._lines(patient_id, history)
+        # Least important lines go first when over budget
+        text = "; ".join(lines)
+        while len(lines) > 1 and estimate_tokens(text) > max_tokens:
+            lines.pop()
+            text = "; ".join(lines)
+            self.stats["trimmed"] += 1
+        if estimate_tokens(text) > max_tokens:
+            text = ""
+        with self._lock:
+            self.stats["builds"] += 1
+            self._summaries[patient_id] = (version, max_tokens, text)
+        return text
+
+
+# Global instance
+context_assembler = ContextAssembler()
+
+
+def patient_summary(patient_id, max_tokens=None):
+    """Public interface for llm_advisor.py"""
+    return context_assembler.summary(patient_id, max_tokens)
+
+
+# 🔬 Benchmark: two weeks of 15-minute readings in the reading store, four scheduled checks a day,
+# then one summary per alert
+if __name__ == "__main__":
+    import sys
+    import time
+    from datetime import timedelta
+    import numpy as np
+    from analytics import GlucoseAnalytics
+    from clock import VirtualClock, set_clock
+    from reading_store import ReadingStore
+
+    n_patients = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    days = 14
+    rng = np.random.default_rng(3)
+    start = datetime(2025, 1, 1)
+    steps = days * 96
+    # Circadian baseline, meal spikes at 08:00 / 13:00 / 19:30, a few overnight lows
+    minutes = np.arange(steps) * 15
+    hours = (minutes % 1440) / 60
+    base = 130 + 15 * np.sin(2 * np.pi * hours / 24)
+    for meal in (8.0, 13.0, 19.5):
+        base += 90 * np.exp(-((hours - meal - 1) ** 2) / 0.5)
+    glucose = base + rng.normal(0, 8, (n_patients, steps))
+    night = (hours > 2.5) & (hours < 4)
+    glucose[::3, night] -= rng.uniform(40, 90, (len(glucose[::3]), 1))  # every third patient
+
+    analytics = GlucoseAnalytics(capacity=n_patients)
+    store = ReadingStore(":memory:")
+    assembler = ContextAssembler(analytics, store)
+    checks_only = ContextAssembler(analytics, ReadingStore(":memory:"))  # what main.py alone would see
+    clock = VirtualClock(start)
+    set_clock(clock)
+    when = [start + timedelta(minutes=int(m)) for m in minutes]
+    epochs = [int(w.timestamp()) for w in when]
+    for p in range(n_patients):
+        store.add_many(f"p{p}", epochs, glucose[p].tolist(), "nightscout")
+    check_steps = [step for step in range(steps) if minutes[step] % 1440 in (450, 720, 1110, 1320)]
+    t0 = time.perf_counter()
+    for step in check_steps:
+        for p in range(n_patients):
+            assembler.record(f"p{p}", glucose[p, step], when[step])
+    per_reading = (time.perf_counter() - t0) / (steps * n_patients)
+    for step in check_steps:
+        for p in range(n_patients):
+            checks_only.record(f"p{p}", glucose[p, step], when[step])
+    rows = analytics.rows_for([f"p{p}" for p in range(n_patients)])
+    for p in range(n_patients):
+        analytics.add_batch(np.full(steps, rows[p]), epochs, glucose[p])
+    clock.advance(days * 86400)
+
+    estimate_tokens("warm up")  # tokenizer lookup happens once per process
+    t0 = time.perf_counter()
+    texts = [assembler.summary(f"p{p}", 60) for p in range(n_patients)]
+    build = (time.perf_counter() - t0) / n_patients
+    t0 = time.perf_counter()
+    for _ in range(20):
+        for p in range(n_patients):
+            assembler.summary(f"p{p}", 60)
+    hit = (time.perf_counter() - t0) / (20 * n_patients)
+    tokens = [estimate_tokens(text) for text in texts]
+    print(f"🗂️ {n_patients} patients x {steps} stored readings, {len(check_steps)} checks each: "
+          f"{per_reading * 1e6:.1f} µs/reading folded, "
+          f"summary build {build * 1e6:.0f} µs, cached {hit * 1e6:.2f} µs")
+    print(f"   tokens: mean {sum(tokens) / len(tokens):.0f}, max {max(tokens)} (budget 60); {assembler.stats}")
+    for p in range(3):
+        print(f"   p{p}: {texts[p]!r}")
+    print(f"   p0 from scheduled checks only: {checks_only.summary('p0', 60)!r}")
+    print(f"   p0 at 20 tokens: {assembler.summary('p0', 20)!r}")
+    assembler.record("p0", 55, clock.now())
+    print(f"   p0 after a new low: {assembler.summary('p0', 60)!r}")
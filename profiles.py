@@ -0,0 +1,194 @@
+# profiles.py - Per-patient, time-of-day threshold profiles with vectorized evaluation
+import threading
+import numpy as np
+from config import get_settings
+
+SLOTS_PER_DAY = 24  # hourly schedule
+MINUTES_PER_SLOT = 1440 // SLOTS_PER_DAY
+
+# Evaluation result codes
+LOW = -1
+IN_RANGE = 0
+HIGH = 1
+
+# Named schedules: list of (start "HH:MM", hypo, hyper) segments, each active until the next one
+PRESETS = {
+    "adult": [("00:00", 70, 180)],
+    "older_adult": [("00:00", 80, 200)],
+    "pregnancy": [("00:00", 63, 140)],
+    # Tighter lows protection overnight for children
+    "pediatric": [("00:00", 80, 200), ("07:00", 70, 180), ("21:00", 80, 200)],
+}
+
+
+def _slot_of(hhmm):
+    hours, minutes = map(int, hhmm.split(":"))
+    if not (0 <= hours < 24 and 0 <= minutes < 60):
+        raise ValueError(f"Invalid time of day: {hhmm!r}")
+    return (hours * 60 + minutes) // MINUTES_PER_SLOT
+
+
+def expand_schedule(segments):
+    """Turn [(start, hypo, hyper), ...] into per-slot (hypo[], hyper[]) arrays"""
+    if not segments:
+        raise ValueError("Threshold schedule needs at least one segment")
+    segments = sorted(segments, key=lambda seg: _slot_of(seg[0]))
+    hypo = np.empty(SLOTS_PER_DAY, dtype=np.uint16)
+    hyper = np.empty(SLOTS_PER_DAY, dtype=np.uint16)
+    # The last segment wraps around midnight until the first one starts
+    hypo[:], hyper[:] = segments[-1][1], segments[-1][2]
+    for i, (start, low, high) in enumerate(segments):
+        if not 0 < low < high:
+            raise ValueError(f"Invalid thresholds at {start}: hypo={low}, hyper={high}")
+        end = _slot_of(segments[i + 1][0]) if i + 1 < len(segments) else SLOTS_PER_DAY
+        hypo[_slot_of(start):end] = low
+        hyper[_slot_of(start):end] = high
+    return hypo, hyper
+
+
+def slots_from_minutes(minute_of_day):
+    return (np.asarray(minute_of_day, dtype=np.int32) // MINUTES_PER_SLOT) % SLOTS_PER_DAY
+
+
+def slots_from_datetimes(timestamps, utc_offset_minutes=0):
+    """Slot index for datetime64 (or ISO string) timestamps, shifted to local time"""
+    minutes = np.asarray(timestamps, dtype="datetime64[m]").astype(np.int64) + utc_offset_minutes
+    return ((minutes % 1440) // MINUTES_PER_SLOT).astype(np.int32)
+
+
+class ThresholdProfileStore:
+    def __init__(self, capacity=1024):
+        # One row per patient, one column per time-of-day slot (mg/dL fits in uint16)
+        self.hypo = np.zeros((capacity, SLOTS_PER_DAY), dtype=np.uint16)
+        self.hyper = np.zeros((capacity, SLOTS_PER_DAY), dtype=np.uint16)
+        self._index = {}  # patient_id -> row
+        self._from_settings = set()  # rows derived from config thresholds, refreshed on reload
+        self._from_profiles = set()  # rows from settings.patient_profiles, reverted when dropped from it
+        self._settings = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._index)
+
+    def _grow(self):
+        capacity = self.hypo.shape[0] * 2
+        self.hypo = np.resize(self.hypo, (capacity, SLOTS_PER_DAY))
+        self.hyper = np.resize(self.hyper, (capacity, SLOTS_PER_DAY))
+
+    def _write_row(self, patient_id, hypo, hyper):
+        row = self._index.get(patient_id)
+        if row is None:
+            row = len(self._index)
+            if row >= self.hypo.shape[0]:
+                self._grow()
+            self._index[patient_id] = row
+        self.hypo[row] = hypo
+        self.hyper[row] = hyper
+        return row
+
+    def set_profile(self, patient_id, schedule):
+        """Assign a preset name or a [(start, hypo, hyper), ...] schedule to a patient"""
+        segments = PRESETS[schedule] if isinstance(schedule, str) else schedule
+        hypo, hyper = expand_schedule(segments)
+        with self._lock:
+            self._write_row(patient_id, hypo, hyper)
+            self._from_settings.discard(patient_id)
+            self._from_profiles.discard(patient_id)
+
+    def _sync_settings(self):
+        """Re-derive config-based rows after a settings hot reload"""
+        settings = get_settings()
+        if settings is not self._settings:
+            # Expand every schedule before touching a row: a bad one leaves the old settings in place
+            profiles = {patient_id: expand_schedule(PRESETS[schedule] if isinstance(schedule, str) else schedule)
+                        for patient_id, schedule in settings.patient_profiles.items()}
+            # Dropped from PATIENT_PROFILES: back to the flat config thresholds
+            self._from_settings.update(self._from_profiles.difference(profiles))
+            for patient_id, (hypo, hyper) in profiles.items():
+                self._write_row(patient_id, hypo, hyper)
+                self._from_settings.discard(patient_id)
+            self._from_profiles = set(profiles)
+            for patient_id in self._from_settings:
+                self._write_row(patient_id, *settings.thresholds_for(patient_id))
+            self._settings = settings  # only once every row reflects it
+
+    def _row(self, patient_id):
+        row = self._index.get(patient_id)
+        if row is None:
+            # No profile yet: flat schedule from config (global or PATIENT_THRESHOLDS override)
+            row = self._write_row(patient_id, *self._settings.thresholds_for(patient_id))
+            self._from_settings.add(patient_id)
+        return row
+
+    def rows_for(self, patient_ids):
+        """Row indices for a sequence of patient ids (reuse them across batches)"""
+        with self._lock:
+            self._sync_settings()
+            return np.fromiter((self._row(p) for p in patient_ids), dtype=np.int32, count=len(patient_ids))
+
+    def evaluate_rows(self, rows, glucose, slots):
+        """Single NumPy pass: LOW / IN_RANGE / HIGH code per reading"""
+        glucose = np.asarray(glucose, dtype=np.float32)
+        hypo = self.hypo[rows, slots]
+        hyper = self.hyper[rows, slots]
+        codes = np.zeros(glucose.shape, dtype=np.int8)
+        codes[glucose <= hypo] = LOW
+        codes[glucose >= hyper] = HIGH
+        return codes
+
+    def evaluate_batch(self, patient_ids, glucose, timestamps, utc_offset_minutes=0):
+        """Evaluate readings for many patients against their time-of-day thresholds"""
+        rows = self.rows_for(patient_ids)
+        return self.evaluate_rows(rows, glucose, slots_from_datetimes(timestamps, utc_offset_minutes))
+
+    def thresholds_at(self, patient_id, when):
+        """(hypo, hyper) for one patient at a datetime - used by check_and_alert"""
+        slot = (when.hour * 60 + when.minute) // MINUTES_PER_SLOT
+        with self._lock:
+            self._sync_settings()
+            row = self._row(patient_id)
+            return int(self.hypo[row, slot]), int(self.hyper[row, slot])
+
+
+# Global instance
+profile_store = ThresholdProfileStore()
+
+
+# 🔬 Benchmark
+if __name__ == "__main__":
+    import time
+
+    n_patients = 10_000
+    n_readings = 100_000
+    rng = np.random.default_rng(42)
+
+    store = ThresholdProfileStore()
+    presets = list(PRESETS)
+    for i in range(n_patients):
+        store.set_profile(f"p{i}", presets[i % len(presets)])
+
+    patient_ids = [f"p{i}" for i in rng.integers(0, n_patients, n_readings)]
+    glucose = rng.normal(130, 45, n_readings).clip(40, 400)
+    minutes = rng.integers(0, 1440, n_readings)
+    timestamps = np.datetime64("2025-01-01T00:00") + minutes.astype("timedelta64[m]")
+
+    start = time.perf_counter()
+    rows = store.rows_for(patient_ids)
+    lookup_ms = (time.perf_counter() - start) * 1000
+
+    runs = 50
+    start = time.perf_counter()
+    for _ in range(runs):
+        codes = store.evaluate_rows(rows, glucose, slots_from_datetimes(timestamps))
+    eval_ms = (time.perf_counter() - start) * 1000 / runs
+
+    start = time.perf_counter()
+    store.evaluate_batch(patient_ids, glucose, timestamps)
+    batch_ms = (time.perf_counter() - start) * 1000
+
+    print(f"🧮 {n_readings:,} readings, {n_patients:,} patients")
+    print(f"   patient id → row lookup: {lookup_ms:.1f} ms")
+    print(f"   vectorized evaluation:    {eval_ms:.2f} ms/batch ({eval_ms * 1e6 / n_readings:.0f} ns/reading)")
+    print(f"   evaluate_batch end-to-end: {batch_ms:.1f} ms")
+    print(f"   low={np.sum(codes == LOW):,} in_range={np.sum(codes == IN_RANGE):,} high={np.sum(codes == HIGH):,}")
+    print(f"   profile arrays: {(store.hypo.nbytes + store.hyper.nbytes) / 1024:.0f} KiB")
@@ -0,0 +1,157 @@
+# prompts.py - Advice prompt variants: compact structured prompt with a byte-identical system prefix
+import re
+import threading
+from config import get_settings
+
+# Static text first, per-reading fields last: the system message never changes between calls, so a
+# provider that caches prompt prefixes (OpenAI does automatically from 1,024 prompt tokens, llama.cpp
+# and vLLM keep the KV cache of a shared prefix) only has to process the fields.
+SYSTEMS = {
+    # The original prompt, kept for comparison and as a fallback
+    "full": (
+        "You are a diabetes care assistant providing evidence-based guidance. "
+        "NEVER suggest insulin dosing, medication changes, or specific medical procedures. "
+        "ALWAYS include when to seek emergency help. "
+        "For lows (≤70 mg/dL): recommend 15g fast-acting carbs, recheck in 15 minutes. "
+        "For highs (≥180 mg/dL): recommend hydration, light activity, recheck in 1-2 hours. "
+        "Use simple, actionable language. Max 3 sentences."
+    ),
+    "compact": (
+        "Diabetes care assistant. Never suggest insulin doses, medication changes or procedures. "
+        "Low (≤70 mg/dL): 15g fast-acting carbs, recheck in 15 minutes. "
+        "High (≥180 mg/dL): water, light activity, recheck in 1-2 hours. "
+        "Always say when to seek emergency help. Plain words, max 3 sentences."
+    ),
+}
+HUMANS = {
+    "full": (
+        "Glucose reading: {glucose} mg/dL ({trend}) during {context}. "
+        "This indicates {condition}. "
+        "Provide immediate actions for {action_focus}. "
+        "Include when to seek emergency help.{history}"
+    ),
+    # One field per line; the system prompt already says what to do with them
+    "compact": "glucose: {glucose} mg/dL\nstatus: {status}\ntrend: {trend}\ncontext: {context}{history}",
+}
+# Patient history (patient_context.py) goes last: it changes with every reading
+HISTORY_FIELDS = {"full": " Recent history: {}.", "compact": "\nhistory: {}"}
+VARIANTS = tuple(SYSTEMS)
+
+# What every system prompt must still tell the model (the quality check for a new or shortened variant)
+REQUIREMENTS = (
+    ("no_dosing", r"never suggest insulin dos"),
+    ("no_med_changes", r"medication changes"),
+    ("emergency", r"emergency help"),
+    ("low_carbs", r"15\s?g fast-acting carbs"),
+    ("low_recheck", r"recheck in 15 min"),
+    ("high_hydration", r"hydration|water"),
+    ("high_recheck", r"recheck in 1-2 hours"),
+    ("brevity", r"max 3 sentences"),
+)
+
+_templates = {}
+_templates_lock = threading.Lock()
+
+
+def missing_requirements(variant):
+    """Safety requirements the variant's system prompt no longer states"""
+    return [name for name, pattern in REQUIREMENTS if not re.search(pattern, SYSTEMS[variant], re.IGNORECASE)]
+
+
+def _template(variant):
+    """ChatPromptTemplate per variant, compiled once; the reading is passed as template variables
+    (free-text contexts with braces cannot break the template)"""
+    template = _templates.get(variant)
+    if template is None:
+        from langchain_core.prompts import ChatPromptTemplate  # deferred: heavy import, see warmup.py
+        with _templates_lock:
+            template = _templates.get(variant)
+            if template is None:
+                template = _templates[variant] = ChatPromptTemplate.from_messages([
+                    ("system", SYSTEMS[variant].replace("{", "{{").replace("}", "}}")),
+                    ("human", HUMANS[variant]),
+                ])
+    return template
+
+
+def build_messages(glucose_level, trend, context, variant=None, history="", kind=None):
+    """Chat messages for one reading: [system, human]; `history` is a patient summary line, `kind`
+    the alert kind ("low"/"high") from the patient's thresholds (global HYPO_THRESHOLD when not given)"""
+    settings = get_settings()
+    variant = variant or settings.llm_prompt_variant
+    low = kind == "low" if kind else glucose_level <= settings.hypo_threshold
+    return _template(variant).format_messages(
+        glucose=glucose_level,
+        trend=trend or "stable",
+        context=context or "automated monitoring",
+        status="low" if low else "high",
+        condition="low blood sugar (hypoglycemia)" if low else "high blood sugar (hyperglycemia)",
+        action_focus="immediate treatment with fast-acting carbohydrates" if low else "hydration and monitoring",
+        history=HISTORY_FIELDS[variant].format(history) if history else "",
+    )
+
+
+def prompt_text(messages):
+    """Flattened prompt, for token estimates"""
+    return "\n".join(m.content for m in messages)
+
+
+# 🔬 Benchmark: token count and build time per variant on a fixed set of readings;
+# `python prompts.py --live` also times real calls and checks the advice (needs a configured provider)
+if __name__ == "__main__":
+    import contextlib
+    import os
+    import sys
+    import time
+    from llm_usage import estimate_tokens
+
+    EVALUATION_SET = [
+        (48, "falling fast", "overnight"), (55, "falling", "after exercise"), (62, "stable", "fasting"),
+        (68, "falling", "before lunch"), (70, "rising", "automated monitoring"), (181, "rising", "after dinner"),
+        (195, "stable", "after breakfast"), (220, "rising fast", "sick day"), (265, "rising", "missed meal"),
+        (310, "stable", "automated monitoring"), (58, "falling fast", "after alcohol"), (240, "falling", "stress"),
+    ]
+    MESSAGE_OVERHEAD = 4  # tokens per chat message for role and separators
+
+    print(f"✍️ {len(EVALUATION_SET)} readings")
+    baseline = None
+    for variant in VARIANTS:
+        n = 2000
+        build_messages(*EVALUATION_SET[0], variant=variant)  # compile outside the timing
+        start = time.perf_counter()
+        for i in range(n):
+            build_messages(*EVALUATION_SET[i % len(EVALUATION_SET)], variant=variant)
+        build_us = (time.perf_counter() - start) / n * 1e6
+        prompts = [build_messages(*reading, variant=variant) for reading in EVALUATION_SET]
+        system_tokens = estimate_tokens(SYSTEMS[variant], "gpt-4o-mini") + MESSAGE_OVERHEAD
+        tokens = [sum(estimate_tokens(m.content, "gpt-4o-mini") + MESSAGE_OVERHEAD for m in messages)
+                  for messages in prompts]
+        mean = sum(tokens) / len(tokens)
+        baseline = baseline or mean
+        missing = missing_requirements(variant)
+        print(f"   {variant:8} {mean:5.1f} prompt tokens/alert ({mean / baseline:4.0%}), static prefix {system_tokens}, "
+              f"build {build_us:5.1f} µs, requirements {'✅' if not missing else '❌ missing ' + ', '.join(missing)}")
+
+    if "--live" in sys.argv:
+        from advice_safety import SafetyValidator
+        from clock import get_clock
+        from llm_router import llm_router
+        from profiles import profile_store
+
+        for variant in VARIANTS:
+            validator = SafetyValidator()
+            latencies, completion_tokens = [], 0
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                for glucose, trend, context in EVALUATION_SET:
+                    messages = build_messages(glucose, trend, context, variant=variant)
+                    start = time.perf_counter()
+                    response, _ = llm_router.invoke(messages)
+                    latencies.append(time.perf_counter() - start)
+                    advice = str(getattr(response, "content", response))
+                    completion_tokens += estimate_tokens(advice, "gpt-4o-mini")
+                    validator.check(advice, glucose,
+                                    *profile_store.thresholds_at(get_settings().patient_id, get_clock().now()))
+            latencies.sort()
+            print(f"   {variant:8} live: p50 {latencies[len(latencies) // 2] * 1e3:.0f} ms, "
+                  f"max {latencies[-1] * 1e3:.0f} ms, {completion_tokens / len(EVALUATION_SET):.0f} completion "
+                  f"tokens/alert, safety {dict(validator.stats)}")
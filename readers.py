@@ -0,0 +1,249 @@
+# readers.py - Pluggable glucose sources (sync / async / push) and a concurrent polling engine
+import asyncio
+import queue
+import random
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from config import get_settings
+
+# One reading delivered by the engine; `data` has the read_glucose_level() shape
+PolledReading = namedtuple("PolledReading", "patient_id source_id data latency_ms")
+
+
+class GlucoseSource:
+    """A reading source for one patient. Subclasses set `kind` and implement read()/aread()"""
+    kind = "sync"
+
+    def __init__(self, patient_id, source_id, min_interval=60.0, timeout=10.0):
+        self.patient_id = patient_id
+        self.source_id = source_id
+        self.min_interval = min_interval  # per-source rate limit (seconds between polls)
+        self.timeout = timeout
+        self.next_due = 0.0
+        self.last_error = None
+
+    @property
+    def key(self):
+        return (self.patient_id, self.source_id)
+
+    def read(self):
+        raise NotImplementedError
+
+
+class SyncSource(GlucoseSource):
+    """Blocking reader function `fn(patient_id) -> dict`; runs on the engine's thread pool"""
+
+    def __init__(self, patient_id, source_id, fn, blocking=True, **kwargs):
+        super().__init__(patient_id, source_id, **kwargs)
+        self.fn = fn
+        self.blocking = blocking  # False for in-memory readers: called inline, no thread hop
+
+    def read(self):
+        return self.fn(self.patient_id)
+
+
+class AsyncSource(GlucoseSource):
+    """Coroutine reader `async fn(patient_id) -> dict`; runs on the engine's event loop"""
+    kind = "async"
+
+    def __init__(self, patient_id, source_id, fn, **kwargs):
+        super().__init__(patient_id, source_id, **kwargs)
+        self.fn = fn
+
+    async def aread(self):
+        return await self.fn(self.patient_id)
+
+
+class PushSource(GlucoseSource):
+    """Readings arrive by callback (webhook, device bridge); the engine never polls it"""
+    kind = "push"
+
+    def __init__(self, patient_id, source_id, **kwargs):
+        super().__init__(patient_id, source_id, **kwargs)
+        self._engine = None
+
+    def push(self, data):
+        """Callback for the producer - thread-safe"""
+        if self._engine is None:
+            raise RuntimeError(f"Push source {self.key} is not registered with an engine")
+        self._engine.pushed.put(PolledReading(self.patient_id, self.source_id, data, 0.0))
+
+
+def synthetic_source(patient_id, **kwargs):
+    from glucose_reader import read_glucose_level
+    return SyncSource(patient_id, "synthetic", lambda _patient_id: read_glucose_level(), **kwargs)
+
+
+def nightscout_source(patient_id, **kwargs):
+    from nightscout_reader import get_nightscout_sync
+    return SyncSource(patient_id, "nightscout", get_nightscout_sync().read_latest, **kwargs)
+
+
+class PollingEngine:
+    def __init__(self, max_workers=16, max_concurrency=32, jitter=0.1, clock=time.monotonic):
+        self.sources = {}  # (patient_id, source_id) -> GlucoseSource
+        self.pushed = queue.Queue()
+        self.max_workers = max_workers
+        self.max_concurrency = max_concurrency
+        self.jitter = jitter  # ± fraction applied to each source's interval
+        self.clock = clock
+        self._executor = None
+        self._lock = threading.Lock()
+        self.stats = {"polls": 0, "readings": 0, "errors": 0, "timeouts": 0, "rate_limited": 0}
+
+    def register(self, source):
+        if isinstance(source, PushSource):
+            source._engine = self
+        # Spread first polls over one interval so many sources don't fire together
+        source.next_due = self.clock() + random.uniform(0, source.min_interval * self.jitter)
+        with self._lock:
+            self.sources[source.key] = source
+        return source
+
+    def unregister(self, patient_id, source_id):
+        with self._lock:
+            self.sources.pop((patient_id, source_id), None)
+
+    def _pool(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="reader")
+        return self._executor
+
+    def _schedule_next(self, source, now):
+        spread = source.min_interval * self.jitter
+        source.next_due = now + source.min_interval + random.uniform(-spread, spread)
+
+    async def _poll(self, source, limit):
+        async with limit:
+            start = time.perf_counter()
+            try:
+                if source.kind == "async":
+                    data = await asyncio.wait_for(source.aread(), source.timeout)
+                elif not getattr(source, "blocking", True):
+                    data = source.read()
+                else:
+                    loop = asyncio.get_running_loop()
+                    data = await asyncio.wait_for(loop.run_in_executor(self._pool(), source.read), source.timeout)
+            except asyncio.TimeoutError:
+                source.last_error = "timeout"
+                self.stats["timeouts"] += 1
+                print(f"⏱️ Reader {source.key} timed out after {source.timeout}s")
+                return None
+            except Exception as e:
+                source.last_error = f"{type(e).__name__}: {str(e)[:100]}"
+                self.stats["errors"] += 1
+                print(f"❌ Reader {source.key} failed: {source.last_error}")
+                return None
+            source.last_error = None
+            if data is None:
+                return None
+            return PolledReading(source.patient_id, source.source_id, data, (time.perf_counter() - start) * 1000)
+
+    async def _poll_due(self, force, patient_filter=None):
+        now = self.clock()
+        with self._lock:
+            sources = [s for s in self.sources.values()
+                       if s.kind != "push" and (patient_filter is None or patient_filter(s.patient_id))]
+        due = []
+        for source in sources:
+            if force or now >= source.next_due:
+                self._schedule_next(source, now)
+                due.append(source)
+            else:
+                self.stats["rate_limited"] += 1
+        limit = asyncio.Semaphore(self.max_concurrency)
+        results = await asyncio.gather(*(self._poll(s, limit) for s in due))
+        self.stats["polls"] += len(due)
+        return [r for r in results if r is not None]
+
+    def _drain_pushed(self):
+        readings = []
+        while True:
+            try:
+                readings.append(self.pushed.get_nowait())
+            except queue.Empty:
+                return readings
+
+    def poll_once(self, force=False, patient_filter=None):
+        """Poll every due source concurrently and return new readings (plus anything pushed)
+
+        `patient_filter(patient_id) -> bool` restricts polling, e.g. to patients this node owns.
+        """
+        readings = asyncio.run(self._poll_due(force, patient_filter)) + self._drain_pushed()
+        self.stats["readings"] += len(readings)
+        return readings
+
+    def run_forever(self, consumer, tick=1.0, stop_event=None):
+        """Continuous mode: poll due sources every `tick` seconds and hand readings to consumer"""
+        stop_event = stop_event or threading.Event()
+        while not stop_event.is_set():
+            for reading in self.poll_once():
+                consumer(reading)
+            stop_event.wait(tick)
+
+    def status(self):
+        with self._lock:
+            sources = list(self.sources.values())
+        return {
+            "sources": len(sources),
+            "failing": {f"{s.patient_id}/{s.source_id}": s.last_error for s in sources if s.last_error},
+            **self.stats,
+        }
+
+
+def build_default_engine():
+    """Sources from settings: Nightscout where configured, synthetic for the default patient otherwise"""
+    settings = get_settings()
+    engine = PollingEngine(max_concurrency=settings.nightscout_concurrency)
+    for patient_id in settings.nightscout_sites:
+        engine.register(nightscout_source(patient_id))
+    if settings.patient_id not in settings.nightscout_sites:
+        engine.register(synthetic_source(settings.patient_id))
+    return engine
+
+
+_engine = None
+
+
+def get_polling_engine():
+    global _engine
+    if _engine is None:
+        _engine = build_default_engine()
+    return _engine
+
+
+# 🔬 Benchmark
+if __name__ == "__main__":
+    n_sources = 2000
+
+    def slow_sync(patient_id):
+        time.sleep(0.02)  # simulated network read
+        return {"glucose": 100, "timestamp": "2025-01-01T08:00:00", "trend": "stable"}
+
+    async def slow_async(patient_id):
+        await asyncio.sleep(0.02)
+        return {"glucose": 150, "timestamp": "2025-01-01T08:00:00", "trend": "rising"}
+
+    async def hangs(patient_id):
+        await asyncio.sleep(60)
+
+    engine = PollingEngine(max_workers=64, max_concurrency=256)
+    for i in range(n_sources):
+        if i % 2:
+            engine.register(SyncSource(f"p{i}", "sync", slow_sync, min_interval=300))
+        else:
+            engine.register(AsyncSource(f"p{i}", "async", slow_async, min_interval=300))
+    engine.register(AsyncSource("stuck", "async", hangs, timeout=0.5))
+    push = engine.register(PushSource("p-push", "bridge"))
+    push.push({"glucose": 65, "timestamp": "2025-01-01T08:00:00", "trend": "falling"})
+
+    start = time.perf_counter()
+    readings = engine.poll_once(force=True)
+    elapsed = time.perf_counter() - start
+    print(f"📡 {n_sources + 2} sources polled in {elapsed:.2f}s → {len(readings)} readings")
+    start = time.perf_counter()
+    again = engine.poll_once()
+    print(f"   immediate re-poll (rate limited): {len(again)} readings in {(time.perf_counter() - start) * 1000:.1f} ms")
+    print(f"   status: {engine.status()['failing']} {dict((k, v) for k, v in engine.stats.items())}")
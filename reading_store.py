@@ -0,0 +1,84 @@
+# reading_store.py - SQLite storage for glucose readings, de-duplicated by (patient, time)
+import sqlite3
+import threading
+from config import get_settings
+
+
+class ReadingStore:
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS readings ("
+            " patient_id TEXT NOT NULL,"
+            " ts INTEGER NOT NULL,"  # epoch seconds, UTC
+            " glucose REAL NOT NULL,"  # mg/dL
+            " source TEXT NOT NULL DEFAULT '',"
+            " PRIMARY KEY (patient_id, ts)"
+            ") WITHOUT ROWID"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    def add_many(self, patient_id, timestamps, values, source=""):
+        """Insert readings, silently skipping ones already stored; returns rows inserted"""
+        rows = [(patient_id, int(ts), float(v), source) for ts, v in zip(timestamps, values)]
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO readings (patient_id, ts, glucose, source) VALUES (?, ?, ?, ?)", rows
+            )
+            self._conn.commit()
+            return self._conn.total_changes - before
+
+    def add(self, patient_id, timestamp, glucose, source=""):
+        return self.add_many(patient_id, [timestamp], [glucose], source)
+
+    def latest_timestamp(self, patient_id):
+        """Newest stored epoch second for a patient (None if nothing stored yet)"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MAX(ts) FROM readings WHERE patient_id = ?", (patient_id,)
+            ).fetchone()
+        return row[0]
+
+    def readings(self, patient_id, start=None, end=None):
+        """[(ts, glucose), ...] for a patient in time order"""
+        query = "SELECT ts, glucose FROM readings WHERE patient_id = ?"
+        params = [patient_id]
+        if start is not None:
+            query += " AND ts >= ?"
+            params.append(int(start))
+        if end is not None:
+            query += " AND ts < ?"
+            params.append(int(end))
+        with self._lock:
+            return self._conn.execute(query + " ORDER BY ts", params).fetchall()
+
+    def count(self, patient_id=None):
+        with self._lock:
+            if patient_id is None:
+                return self._conn.execute("SELECT COUNT(*) FROM readings").fetchone()[0]
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM readings WHERE patient_id = ?", (patient_id,)
+            ).fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_reading_store():
+    """Shared store at settings.reading_db_path, opened on first use"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ReadingStore(get_settings().reading_db_path)
+    return _store
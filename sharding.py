@@ -0,0 +1,436 @@
+# sharding.py - Patients consistently hashed onto worker processes; a coordinator schedules and supervises them
+import bisect
+import hashlib
+import multiprocessing
+import os
+import sys
+import time
+from collections import Counter
+from functools import partial
+
+VNODES = 64  # ring points per worker - smooths the share each worker gets
+REPLY_TIMEOUT = 120.0
+HEALTH_TIMEOUT = 5.0
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.blake2b(str(key).encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hashing: adding or removing a worker only moves ~1/N of the patients"""
+
+    def __init__(self, nodes=(), vnodes=VNODES):
+        self.vnodes = vnodes
+        self._points = []  # sorted ring positions
+        self._owners = {}  # ring position -> node
+        for node in nodes:
+            self.add(node)
+
+    @property
+    def nodes(self):
+        return set(self._owners.values())
+
+    def add(self, node):
+        for i in range(self.vnodes):
+            point = _hash(f"{node}#{i}")
+            self._owners[point] = node
+            bisect.insort(self._points, point)
+
+    def remove(self, node):
+        self._points = [p for p in self._points if self._owners[p] != node]
+        self._owners = {p: self._owners[p] for p in self._points}
+
+    def owner(self, key):
+        if not self._points:
+            raise LookupError("Hash ring has no nodes")
+        i = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[self._points[i]]
+
+
+# Source factories - module-level so they can be pickled into spawned workers
+def default_source(patient_id):
+    """Nightscout where configured, synthetic otherwise (same rule as build_default_engine)"""
+    from config import get_settings
+    from readers import nightscout_source, synthetic_source
+    if patient_id in get_settings().nightscout_sites:
+        return nightscout_source(patient_id)
+    return synthetic_source(patient_id)
+
+
+def replay_source(patient_id, start, days):
+    """Deterministic synthetic series per patient, generated inside the worker"""
+    import numpy as np
+    from simulation import ReplaySource, synthetic_series
+    rng = np.random.default_rng(_hash(patient_id))
+    return ReplaySource(patient_id, *synthetic_series(rng, start, days))
+
+
+def _worker_main(conn, source_factory, simulated_start):
+    """Worker loop: owns its patients' sources, trend history and suppression state"""
+    import main
+    from alert_state import trend_tracker, alert_suppressor
+    from readers import PollingEngine
+
+    providers = None
+    clock = None
+    engine_clock = time.monotonic
+    if simulated_start is not None:
+        from clock import VirtualClock, set_clock
+        from simulation import StubProviders
+        clock = VirtualClock(simulated_start)
+        set_clock(clock)
+        engine_clock = clock.time
+        providers = StubProviders().as_providers()
+        sys.stdout = open(os.devnull, "w")
+    engine = PollingEngine(jitter=0.0, clock=engine_clock)
+
+    while True:
+        op, args = conn.recv()
+        try:
+            if op == "adopt":
+                patient_ids, state = args
+                trend_tracker.load_state(state.get("trend", {}))
+                alert_suppressor.load_state(state.get("suppression", {}))
+                for patient_id in patient_ids:
+                    engine.register(source_factory(patient_id))
+                reply = len(engine.sources)
+            elif op == "release":
+                patient_ids = set(args)
+                for key in [k for k in engine.sources if k[0] in patient_ids]:
+                    engine.unregister(*key)
+                reply = {
+                    "trend": trend_tracker.export_state(patient_ids, remove=True),
+                    "suppression": alert_suppressor.export_state(patient_ids, remove=True),
+                }
+            elif op == "command":
+                # An ACK/SNOOZE/CHECK reply for a patient this worker owns (inbound.apply_command)
+                patient_id, recipient_id, command, arg, at = args
+                if command == "check":
+                    reply = main.check_patient(patient_id, engine, providers)
+                else:
+                    from inbound import apply_command
+                    reply = apply_command(patient_id, recipient_id, command, arg, at)
+            elif op == "reload":
+                from config import settings_manager
+                reply = settings_manager.reload()
+            elif op == "check":
+                if args is not None and clock is not None:
+                    clock.set(args)
+                start = time.perf_counter()
+                outcomes = Counter()
+                for reading in engine.poll_once(force=True):
+                    outcomes[main.process_reading(reading, providers)] += 1
+                reply = {"outcomes": outcomes, "busy_s": time.perf_counter() - start}
+            elif op == "ping":
+                reply = {"pid": os.getpid(), "patients": len(engine.sources), **engine.stats}
+            elif op == "stop":
+                conn.send(("ok", None))
+                return
+            else:
+                raise ValueError(f"Unknown worker op: {op!r}")
+            conn.send(("ok", reply))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {str(e)[:200]}"))
+
+
+class _Worker:
+    def __init__(self, worker_id, process, conn):
+        self.worker_id = worker_id
+        self.process = process
+        self.conn = conn
+        self.last_seen = time.monotonic()
+
+
+class ShardCoordinator:
+    """Spawns workers, routes patients by consistent hash, rebalances, and replaces dead workers"""
+
+    def __init__(self, source_factory=default_source, simulated_start=None, reply_timeout=REPLY_TIMEOUT):
+        self.source_factory = source_factory
+        self.simulated_start = simulated_start
+        self.reply_timeout = reply_timeout
+        self.ring = HashRing()
+        self.workers = {}  # worker_id -> _Worker
+        self.owner = {}  # patient_id -> worker_id
+        self.stats = Counter()
+        self._ctx = multiprocessing.get_context("spawn")  # no forked locks/threads from the parent
+        self._next_id = 0
+
+    # --- worker lifecycle ---
+    def _spawn(self):
+        worker_id = f"w{self._next_id}"
+        self._next_id += 1
+        parent_conn, child_conn = self._ctx.Pipe()
+        process = self._ctx.Process(target=_worker_main, name=f"shard-{worker_id}", daemon=True,
+                                    args=(child_conn, self.source_factory, self.simulated_start))
+        process.start()
+        self.workers[worker_id] = _Worker(worker_id, process, parent_conn)
+        self.ring.add(worker_id)
+        return worker_id
+
+    def start(self, n_workers, patient_ids=()):
+        for _ in range(n_workers):
+            self._spawn()
+        self.add_patients(patient_ids)
+        return self
+
+    def _call(self, requests, timeout=None):
+        """Send {worker_id: (op, args)} to every worker first, then collect; failed workers are replaced"""
+        sent = []
+        for worker_id, message in requests.items():
+            try:
+                self.workers[worker_id].conn.send(message)
+                sent.append(worker_id)
+            except (OSError, EOFError):
+                self._fail(worker_id, "send failed")
+        deadline = time.monotonic() + (timeout or self.reply_timeout)
+        replies = {}
+        for worker_id in sent:
+            worker = self.workers.get(worker_id)
+            try:
+                if worker is None or not worker.conn.poll(max(0.0, deadline - time.monotonic())):
+                    raise TimeoutError("no reply")
+                status, reply = worker.conn.recv()
+            except (OSError, EOFError, TimeoutError) as e:
+                self._fail(worker_id, type(e).__name__)
+                continue
+            worker.last_seen = time.monotonic()
+            if status == "error":
+                self.stats["worker_errors"] += 1
+                print(f"❌ Worker {worker_id}: {reply}")
+                continue
+            replies[worker_id] = reply
+        return replies
+
+    def _fail(self, worker_id, reason):
+        """Drop a dead/hung worker and hand its patients to a replacement (their alert state is lost)"""
+        worker = self.workers.pop(worker_id, None)
+        if worker is None:
+            return
+        print(f"🚑 Worker {worker_id} failed ({reason}) - replacing it")
+        self.stats["worker_failures"] += 1
+        worker.process.kill()
+        self.ring.remove(worker_id)
+        for patient_id, owner in self.owner.items():
+            if owner == worker_id:
+                self.owner[patient_id] = None
+        self._spawn()
+        self._rebalance()
+
+    def _rebalance(self):
+        """Move every patient whose ring owner changed, carrying its state from the old owner"""
+        moves = {}  # patient_id -> (old worker or None, new worker)
+        for patient_id, old in self.owner.items():
+            new = self.ring.owner(patient_id)
+            if new != old:
+                moves[patient_id] = (old, new)
+        if not moves:
+            return 0
+
+        releases = {}
+        for patient_id, (old, _new) in moves.items():
+            if old in self.workers:
+                releases.setdefault(old, []).append(patient_id)
+        state = {"trend": {}, "suppression": {}}
+        for reply in self._call({w: ("release", ids) for w, ids in releases.items()}).values():
+            for part in state:
+                state[part].update(reply[part])
+
+        adoptions = {}  # new worker -> (patient ids, their carried state)
+        for patient_id, (_old, new) in moves.items():
+            ids, carried = adoptions.setdefault(new, ([], {"trend": {}, "suppression": {}}))
+            ids.append(patient_id)
+            for part in carried:
+                if patient_id in state[part]:
+                    carried[part][patient_id] = state[part][patient_id]
+        self._call({w: ("adopt", payload) for w, payload in adoptions.items()})
+        for patient_id, (_old, new) in moves.items():
+            self.owner[patient_id] = new
+        self.stats["moved"] += len(moves)
+        return len(moves)
+
+    def add_worker(self):
+        """Scale out by one worker; returns how many patients moved to it"""
+        self._spawn()
+        return self._rebalance()
+
+    def remove_worker(self, worker_id=None):
+        """Scale in: the worker hands its patients (and their state) to the rest before stopping"""
+        if len(self.workers) <= 1:
+            raise ValueError("Cannot remove the last worker")
+        worker_id = worker_id or next(reversed(self.workers))
+        self.ring.remove(worker_id)
+        moved = self._rebalance()
+        self._call({worker_id: ("stop", None)}, timeout=HEALTH_TIMEOUT)
+        worker = self.workers.pop(worker_id, None)
+        if worker is not None:
+            worker.process.join(HEALTH_TIMEOUT)
+        return moved
+
+    # --- patients ---
+    def add_patients(self, patient_ids):
+        for patient_id in patient_ids:
+            self.owner.setdefault(patient_id, None)
+        return self._rebalance()
+
+    def remove_patients(self, patient_ids):
+        releases = {}
+        for patient_id in patient_ids:
+            worker_id = self.owner.pop(patient_id, None)
+            if worker_id in self.workers:
+                releases.setdefault(worker_id, []).append(patient_id)
+        self._call({w: ("release", ids) for w, ids in releases.items()})
+
+    def set_patients(self, patient_ids):
+        """Match the sharded patients to `patient_ids` (after a settings reload); returns how many moved"""
+        patient_ids = set(patient_ids)
+        self.remove_patients([p for p in self.owner if p not in patient_ids])
+        return self.add_patients(patient_ids)
+
+    def command(self, patient_id, recipient_id, command, arg, at=None):
+        """inbound.apply_command for the sharded scheduler: check times are the coordinator's,
+        everything else runs in the worker holding the patient's alert state"""
+        if command == "schedule":
+            from main import add_check_time
+            return add_check_time(arg)
+        worker_id = self.owner.get(patient_id)
+        if worker_id not in self.workers:
+            self.stats["commands_unrouted"] += 1
+            print(f"⚠️ Stored {command} for unsharded patient {patient_id} ignored")
+            return None
+        self.stats["commands"] += 1
+        return self._call({worker_id: ("command", (patient_id, recipient_id, command, arg, at))}).get(worker_id)
+
+    def reload_settings(self):
+        """Have every worker re-read settings: SIGHUP and the file watcher only reach the coordinator"""
+        replies = self._call({w: ("reload", None) for w in self.workers}, timeout=HEALTH_TIMEOUT)
+        return sum(bool(ok) for ok in replies.values())
+
+    def assignments(self):
+        counts = Counter(self.owner.values())
+        return {worker_id: counts.get(worker_id, 0) for worker_id in self.workers}
+
+    # --- scheduling and health ---
+    def check(self, when=None):
+        """One scheduled check across all shards in parallel; returns combined outcomes"""
+        replies = self._call({w: ("check", when) for w in self.workers})
+        outcomes = Counter()
+        for reply in replies.values():
+            outcomes.update(reply["outcomes"])
+        self.stats["checks"] += 1
+        self.stats.update(outcomes)
+        return outcomes
+
+    def health(self):
+        """Ping every worker; dead or unresponsive ones are replaced"""
+        for worker_id, worker in list(self.workers.items()):
+            if not worker.process.is_alive():
+                self._fail(worker_id, f"exit code {worker.process.exitcode}")
+        replies = self._call({w: ("ping", None) for w in self.workers}, timeout=HEALTH_TIMEOUT)
+        return {
+            "workers": {w: replies.get(w, "unresponsive") for w in self.workers},
+            "assignments": self.assignments(),
+            **self.stats,
+        }
+
+    def stop(self):
+        self._call({w: ("stop", None) for w in self.workers}, timeout=HEALTH_TIMEOUT)
+        for worker in self.workers.values():
+            worker.process.join(HEALTH_TIMEOUT)
+            if worker.process.is_alive():
+                worker.process.kill()
+        self.workers.clear()
+
+
+def _patient_ids(settings):
+    return set(settings.nightscout_sites) | {settings.patient_id}
+
+
+def run_scheduler(n_workers):
+    """main.run_scheduler for SHARD_WORKERS > 1: same check times, checks fan out to worker processes.
+    Replies always come through the command store (the workers hold the alert state) and are routed
+    to the patient's worker; settings reloads and new patients are pushed to the workers."""
+    import schedule
+    import main
+    from config import get_settings, settings_manager
+    from inbound import apply_stored_commands
+
+    settings = get_settings()
+    settings_manager.watch()
+    patient_ids = _patient_ids(settings)
+    coordinator = ShardCoordinator().start(n_workers, patient_ids)
+    print(f"🧩 {len(patient_ids)} patients sharded over {n_workers} workers: {coordinator.assignments()}")
+
+    def schedule_check(t):
+        schedule.every().day.at(t).do(coordinator.check)
+
+    for t in main.CHECK_TIMES:
+        schedule_check(t)
+        print(f"⏰ Scheduled check at {t}")
+    main._scheduler["add"] = schedule_check  # SCHEDULE replies (main.add_check_time) land here
+    schedule.every(1).minutes.do(coordinator.health)
+    apply_stored_commands(apply=coordinator.command)  # restores check times added by earlier SCHEDULE replies
+
+    print("\n✅ Sharded scheduler started. Waiting for next check...")
+    try:
+        while True:
+            current = get_settings()
+            if current is not settings:
+                settings = current
+                reloaded = coordinator.reload_settings()
+                moved = coordinator.set_patients(_patient_ids(settings))
+                print(f"🧩 Settings pushed to {reloaded}/{len(coordinator.workers)} workers, {moved} patient(s) moved")
+            apply_stored_commands(apply=coordinator.command)
+            schedule.run_pending()
+            time.sleep(30)
+    finally:
+        main._scheduler.clear()
+        coordinator.stop()
+
+
+# 🔬 Scaling benchmark
+def _bench(n_patients, n_workers, days, every_minutes):
+    from datetime import datetime, timedelta
+    from simulation import check_times
+
+    start = datetime(2025, 1, 6)
+    coordinator = ShardCoordinator(partial(replay_source, start=start, days=days), simulated_start=start)
+    coordinator.start(n_workers, [f"p{i}" for i in range(n_patients)])
+    coordinator.check(start + timedelta(seconds=1))  # warm-up: imports, first-touch allocations
+    t0 = time.perf_counter()
+    readings = 0
+    for when in check_times(start + timedelta(minutes=1), days, every_minutes):
+        readings += sum(coordinator.check(when).values())
+    elapsed = time.perf_counter() - t0
+    return coordinator, readings, elapsed
+
+
+if __name__ == "__main__":
+    import argparse
+
+    cores = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description="Throughput vs worker count, plus a rebalance demo")
+    parser.add_argument("--patients", type=int, default=2000)
+    parser.add_argument("--days", type=int, default=1)
+    parser.add_argument("--every", type=int, default=30, metavar="MINUTES")
+    parser.add_argument("--max-workers", type=int, default=cores)
+    args = parser.parse_args()
+
+    counts = sorted({1, args.max_workers} | {2 ** i for i in range(1, 8) if 2 ** i < args.max_workers})
+    print(f"🧩 {args.patients} patients, {args.days} virtual day(s) every {args.every} min, {cores} core(s)")
+    baseline = None
+    for n in counts:
+        coordinator, readings, elapsed = _bench(args.patients, n, args.days, args.every)
+        rate = readings / elapsed
+        baseline = baseline or rate
+        print(f"   {n:>3} worker(s): {readings:,} readings in {elapsed:.2f}s → {rate:,.0f}/s "
+              f"(×{rate / baseline:.2f}, {rate / baseline / n:.0%} of linear) shares={sorted(coordinator.assignments().values())}")
+        if n == counts[-1]:
+            before = dict(coordinator.owner)
+            moved = coordinator.add_worker()
+            print(f"   + worker: {moved} of {args.patients} patients moved ({moved / args.patients:.0%}; ideal {1 / (n + 1):.0%})")
+            moved = coordinator.remove_worker()
+            unchanged = sum(before[p] == w for p, w in coordinator.owner.items())
+            print(f"   - worker: {moved} moved back; {unchanged}/{args.patients} patients on their original worker")
+            print(f"   health: {coordinator.health()['assignments']}")
+        coordinator.stop()
@@ -0,0 +1,181 @@
+# simulation.py - Replay the whole agent on a virtual clock with stubbed LLM and Twilio
+import bisect
+import contextlib
+import os
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+import numpy as np
+from clock import VirtualClock, set_clock, get_clock
+from readers import PollingEngine, SyncSource
+
+SENSOR_GAP_S = 15 * 60  # a reading older than this at check time counts as missing
+
+
+class ReplaySource(SyncSource):
+    """Serves the newest recorded reading at or before the (virtual) clock time"""
+
+    def __init__(self, patient_id, timestamps, values, **kwargs):
+        super().__init__(patient_id, "replay", self._latest, blocking=False, min_interval=0, **kwargs)
+        self.timestamps = list(timestamps)
+        self.values = list(values)
+
+    def _latest(self, _patient_id):
+        now = get_clock().time()
+        i = bisect.bisect_right(self.timestamps, now) - 1
+        if i < 0 or now - self.timestamps[i] > SENSOR_GAP_S:
+            return None
+        return {
+            "glucose": round(float(self.values[i]), 1),
+            "timestamp": datetime.fromtimestamp(self.timestamps[i]).isoformat(),
+            "trend": None,  # computed by the trend tracker from history
+        }
+
+
+def synthetic_series(rng, start, days, step_minutes=5):
+    """Circadian baseline + random walk + occasional meal spikes and lows"""
+    n = days * 1440 // step_minutes
+    minutes = np.arange(n) * step_minutes
+    circadian = 25 * np.sin(2 * np.pi * ((minutes / 60) % 24 - 9) / 24)
+    walk = np.cumsum(rng.normal(0, 2.0, n))
+    walk -= np.convolve(walk, np.ones(48) / 48, mode="same")  # keep the walk from drifting away
+    excursions = np.zeros(n)
+    for centre in rng.integers(0, n, days * 2):
+        width = int(rng.integers(6, 24))
+        excursions[centre:centre + width] += rng.choice([-60, 90])
+    values = np.clip(125 + circadian + walk + excursions, 40, 400)
+    timestamps = start.timestamp() + minutes * 60
+    return timestamps, values
+
+
+class StubProviders:
+    """Stands in for the LLM and Twilio; counts the calls that would have been made"""
+
+    def __init__(self):
+        from llm_advisor import LLMAdvisor
+        self._fallback = LLMAdvisor()._get_safety_fallback
+        self.calls = Counter()
+
+    def advice(self, glucose_level, trend="stable", context="", patient_id=None, kind=None):
+        self.calls["llm"] += 1
+        return self._fallback(glucose_level, kind=kind)
+
+    def whatsapp(self, glucose_level, timestamp, advice="", kind=None):
+        self.calls["whatsapp"] += 1
+        return {"success": True, "channel": "whatsapp", "sid": f"SIM{self.calls['whatsapp']:08d}", "status": "queued"}
+
+    def sms(self, glucose_level, timestamp, advice="", kind=None):
+        self.calls["sms"] += 1
+        return True, f"SIM{self.calls['sms']:05d}"
+
+    def as_providers(self):
+        return {"advice": self.advice, "whatsapp": self.whatsapp, "sms": self.sms}
+
+
+def check_times(start, days, every_minutes=None):
+    """Virtual check instants: the agent's daily schedule, or a fixed cadence"""
+    from main import CHECK_TIMES
+    if every_minutes:
+        step = timedelta(minutes=every_minutes)
+        t, end = start + step, start + timedelta(days=days)
+        while t < end:
+            yield t
+            t += step
+        return
+    for day in range(days):
+        for hhmm in CHECK_TIMES:
+            hours, minutes = map(int, hhmm.split(":"))
+            yield start + timedelta(days=day, hours=hours, minutes=minutes)
+
+
+def run_simulation(n_patients=1000, days=14, every_minutes=None, seed=1, series=None,
+                   start=datetime(2025, 1, 6)):
+    """Replay `days` of readings for many patients; returns a report dict"""
+    import main
+    from alert_state import alert_suppressor
+
+    clock = VirtualClock(start)
+    previous_clock = set_clock(clock)
+    stubs = StubProviders()
+    engine = PollingEngine(max_workers=8, max_concurrency=1024, jitter=0.0, clock=clock.time)
+
+    rng = np.random.default_rng(seed)
+    if series is None:
+        series = {f"sim{i}": synthetic_series(rng, start, days) for i in range(n_patients)}
+    for patient_id, (timestamps, values) in series.items():
+        engine.register(ReplaySource(patient_id, timestamps, values))
+
+    outcomes = Counter()
+    latencies_ms = []
+    detection_delay_s = []
+    suppressed_before = alert_suppressor.suppressed
+    wall_start = time.perf_counter()
+    try:
+        with open(os.devnull, "w") as quiet, contextlib.redirect_stdout(quiet):
+            for when in check_times(start, days, every_minutes):
+                clock.set(when)
+                for reading in engine.poll_once(force=True):
+                    t0 = time.perf_counter()
+                    outcome = main.process_reading(reading, stubs.as_providers())
+                    latencies_ms.append((time.perf_counter() - t0) * 1000)
+                    outcomes[outcome] += 1
+                    if outcome == "alerted":
+                        delay = clock.time() - datetime.fromisoformat(reading.data["timestamp"]).timestamp()
+                        detection_delay_s.append(delay)
+    finally:
+        set_clock(previous_clock)
+    wall_s = time.perf_counter() - wall_start
+
+    suppressed = alert_suppressor.suppressed - suppressed_before
+    latencies = np.array(latencies_ms or [0.0])
+    return {
+        "patients": len(series),
+        "virtual_days": days,
+        "wall_seconds": round(wall_s, 2),
+        "speedup": round(days * 86400 / wall_s) if wall_s else None,
+        "readings_processed": sum(outcomes.values()),
+        "outcomes": dict(outcomes),
+        "alerts_fired": outcomes["alerted"],
+        "alerts_suppressed": suppressed,
+        "processing_ms": {p: round(float(np.percentile(latencies, p)), 3) for p in (50, 95, 99)},
+        "detection_delay_s_p95": round(float(np.percentile(detection_delay_s, 95)), 1) if detection_delay_s else None,
+        "provider_calls_stubbed": dict(stubs.calls),
+        # Each suppressed repeat would have cost one LLM call and one WhatsApp message
+        "provider_calls_avoided": {"llm": suppressed, "whatsapp": suppressed},
+        "engine": {k: v for k, v in engine.stats.items()},
+    }
+
+
+def series_from_store(patient_ids):
+    """Recorded readings (e.g. from cgm_import.py) as replay series"""
+    from reading_store import get_reading_store
+    store = get_reading_store()
+    series = {}
+    for patient_id in patient_ids:
+        rows = store.readings(patient_id)
+        if rows:
+            series[patient_id] = ([ts for ts, _ in rows], [g for _, g in rows])
+    return series
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Run the agent at accelerated virtual time")
+    parser.add_argument("--patients", type=int, default=1000)
+    parser.add_argument("--days", type=int, default=14)
+    parser.add_argument("--every", type=int, metavar="MINUTES", help="check cadence instead of the daily schedule")
+    parser.add_argument("--replay", metavar="IDS", help="comma-separated patient ids to replay from the reading store")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    series = None
+    start = datetime(2025, 1, 6)
+    if args.replay:
+        series = series_from_store(args.replay.split(","))
+        first = min(ts[0] for ts, _ in series.values())
+        start = datetime.fromtimestamp(first).replace(hour=0, minute=0, second=0, microsecond=0)
+    print(f"🧪 Simulating {args.days} days for {len(series) if series else args.patients} patients...")
+    report = run_simulation(args.patients, args.days, args.every, args.seed, series, start)
+    print(json.dumps(report, indent=2))
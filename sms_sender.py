@@ -1,45 +1,54 @@
 # sms_sender.py - DEBUG VERSION
-from twilio.rest import Client
-from config import TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, TWILIO_PHONE_NUMBER, PATIENT_PHONE_NUMBER
+from config import get_settings
+from messages import render_alert, sms_segments
+from tracing import span
+from twilio_client import get_twilio_client
 import os
 
-def send_sms_alert(glucose_level, timestamp, advice=""):
-    """Send SMS alert with detailed debugging"""
-    try:
-        print("🔍 DEBUGGING TWILIO CREDENTIALS:")
-        print(f"   Account SID from config: {TWILIO_ACCOUNT_SID[:8]}...{TWILIO_ACCOUNT_SID[-4:]}")
-        print(f"   Auth Token from config: {TWILIO_AUTH_TOKEN[:4]}...{TWILIO_AUTH_TOKEN[-4:]}")
-        print(f"   From number: {TWILIO_PHONE_NUMBER}")
-        print(f"   To number: {PATIENT_PHONE_NUMBER}")
+def send_sms_alert(glucose_level, timestamp, advice="", to=None, locale=None, kind=None):
+    """Send SMS alert with detailed debugging (to the patient unless `to` is given)"""
+    with span("sms.send", glucose=glucose_level) as send_span:
+        try:
+            settings = get_settings()
+            to = to or settings.patient_phone_number
+            print("🔍 DEBUGGING TWILIO CREDENTIALS:")
+            print(f"   Account SID from config: {settings.twilio_account_sid[:8]}...{settings.twilio_account_sid[-4:]}")
+            print(f"   Auth Token from config: {settings.twilio_auth_token[:4]}...{settings.twilio_auth_token[-4:]}")
+            print(f"   From number: {settings.twilio_phone_number}")
+            print(f"   To number: {to}")
         
-        # Try to create client
-        print("🔧 CREATING TWILIO CLIENT...")
-        client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-        print("✅ TWILIO CLIENT CREATED SUCCESSFULLY")
+            # Try to create client
+            print("🔧 CREATING TWILIO CLIENT...")
+            client = get_twilio_client()  # pooled; twilio import deferred until first use
+            print("✅ TWILIO CLIENT CREATED SUCCESSFULLY")
         
-        # Lebanon-friendly message format
-        time_str = timestamp.split('T')[1][:5]
-        status = "LOW" if glucose_level < 70 else "HIGH" if glucose_level > 180 else "OK"
+            # Localized template; advice is cut at a word boundary to fit SMS_MAX_SEGMENTS
+            message_body = render_alert("sms", glucose_level, timestamp, advice, locale, kind=kind)
+            encoding, segments = sms_segments(message_body)
+            send_span.set_attribute("encoding", encoding)
+            send_span.set_attribute("segments", segments)
         
-        message_body = f"GLUCO TEST:{time_str}|{status}:{glucose_level}mg/dL:{advice[:30]}"
-        message_body = message_body[:140]  # Keep under 160 chars
+            print(f"📤 SENDING SMS TO {to}: {message_body}")
         
-        print(f"📤 SENDING SMS TO {PATIENT_PHONE_NUMBER}: {message_body}")
+            # Delivery receipts go to /webhooks/twilio/status (delivery.py) when configured
+            callback = {"status_callback": settings.status_callback_url} if settings.status_callback_url else {}
+            message = client.messages.create(
+                body=message_body,
+                from_=settings.twilio_phone_number,
+                to=to,
+                **callback
+            )
         
-        message = client.messages.create(
-            body=message_body,
-            from_=TWILIO_PHONE_NUMBER,
-            to=PATIENT_PHONE_NUMBER
-        )
-        
-        print(f"✅ SMS SENT SUCCESSFULLY (SID: {message.sid[:8]})")
-        return True, message.sid[:8]
+            print(f"✅ SMS SENT SUCCESSFULLY (SID: {message.sid[:8]})")
+            send_span.set_attribute("sid", message.sid[:8])
+            return True, message.sid  # full SID: the message ledger is keyed by it
     
-    except Exception as e:
-        error_type = type(e).__name__
-        print(f"❌ SMS FAILED: {error_type} - {str(e)}")
-        print("🔧 ENVIRONMENT VARIABLES IN RENDER:")
-        for key in ["TWILIO_ACCOUNT_SID", "TWILIO_AUTH_TOKEN", "TWILIO_PHONE_NUMBER", "PATIENT_PHONE_NUMBER"]:
-            value = os.environ.get(key)
-            print(f"   {key}: {'FOUND' if value else 'MISSING'}")
-        return False, f"{error_type}: {str(e)[:100]}"
\ No newline at end of file
+        except Exception as e:
+            send_span.record_error(e)
+            error_type = type(e).__name__
+            print(f"❌ SMS FAILED: {error_type} - {str(e)}")
+            print("🔧 ENVIRONMENT VARIABLES IN RENDER:")
+            for key in ["TWILIO_ACCOUNT_SID", "TWILIO_AUTH_TOKEN", "TWILIO_PHONE_NUMBER", "PATIENT_PHONE_NUMBER"]:
+                value = os.environ.get(key)
+                print(f"   {key}: {'FOUND' if value else 'MISSING'}")
+            return False, f"{error_type}: {str(e)[:100]}"
\ No newline at end of file
@@ -1,7 +1,7 @@
 # test_5_sms_with_llm.py
 from glucose_reader import read_glucose_level
 from llm_advisor import get_glucose_advice
-from sms_sender import send_glucose_alert
+from sms_sender import send_sms_alert
 import time
 
 print("🧠📲 Sending 5 SMS with LLM advice (one every 10 seconds)...\n")
@@ -21,7 +21,7 @@ for i in range(1, 6):
     )
     
     # 3. Send SMS with glucose + full LLM advice
-    result = send_glucose_alert(
+    result = send_sms_alert(
         glucose_level=glucose,
         timestamp=timestamp,
         advice=advice  # ← now includes AI advice
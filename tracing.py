@@ -0,0 +1,239 @@
+# tracing.py - Lightweight spans for the read → advise → send pipeline
+import json
+import os
+import threading
+import time
+import uuid
+import contextvars
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from config import get_settings
+
+# Span that is currently open in this thread / task
+_current_span = contextvars.ContextVar("gluco_current_span", default=None)
+
+# Finished children wait for their root; a root that never finishes must not hold them forever
+MAX_OPEN_TRACES = 1000  # oldest waiting trace is dropped beyond this
+MAX_SPANS_PER_TRACE = 500  # further children of one open trace are dropped
+
+
+class Span:
+    def __init__(self, name, trace_id, parent_id=None, attributes=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.errors = []
+        self.start_time = time.time()
+        self.end_time = None
+        self._start_counter = time.perf_counter()
+        self.duration_ms = None
+
+    def set_attribute(self, key, value):
+        """Attach a key/value pair to this span"""
+        self.attributes[key] = value
+
+    def record_error(self, error):
+        """Record an exception (or error string) without ending the span"""
+        if isinstance(error, BaseException):
+            self.errors.append({"type": type(error).__name__, "message": str(error)[:200]})
+        else:
+            self.errors.append({"type": "error", "message": str(error)[:200]})
+
+    def finish(self):
+        if self.end_time is None:
+            self.end_time = time.time()
+            self.duration_ms = (time.perf_counter() - self._start_counter) * 1000.0
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_time": self.start_time,
+            "end_time": self.end_time,
+            "duration_ms": self.duration_ms,
+            "attributes": self.attributes,
+            "errors": self.errors,
+        }
+
+
+class JsonFileExporter:
+    """Write each finished trace to <directory>/<trace_id>.json"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def export(self, trace):
+        path = os.path.join(self.directory, f"{trace['trace_id']}.json")
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(trace, f, ensure_ascii=False)
+        except OSError as e:
+            print(f"⚠️ Trace export failed: {e}")
+
+
+class Tracer:
+    def __init__(self, buffer_size=1000, exporter=None):
+        self.buffer = deque(maxlen=buffer_size)  # ring buffer of finished traces
+        self.exporter = exporter
+        self._open = OrderedDict()  # trace_id -> finished child spans awaiting the root, oldest first
+        self.dropped_spans = 0
+        self._lock = threading.Lock()
+
+    def configure(self, buffer_size=None, exporter=None):
+        """Resize the ring buffer and/or swap the exporter"""
+        with self._lock:
+            if buffer_size and buffer_size != self.buffer.maxlen:
+                self.buffer = deque(self.buffer, maxlen=buffer_size)
+            if exporter is not None:
+                self.exporter = exporter
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """Open a span as a child of the current one (or start a new trace)"""
+        parent = _current_span.get()
+        if parent is None:
+            current = Span(name, uuid.uuid4().hex, None, attributes)
+        else:
+            current = Span(name, parent.trace_id, parent.span_id, attributes)
+        token = _current_span.set(current)
+        try:
+            yield current
+        except BaseException as e:
+            current.record_error(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            current.finish()
+            self._on_finish(current)
+
+    def _on_finish(self, span):
+        if span.parent_id is not None:
+            with self._lock:
+                children = self._open.get(span.trace_id)
+                if children is None:
+                    children = self._open[span.trace_id] = []
+                    while len(self._open) > MAX_OPEN_TRACES:
+                        self.dropped_spans += len(self._open.popitem(last=False)[1])
+                if len(children) < MAX_SPANS_PER_TRACE:
+                    children.append(span)
+                else:
+                    self.dropped_spans += 1
+            return
+
+        with self._lock:
+            children = self._open.pop(span.trace_id, [])
+        spans = [span] + sorted(children, key=lambda s: s.start_time)
+        trace = {
+            "trace_id": span.trace_id,
+            "name": span.name,
+            "start_time": span.start_time,
+            "duration_ms": span.duration_ms,
+            "error": any(s.errors for s in spans),
+            "spans": [s.to_dict() for s in spans],
+        }
+        with self._lock:
+            self.buffer.append(trace)
+        if self.exporter:
+            self.exporter.export(trace)
+
+    def recent(self, limit=50):
+        """Most recent finished traces, newest first"""
+        with self._lock:
+            traces = list(self.buffer)
+        return traces[::-1][:limit]
+
+    def get_trace(self, trace_id):
+        with self._lock:
+            for trace in self.buffer:
+                if trace["trace_id"] == trace_id:
+                    return trace
+        return None
+
+    def slowest(self, percent=1.0, name=None):
+        """Slowest `percent`% of buffered traces (at least one), slowest first"""
+        with self._lock:
+            traces = [t for t in self.buffer if name is None or t["name"] == name]
+        if not traces:
+            return []
+        traces.sort(key=lambda t: t["duration_ms"], reverse=True)
+        count = max(1, int(len(traces) * percent / 100.0))
+        return traces[:count]
+
+
+def waterfall(trace):
+    """Flatten a trace into rows with offsets relative to the root span"""
+    root_start = trace["start_time"]
+    depth = {}
+    rows = []
+    for s in trace["spans"]:
+        level = 0 if s["parent_id"] is None else depth.get(s["parent_id"], 0) + 1
+        depth[s["span_id"]] = level
+        rows.append({
+            "name": s["name"],
+            "depth": level,
+            "offset_ms": round((s["start_time"] - root_start) * 1000.0, 2),
+            "duration_ms": round(s["duration_ms"] or 0.0, 2),
+            "attributes": s["attributes"],
+            "errors": s["errors"],
+        })
+    return {
+        "trace_id": trace["trace_id"],
+        "name": trace["name"],
+        "duration_ms": round(trace["duration_ms"] or 0.0, 2),
+        "spans": rows,
+    }
+
+
+# Global instance (sized from settings on first use, so importing stays cheap)
+tracer = Tracer()
+_configured = False
+
+
+def _configure_from_settings():
+    global _configured
+    settings = get_settings()
+    exporter = JsonFileExporter(settings.trace_export_dir) if settings.trace_export_dir else None
+    tracer.configure(settings.trace_buffer_size, exporter)
+    _configured = True
+
+
+def span(name, **attributes):
+    """Public interface: `with span("llm.get_advice", glucose=65) as s: ...`"""
+    if not _configured:
+        _configure_from_settings()
+    return tracer.span(name, **attributes)
+
+
+def current_span():
+    return _current_span.get()
+
+
+# 🔬 Test function
+if __name__ == "__main__":
+    print("🧵 Testing tracer...")
+    for i in range(200):
+        with span("check_and_alert", run=i):
+            with span("read_glucose_level"):
+                time.sleep(0.0001)
+            with span("llm.get_advice") as s:
+                s.set_attribute("attempts", 1)
+                time.sleep(0.0001 * (i % 7))
+
+    slow = tracer.slowest(percent=1)
+    print(f"📊 {len(tracer.buffer)} traces buffered, slowest 1% = {len(slow)} trace(s)")
+    print(json.dumps(waterfall(slow[0]), indent=2))
+
+    # Roots that never finish (a crash before __exit__) leave bounded state behind
+    for i in range(3 * MAX_OPEN_TRACES):
+        token = _current_span.set(Span("abandoned_root", uuid.uuid4().hex))
+        with span("child"):
+            pass
+        _current_span.reset(token)
+    print(f"🧹 {3 * MAX_OPEN_TRACES} abandoned roots: {len(tracer._open)} open traces kept, "
+          f"{tracer.dropped_spans} child spans dropped")
+    print("\n✅ Tracer test complete")
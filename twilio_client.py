@@ -0,0 +1,28 @@
+# twilio_client.py - One pooled Twilio REST client per credential set, shared by every sender
+import threading
+from config import get_settings
+
+POOL_SIZE = 64  # keep-alive connections to api.twilio.com (>= fan-out concurrency)
+REQUEST_TIMEOUT = 15.0
+
+_clients = {}  # (account_sid, auth_token) -> Client; new credentials after a reload get a new client
+_lock = threading.Lock()
+
+
+def get_twilio_client(pool_size=POOL_SIZE):
+    """Shared Client whose requests.Session reuses TLS connections across alerts and threads"""
+    settings = get_settings()
+    key = (settings.twilio_account_sid, settings.twilio_auth_token)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                from requests.adapters import HTTPAdapter
+                from twilio.http.http_client import TwilioHttpClient
+                from twilio.rest import Client  # deferred: heavy import, see warmup.py
+                http_client = TwilioHttpClient(pool_connections=True, timeout=REQUEST_TIMEOUT)
+                http_client.session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=pool_size))
+                client = Client(*key, http_client=http_client)
+                _clients[key] = client
+    return client
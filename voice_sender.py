@@ -0,0 +1,147 @@
+# voice_sender.py - Phone-call alerts (Twilio Programmable Voice, text-to-speech) for severe lows
+import threading
+import time
+from contextlib import contextmanager
+from html import escape
+from config import get_settings
+from messages import render_alert
+from tracing import span
+from twilio_client import get_twilio_client
+
+# <Say> language and voice per message locale
+VOICES = {
+    "en": ("en-US", "Polly.Joanna"),
+    "fr": ("fr-FR", "Polly.Lea"),
+    "ar": ("arb", "Polly.Zeina"),
+}
+SAY_REPEATS = 2  # the callee may miss the start of the message
+RING_SECONDS = 30  # unanswered after this -> "no-answer" status callback
+SLOT_TIMEOUT = 60.0  # waiting longer than this for a call slot fails the send
+_PAUSE = '<Pause length="1"/>'
+
+
+def build_twiml(text, locale="en", repeats=SAY_REPEATS):
+    language, voice = VOICES.get(locale, VOICES["en"])
+    say = f'<Say language="{language}" voice="{voice}">{escape(text)}</Say>'
+    return f'<?xml version="1.0" encoding="UTF-8"?><Response>{_PAUSE.join([say] * repeats)}</Response>'
+
+
+class CallLimiter:
+    """At most `concurrency` call requests in flight, started no faster than `per_second`
+    (Twilio queues calls beyond the account's CPS; pacing here keeps the first ones prompt)"""
+
+    def __init__(self, concurrency, per_second):
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._interval = 1.0 / per_second
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def slot(self, timeout=SLOT_TIMEOUT):
+        if not self._slots.acquire(timeout=timeout):
+            raise TimeoutError("no voice call slot available")
+        try:
+            with self._lock:
+                now = time.monotonic()
+                start = max(now, self._next)
+                self._next = start + self._interval
+            if start > now:
+                time.sleep(start - now)
+            yield
+        finally:
+            self._slots.release()
+
+
+_limiters = {}  # (concurrency, per_second) -> CallLimiter; new limits after a reload get a new limiter
+_limiters_lock = threading.Lock()
+
+
+def get_call_limiter():
+    settings = get_settings()
+    key = (settings.voice_concurrency, settings.voice_calls_per_second)
+    limiter = _limiters.get(key)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.setdefault(key, CallLimiter(*key))
+    return limiter
+
+
+def send_voice_alert(glucose_level, timestamp, advice="", to=None, locale=None, kind=None):
+    """Call the patient (or `to`) and read the alert and advice aloud.
+    Returns (success, call SID or error) like send_sms_alert."""
+    with span("voice.call", glucose=glucose_level) as call_span:
+        try:
+            settings = get_settings()
+            to = (to or settings.patient_phone_number).replace("whatsapp:", "")
+            locale = locale or settings.message_locale
+            twiml = build_twiml(render_alert("voice", glucose_level, timestamp, advice, locale, kind=kind), locale)
+            callback = {}
+            if settings.status_callback_url:
+                callback = {"status_callback": settings.status_callback_url,
+                            "status_callback_event": ["initiated", "ringing", "answered", "completed"]}
+
+            with get_call_limiter().slot():
+                print(f"📞 CALLING {to}")
+                call = get_twilio_client().calls.create(
+                    twiml=twiml,
+                    to=to,
+                    from_=settings.twilio_phone_number,
+                    timeout=RING_SECONDS,
+                    **callback
+                )
+
+            print(f"✅ VOICE CALL PLACED (SID: {call.sid[:8]})")
+            call_span.set_attribute("sid", call.sid[:8])
+            return True, call.sid
+
+        except Exception as e:
+            call_span.record_error(e)
+            error_type = type(e).__name__
+            print(f"❌ VOICE CALL FAILED: {error_type} - {str(e)}")
+            return False, f"{error_type}: {str(e)[:100]}"
+
+
+# 🔬 Benchmark: unacknowledged severe lows escalate to calls against a local Twilio stand-in
+if __name__ == "__main__":
+    import contextlib
+    import os
+    import sys
+    import tempfile
+    from datetime import datetime
+    from clock import VirtualClock, set_clock
+    from notifications import AlertFanout, CareGraph, DEFAULT_SENDERS, Recipient, start_stand_in_server
+
+    n_alerts = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    os.environ.update({"TWILIO_ACCOUNT_SID": "AC0", "TWILIO_AUTH_TOKEN": "stand-in", "TWILIO_PHONE_NUMBER": "+9610000000",
+                       "VOICE_CONCURRENCY": "4", "VOICE_CALLS_PER_SECOND": "10",
+                       "MESSAGE_LEDGER_PATH": os.path.join(tempfile.mkdtemp(), "ledger.db")})
+    server = start_stand_in_server(delay=0.2)  # call creation is slower than a message
+    get_twilio_client().api.base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    print(build_twiml(render_alert("voice", 48, "2025-01-06T03:10:00", "Drink juice now. 🧃", "en"), "en"))
+
+    graph = CareGraph()
+    senders = {channel: DEFAULT_SENDERS[channel] for channel in ("sms", "voice")}
+    fanout = AlertFanout(graph, senders, max_concurrency=16, escalation_minutes=5)
+    clock = VirtualClock(datetime(2025, 1, 6, 3, 0))
+    set_clock(clock)
+    for i in range(n_alerts):
+        graph.set_team(f"p{i}", [Recipient("patient", 0, phone=f"+96171{i:06d}", channels=("sms",)),
+                                 Recipient("parent", 1, phone=f"+96170{i:06d}", channels=("sms",))])
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        ids = [fanout.notify(f"p{i}", 45 if i % 2 else 62, "2025-01-06T03:00:00", "Take 15g fast carbs.")
+               for i in range(n_alerts)]
+        clock.advance(5 * 60 + 1)  # nobody acknowledged
+        start = time.perf_counter()
+        fanout.escalate_due()
+        fanout.wait_idle()
+        elapsed = time.perf_counter() - start
+    calls = server.counts["Calls"]
+    print(f"📞 {n_alerts} unacknowledged alerts ({n_alerts // 2} severe lows) escalated in {elapsed:.2f}s: "
+          f"{calls} calls at peak {server.peak['Calls']} concurrent (limit 4, 10/s), "
+          f"{server.counts['Messages']} SMS")
+    print(f"   {dict(fanout.stats)}")
+    print(f"   severe low: {[(d['recipient'], d['channel']) for d in fanout.status(ids[1])['deliveries']]}")
+    print(f"   mild low:   {[(d['recipient'], d['channel']) for d in fanout.status(ids[0])['deliveries']]}")
+    server.shutdown()
@@ -0,0 +1,105 @@
+# warmup.py - Deferred provider SDK imports, background warm-up and import-time profiling
+import importlib
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+
+# Provider SDKs that are imported on first use instead of at module load
+HEAVY_MODULES = [
+    "twilio.rest",
+    "langchain_core.prompts",
+    "langchain_openai",
+    "schedule",
+]
+
+# Cold start budget for `import web` + first GET / (Render free-plan health check)
+HEALTH_STARTUP_TARGET_MS = 800
+
+_warmup_thread = None
+warmup_timings = {}  # module -> seconds spent importing it in the background
+
+
+def _warm_up(modules):
+    for name in modules:
+        start = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            print(f"⚠️ Warm-up could not import {name}: {e}")
+            continue
+        warmup_timings[name] = time.perf_counter() - start
+    print(f"🔥 Warm-up done: {', '.join(f'{m} {t:.2f}s' for m, t in warmup_timings.items())}")
+
+
+def warm_up_in_background(modules=None):
+    """Import provider SDKs off the main thread so the first alert does not pay for them"""
+    global _warmup_thread
+    if _warmup_thread is None:
+        _warmup_thread = threading.Thread(
+            target=_warm_up, args=(modules or HEAVY_MODULES,), name="sdk-warmup", daemon=True
+        )
+        _warmup_thread.start()
+    return _warmup_thread
+
+
+_IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def import_time_report(statement="import web", top=25):
+    """Run `python -X importtime` in a fresh process and return the slowest imports"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=here, capture_output=True, text=True
+    )
+    rows = []
+    for line in proc.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            rows.append({
+                "module": module,
+                "self_ms": int(self_us) / 1000.0,
+                "cumulative_ms": int(cumulative_us) / 1000.0,
+                "depth": len(indent) // 2,
+            })
+    rows.sort(key=lambda r: r["cumulative_ms"], reverse=True)
+    return {"statement": statement, "ok": proc.returncode == 0, "imports": rows[:top],
+            "error": proc.stderr.strip().splitlines()[-1] if proc.returncode else ""}
+
+
+def measure_health_startup():
+    """Wall time (ms) for a fresh process to import web and answer GET /"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    code = (
+        "import time; t = time.perf_counter(); import web; "
+        "r = web.app.test_client().get('/'); "
+        "print(r.status_code, (time.perf_counter() - t) * 1000)"
+    )
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-c", code], cwd=here, capture_output=True, text=True)
+    total_ms = (time.perf_counter() - start) * 1000.0
+    if proc.returncode != 0:
+        return {"ok": False, "error": proc.stderr.strip().splitlines()[-1:]}
+    status, in_process_ms = proc.stdout.split()[-2:]
+    return {"ok": status == "200", "in_process_ms": float(in_process_ms), "process_ms": total_ms}
+
+
+# 🔬 Benchmark
+if __name__ == "__main__":
+    for statement in ("import web", "import main"):
+        report = import_time_report(statement)
+        print(f"\n📦 {statement} (python -X importtime, slowest cumulative imports)")
+        if not report["ok"]:
+            print(f"   ❌ {report['error']}")
+        for row in report["imports"]:
+            print(f"   {row['cumulative_ms']:9.1f} ms  {row['module']}")
+
+    startup = measure_health_startup()
+    print(f"\n⏱️ Health endpoint cold start: {startup}")
+    if startup["ok"]:
+        verdict = "✅" if startup["in_process_ms"] <= HEALTH_STARTUP_TARGET_MS else "❌"
+        print(f"{verdict} target {HEALTH_STARTUP_TARGET_MS} ms, measured {startup['in_process_ms']:.0f} ms")
@@ -1,7 +1,8 @@
 # web.py - FINAL WORKING VERSION FOR LEBANON
-from flask import Flask
+from flask import Flask, Response, request
 import os
-from twilio.rest import Client
+from tracing import tracer, waterfall
+from warmup import warm_up_in_background
 
 app = Flask(__name__)
 
@@ -12,7 +13,22 @@ def home():
         "lebanon_number": "+9613929206",
         "endpoints": {
             "sms": "/sms",
-            "whatsapp": "/whatsapp"
+            "whatsapp": "/whatsapp",
+            "traces": "/traces",
+            "slowest_traces": "/traces/slowest?percent=1",
+            "analytics": "/analytics/<patient_id>",
+            "advice_context": "/analytics/<patient_id>/summary",
+            "agp": "/agp/<patient_id>",
+            "agp_chart": "/agp/<patient_id>/svg",
+            "cluster": "/cluster",
+            "sms_segments": "/messages/stats",
+            "twilio_inbound": "POST /webhooks/twilio/inbound",
+            "twilio_status": "POST /webhooks/twilio/status",
+            "message": "/messages/<sid>",
+            "deliveries": "/deliveries/<patient_id>",
+            "llm_providers": "/llm/providers",
+            "llm_usage": "/llm/usage?day=YYYY-MM-DD",
+            "llm_usage_patient": "/llm/usage/<patient_id>"
         }
     }
 
@@ -26,6 +42,7 @@ def test_sms():
         to_number = "+9613929206"
         
         print(f"📤 SENDING SMS TO {to_number}")
+        from twilio.rest import Client  # deferred so GET / never pays for it
         
         client = Client(account_sid, auth_token)
         message = client.messages.create(
@@ -58,6 +75,7 @@ def test_whatsapp():
         patient_whatsapp = "whatsapp:+9613929206"
         
         print("📱 SENDING WHATSAPP TO LEBANON")
+        from twilio.rest import Client
         
         client = Client(account_sid, auth_token)
         message = client.messages.create(
@@ -80,8 +98,162 @@ def test_whatsapp():
             "solution": "1. Send 'join alpha-gluco' to +14155238886\n2. Wait 1 minute\n3. Retry this endpoint"
         }
 
+@app.route('/traces')
+def recent_traces():
+    """Most recent alert traces (summary only)"""
+    limit = request.args.get("limit", 50, type=int)
+    return {
+        "traces": [
+            {
+                "trace_id": t["trace_id"],
+                "name": t["name"],
+                "duration_ms": round(t["duration_ms"] or 0.0, 2),
+                "error": t["error"],
+                "spans": len(t["spans"])
+            }
+            for t in tracer.recent(limit)
+        ]
+    }
+
+@app.route('/traces/slowest')
+def slowest_traces():
+    """Waterfalls for the slowest N% of buffered traces"""
+    percent = request.args.get("percent", 1.0, type=float)
+    name = request.args.get("name", "check_and_alert")
+    return {
+        "percent": percent,
+        "waterfalls": [waterfall(t) for t in tracer.slowest(percent, name)]
+    }
+
+@app.route('/traces/<trace_id>')
+def trace_detail(trace_id):
+    """Waterfall for one trace"""
+    trace = tracer.get_trace(trace_id)
+    if trace is None:
+        return {"status": "❌ TRACE NOT FOUND", "trace_id": trace_id}, 404
+    return waterfall(trace)
+
+@app.route('/analytics/<patient_id>')
+def patient_analytics(patient_id):
+    """Time-in-range, CV and GMI over 24h/7d/14d/90d (or ?window=14d)"""
+    from analytics import glucose_analytics, WINDOWS  # deferred: numpy is not needed for GET /
+    window = request.args.get("window")
+    if window is None:
+        return {"patient_id": patient_id, "windows": glucose_analytics.report(patient_id)}
+    if window not in WINDOWS:
+        return {"status": "❌ UNKNOWN WINDOW", "windows": list(WINDOWS)}, 400
+    return {"patient_id": patient_id, **glucose_analytics.metrics(patient_id, window)}
+
+@app.route('/analytics/<patient_id>/summary')
+def patient_context_summary(patient_id):
+    """The patient history line added to LLM prompts (or ?tokens=N for another budget)"""
+    from patient_context import context_assembler
+    tokens = request.args.get("tokens", type=int)
+    return {"patient_id": patient_id, "summary": context_assembler.summary(patient_id, tokens),
+            "stats": context_assembler.stats}
+
+@app.route('/agp/<patient_id>')
+def agp_report(patient_id):
+    """14-day AGP percentiles (5/25/50/75/95) by time of day"""
+    from agp import agp_reporter
+    return agp_reporter.report(patient_id)
+
+@app.route('/agp/<patient_id>/svg')
+def agp_chart(patient_id):
+    """14-day AGP chart, rendered server-side and cached until new data arrives"""
+    from agp import agp_reporter
+    return Response(agp_reporter.render_svg(patient_id), mimetype="image/svg+xml")
+
+def _public_url():
+    """URL as Twilio signed it - Render terminates TLS, so trust X-Forwarded-Proto/Host"""
+    proto = request.headers.get("X-Forwarded-Proto", request.scheme).split(",")[0].strip()
+    host = request.headers.get("X-Forwarded-Host", request.host).split(",")[0].strip()
+    query = f"?{request.query_string.decode()}" if request.query_string else ""
+    return f"{proto}://{host}{request.path}{query}"
+
+@app.route('/webhooks/twilio/inbound', methods=['POST'])
+def twilio_inbound():
+    """SMS/WhatsApp replies: OK/ACK, SNOOZE 30, CHECK NOW, SCHEDULE 08:00 (queued, answered with TwiML)"""
+    from inbound import accept_inbound
+    body, status = accept_inbound(_public_url(), request.form.to_dict(), request.headers.get("X-Twilio-Signature", ""))
+    return Response(body, status=status, mimetype="text/xml")
+
+@app.route('/webhooks/twilio/status', methods=['POST'])
+def twilio_status():
+    """Delivery receipts (queued/sent/delivered/read/failed) for the message ledger"""
+    from delivery import accept_status
+    status = accept_status(_public_url(), request.form.to_dict(), request.headers.get("X-Twilio-Signature", ""))
+    return Response(status=status)
+
+@app.route('/deliveries/<patient_id>')
+def patient_deliveries(patient_id):
+    """Newest messages sent for a patient with their delivery timeline"""
+    from delivery import delivery_tracker
+    limit = min(request.args.get("limit", 50, type=int), 500)
+    return {"patient_id": patient_id, "messages": delivery_tracker.ledger.for_patient(patient_id, limit),
+            "stats": dict(delivery_tracker.stats)}
+
+@app.route('/messages/stats')
+def message_stats():
+    """SMS segments billed per alert and which compaction steps were needed"""
+    from messages import message_renderer
+    return message_renderer.sms_report()
+
+@app.route('/messages/<sid>')
+def message_status(sid):
+    """One message's ledger row (status transitions, error code, fallback SID)"""
+    from delivery import delivery_tracker
+    row = delivery_tracker.ledger.get(sid)
+    if row is None:
+        return {"error": "unknown message SID"}, 404
+    return row
+
+@app.route('/llm/providers')
+def llm_providers():
+    """Per-provider EWMA latency, error rate and cooldown, plus hedging/failover counts"""
+    from llm_router import llm_router
+    return llm_router.status()
+
+@app.route('/llm/usage')
+def llm_usage():
+    """Tokens and cost for a day (default today) by patient and model, with budget state"""
+    from llm_usage import get_usage_ledger
+    return get_usage_ledger().report(request.args.get("day"))
+
+@app.route('/llm/usage/<patient_id>')
+def llm_usage_patient(patient_id):
+    """One patient's daily token/cost history"""
+    from llm_usage import get_usage_ledger
+    days = min(request.args.get("days", 30, type=int), 366)
+    return {"patient_id": patient_id, "days": get_usage_ledger().patient_history(patient_id, days)}
+
+@app.route('/cluster')
+def cluster_status():
+    """Leader, nodes and partition leases from the shared store (CLUSTER_DB mode); read-only, the web
+    process does not join the cluster"""
+    import sqlite3
+    from cluster import cluster_view
+    try:
+        view = cluster_view()
+    except sqlite3.Error as e:
+        return {"cluster": True, "error": f"cluster store unavailable: {e}"}, 503
+    if view is None:
+        return {"status": "single instance", "cluster": False}
+    return {"cluster": True, **view}
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 10000))
     print("🚀 GLUCOALERT AI - LEBANON WORKING VERSION 🚀")
     print(f"🌍 Running on port {port}")
+    warm_up_in_background(["twilio.rest"])
+    from config import get_settings
+    if get_settings().embedded_scheduler:
+        # Same process as the webhooks, so ACK/snooze replies reach the alert suppressor
+        import threading
+        from main import run_scheduler
+        threading.Thread(target=run_scheduler, name="scheduler", daemon=True).start()
+    else:
+        # The scheduler process resumes them too; claiming a due row is atomic in the shared ledger
+        from delivery import resume_deliveries
+        resume_deliveries()
     app.run(host="0.0.0.0", port=port)
\ No newline at end of file